@@ -14,13 +14,15 @@ import logging
 import sys
 import ctypes as C
 
-from multiprocessing import Process, Queue
 import time
+from collections import OrderedDict
 
 import matplotlib.pylab as plt
 
 from library_constants import *
 from library_general import *
+from library_opacity import *
+from library_mpi import *
 
 try:
     import library_cythonised_functions as cy_fun
@@ -32,6 +34,16 @@ cythonised = False
 
 class atmosphere(object):
 
+    # attributes that depend on the wavenumber grid, kept in memory for each grid (see load_opacity_arrays)
+    opacity_set_attributes = ['int_nwngrid', 'int_wngrid', 'int_wngrid_idxmin', 'int_wngrid_idxmax',
+                              'int_wngrid_select', 'int_wlgrid', 'int_nwlgrid',
+                              'int_bingrid', 'int_bingrididx', 'int_nbingrid', 'int_binning',
+                              'star_sed', 'sigma_array', 'sigma_array_flat',
+                              'ktables_array', 'ktables_array_flat',
+                              'sigma_temp', 'sigma_rayleigh_array', 'sigma_rayleigh_array_flat',
+                              'sigma_cia_array', 'sigma_cia_array_flat', 'cia_idx',
+                              'opacity_slabs', 'opacity_temp_window', 'opacity_slab_brackets']
+
     def __init__(self, data, tp_profile_type=None, covariance=None, nthreads=1):
 
         logging.info('Initialising atmosphere object')
@@ -42,6 +54,10 @@ class atmosphere(object):
 
         self.data = data
 
+        # wait for the shared libraries, compiled in the background when prefetching the input data
+        if self.params.gen_compile_cpp:
+            self.data.wait_prefetch('shared_libs_compiled')
+
         # set planet radius, mass, gravity
         self.planet_radius = self.params.planet_radius
         self.planet_mass = self.params.planet_mass
@@ -100,8 +116,25 @@ class atmosphere(object):
             self.hybrid_covmat = covariance
             self.get_TP_sample_grid(covariance, delta=0.05)
 
-        # load opacity arrays for the appropriate wavenumber grid (gas, rayleigh, cia)
+        # persistent cache of the opacity arrays interpolated to the pressure profile (created by the data class)
+        self.opacity_cache = self.data.opacity_cache
+
+        # lazy temperature mode: the temperature slabs of the cross sections / ktables are interpolated to the
+        # pressure profile only when a layer temperature first falls in their bracket (see set_opacity_temperature_window)
+        self.lazy_temperature = self.params.in_lazy_temperature
+        self.opacity_slabs_touched = set()
+
+        # cia arrays of the wavenumber ranges loaded so far. They do not depend on the atmospheric profiles, so they
+        # are reused when switching between grids
+        self.sigma_cia_arrays = {}
+
+        # node communicator used to share the opacity arrays between the processes of a node (see gen_mpi_shared_opacity)
+        self.shared_comm = self.data.shared_comm
+
+        # load opacity arrays for the appropriate wavenumber grid (gas, rayleigh, cia). The arrays of the last
+        # in_opacity_grids grids are kept in memory
         self.opacity_wngrid = ''
+        self.opacity_sets = OrderedDict()
         if self.params.mode == 'retrieval':
             self.load_opacity_arrays(wngrid='obs_spectrum', nthreads=nthreads)
         else:
@@ -110,6 +143,10 @@ class atmosphere(object):
             else:
                 self.load_opacity_arrays(wngrid='native', nthreads=nthreads)
 
+        # grids loaded later (e.g. the extended grid of the output, computed by the master process only) are not
+        # shared: loading them is not a collective operation
+        self.shared_comm = None
+
         # initialise ACE specific parameters
         if self.params.gen_ace:
 
@@ -197,73 +234,113 @@ class atmosphere(object):
 
             logging.info('Loading opacity arrays for grid `%s`' % wngrid)
 
-            self.opacity_wngrid = wngrid
-
-            # select the wavenumber grid. The grids are defined in the data class, function load_wavenumber_grid
-            if wngrid == 'obs_spectrum':
-                self.int_nwngrid = self.data.int_nwngrid_obs
-                self.int_wngrid = self.data.int_wngrid_obs
-                self.int_wngrid_idxmin = self.data.int_wngrid_obs_idxmin
-                self.int_wngrid_idxmax = self.data.int_wngrid_obs_idxmax
-
-            elif wngrid == 'native':
-                self.int_nwngrid = self.data.int_nwngrid_native
-                self.int_wngrid = self.data.int_wngrid_native
-                self.int_wngrid_idxmin = 0
-                self.int_wngrid_idxmax = self.data.int_nwngrid_native
-
-            elif wngrid == 'manual':
-                self.int_nwngrid = self.data.int_nwngrid_manual
-                self.int_wngrid = self.data.int_wngrid_manual
-                self.int_wngrid_idxmin = self.data.int_wngrid_manual_idxmin
-                self.int_wngrid_idxmax = self.data.int_wngrid_manual_idxmax
-
-            elif wngrid == 'extended':
-                self.int_nwngrid = self.data.int_nwngrid_extended
-                self.int_wngrid = self.data.int_wngrid_extended
-                self.int_wngrid_idxmin = self.data.int_wngrid_extended_idxmin
-                self.int_wngrid_idxmax = self.data.int_wngrid_extended_idxmax
-            else:
+            # keep the arrays of the current grid in memory, so that switching back to it is immediate
+            if self.opacity_wngrid:
+                self.opacity_sets[self.opacity_wngrid] = self.get_opacity_set()
 
-                logging.error('Cannot load the opacity arrays for grid `%s`' % wngrid)
-                exit()
-
-            self.int_wlgrid = 10000./self.int_wngrid
-            self.int_nwlgrid = self.int_nwngrid
-
-
-            if self.params.mode == 'retrieval':
-                # get bins and indexes for spectrum binning (used only if opacity method is xsec, not used for ktables)
-                self.int_bingrid, self.int_bingrididx = get_specbingrid(self.data.obs_wlgrid,
-                                                                         self.int_wlgrid,
-                                                                         self.data.obs_binwidths)
-                self.int_nbingrid = len(self.data.obs_binwidths)
-
-            # load SED array for emission
-            if self.params.gen_type.upper() == 'EMISSION':
-                self.star_sed =  self.data.star_sed_native[self.int_wngrid_idxmin:self.int_wngrid_idxmax]
-
-            # load arrays (interpolate to pressure profile and restrict wavenumber range to selected wngrid)
-
-            if self.params.in_opacity_method in ['xsec_lowres', 'xsec_highres', 'xsec_sampled', 'xsec']:
-                # get sigma array (and interpolate sigma array to pressure profile)
-                self.sigma_array = self.get_sigma_array(nthreads=nthreads)
-                self.sigma_array_flat = self.sigma_array.flatten()
-            elif self.params.in_opacity_method in ['ktab', 'ktable', 'ktables']:
-                # get sigma array (and interpolate sigma array to pressure profile)
-                self.ktables_array = self.get_ktables_array(nthreads=nthreads)
-                self.ktables_array_flat = self.ktables_array.flatten()
+            if wngrid in self.opacity_sets:
 
-            # get sigma rayleigh array (for active and inactive absorbers)
-            self.sigma_rayleigh_array = self.get_sigma_rayleigh_array()
-            self.sigma_rayleigh_array_flat = self.sigma_rayleigh_array.flatten()
+                logging.info('Opacity arrays for grid `%s` already in memory' % wngrid)
+                self.__dict__.update(self.opacity_sets.pop(wngrid))
+                self.opacity_wngrid = wngrid
 
-            # get collision induced absorption cross sections
-            self.sigma_cia_array = self.get_sigma_cia_array()
-            self.sigma_cia_array_flat = self.sigma_cia_array.flatten()
+            else:
 
-            # get the gas indexes of the molecules inside the pairs
-            self.cia_idx = self.get_cia_idx()
+                self.opacity_wngrid = wngrid
+
+                # select the wavenumber grid. The grids are defined in the data class, function load_wavenumber_grid
+                if wngrid == 'obs_spectrum':
+                    self.int_nwngrid = self.data.int_nwngrid_obs
+                    self.int_wngrid = self.data.int_wngrid_obs
+                    self.int_wngrid_idxmin = self.data.int_wngrid_obs_idxmin
+                    self.int_wngrid_idxmax = self.data.int_wngrid_obs_idxmax
+
+                elif wngrid == 'native':
+                    self.int_nwngrid = self.data.int_nwngrid_native
+                    self.int_wngrid = self.data.int_wngrid_native
+                    self.int_wngrid_idxmin = 0
+                    self.int_wngrid_idxmax = self.data.int_nwngrid_native
+
+                elif wngrid == 'manual':
+                    self.int_nwngrid = self.data.int_nwngrid_manual
+                    self.int_wngrid = self.data.int_wngrid_manual
+                    self.int_wngrid_idxmin = self.data.int_wngrid_manual_idxmin
+                    self.int_wngrid_idxmax = self.data.int_wngrid_manual_idxmax
+
+                elif wngrid == 'extended':
+                    self.int_nwngrid = self.data.int_nwngrid_extended
+                    self.int_wngrid = self.data.int_wngrid_extended
+                    self.int_wngrid_idxmin = self.data.int_wngrid_extended_idxmin
+                    self.int_wngrid_idxmax = self.data.int_wngrid_extended_idxmax
+                else:
+
+                    logging.error('Cannot load the opacity arrays for grid `%s`' % wngrid)
+                    exit()
+
+                # wavenumbers of the native grid used by the grid: a slice, or the indexes of the wavenumbers kept by
+                # the wavenumber culling. Used to cut all the opacity arrays
+                self.int_wngrid_select = slice(self.int_wngrid_idxmin, self.int_wngrid_idxmax)
+
+                self.int_wlgrid = 10000./self.int_wngrid
+                self.int_nwlgrid = self.int_nwngrid
+
+
+                if self.params.mode == 'retrieval':
+                    # get bins and indexes for spectrum binning (used only if opacity method is xsec, not used for ktables)
+                    self.int_bingrid, self.int_bingrididx = get_specbingrid(self.data.obs_wlgrid,
+                                                                             self.int_wlgrid,
+                                                                             self.data.obs_binwidths)
+                    self.int_nbingrid = len(self.data.obs_binwidths)
+                    self.int_binning = binning_operator.from_bingrid_idx(self.int_bingrididx, self.int_nbingrid)
+
+                    # only if the model is binned to the observations (cross sections). With ktables the model is
+                    # interpolated to the observed wavenumbers (see fitting.chisq_trans), which needs the grid points
+                    # around them, inside the bins or not
+                    if wngrid == 'obs_spectrum' and self.params.in_wavenumber_culling and \
+                            self.params.in_opacity_method in ['xsec_sampled', 'xsec_lowres', 'xsec']:
+                        self.cull_wavenumber_grid()
+
+                # load SED array for emission
+                if self.params.gen_type.upper() == 'EMISSION':
+                    self.star_sed =  self.data.star_sed_native[self.int_wngrid_select]
+
+                # load arrays (interpolate to pressure profile and restrict wavenumber range to selected wngrid).
+                # If the wavenumber range is contained in the range of a grid kept in memory, the arrays of that grid
+                # are simply cut. With a node communicator, only the first process of the node computes the arrays,
+                # which are then shared with the other processes of the node
+                opacity_arrays = self.get_nested_opacity_arrays()
+                if opacity_arrays is None:
+                    if self.shared_comm is None or self.shared_comm.Get_rank() == 0:
+                        opacity_arrays = self.get_opacity_arrays(nthreads=nthreads)
+                    else:
+                        opacity_arrays = None
+                    if self.shared_comm is not None:
+                        opacity_arrays = share_dict(self.shared_comm, opacity_arrays)
+                for name, array in opacity_arrays.items():
+                    setattr(self, name, array)
+
+                # flat arrays passed to the cpp code (views, the arrays are already contiguous), and their temperatures.
+                # In lazy temperature mode the gas arrays are built before each model (set_opacity_temperature_window)
+                if self.lazy_temperature:
+                    self.opacity_slabs = OrderedDict()
+                    self.opacity_temp_window = None
+                    self.opacity_slab_brackets = [get_interp_bracket(pressure_val, self.get_opacity_dict()['p'])
+                                                  for pressure_val in self.pressure_profile/1e5]
+                else:
+                    self.sigma_temp = np.asarray(self.get_opacity_dict()['t'], dtype=np.float64)
+                    if self.params.in_opacity_method in ['xsec_lowres', 'xsec_highres', 'xsec_sampled', 'xsec']:
+                        self.sigma_array_flat = self.sigma_array.ravel()
+                    elif self.params.in_opacity_method in ['ktab', 'ktable', 'ktables']:
+                        self.ktables_array_flat = self.ktables_array.ravel()
+                self.sigma_rayleigh_array_flat = self.sigma_rayleigh_array.ravel()
+                self.sigma_cia_array_flat = self.sigma_cia_array.ravel()
+
+                # get the gas indexes of the molecules inside the pairs
+                self.cia_idx = self.get_cia_idx()
+
+            # drop the least recently used grids
+            while len(self.opacity_sets) > max(self.params.in_opacity_grids - 1, 0):
+                self.opacity_sets.popitem(last=False)
 
             # get clouds specific parameters
             self.clouds_pressure = self.params.atm_clouds_pressure
@@ -286,6 +363,201 @@ class atmosphere(object):
         else:
             logging.info('Opacity for grid `%s` already loaded' % wngrid)
 
+    def cull_wavenumber_grid(self):
+
+        # keep only the wavenumbers falling inside a bin of the observed spectrum. The wavenumbers in the gaps between
+        # the bins (e.g. between instruments) are not used by the binning, so they are not computed at all. The
+        # binning of the culled grid is the same as the binning of the full grid
+
+        inside = self.int_binning.bin_idx >= 0
+        if np.all(inside):
+            return
+
+        logging.info('Wavenumber culling: %i of %i wavenumbers inside the bins of the observed spectrum' %
+                     (np.sum(inside), self.int_nwngrid))
+
+        self.int_wngrid_select = self.int_wngrid_idxmin + np.where(inside)[0]
+        self.int_wngrid = self.int_wngrid[inside]
+        self.int_nwngrid = len(self.int_wngrid)
+        self.int_wlgrid = self.int_wlgrid[inside]
+        self.int_nwlgrid = self.int_nwngrid
+        self.int_bingrididx = np.asarray(self.int_bingrididx)[inside]
+        self.int_binning = binning_operator.from_bingrid_idx(self.int_bingrididx, self.int_nbingrid)
+
+    def get_wngrid_indexes(self, wngrid_select):
+
+        # indexes in the native grid of the wavenumbers selected by int_wngrid_select
+        return np.arange(self.data.int_nwngrid_native)[wngrid_select]
+
+    def get_opacity_set(self):
+
+        # all the arrays that depend on the wavenumber grid (see load_opacity_arrays)
+        return dict((name, self.__dict__[name]) for name in self.opacity_set_attributes if name in self.__dict__)
+
+    def get_nested_opacity_arrays(self):
+
+        # opacity arrays of the current wavenumber range, cut from a grid kept in memory whose range contains it
+        # (no pressure interpolation). None if there is no such grid, or in lazy temperature mode
+
+        if self.lazy_temperature:
+            return None
+
+        # grids in memory containing all the wavenumbers of the current grid, and position of these wavenumbers
+        wngrid_idx = self.get_wngrid_indexes(self.int_wngrid_select)
+        opacity_sets = []
+        for opacity_set in self.opacity_sets.values():
+            if opacity_set['int_wngrid_idxmin'] <= self.int_wngrid_idxmin and \
+                    opacity_set['int_wngrid_idxmax'] >= self.int_wngrid_idxmax:
+                set_wngrid_idx = self.get_wngrid_indexes(opacity_set['int_wngrid_select'])
+                wn_pos = np.minimum(np.searchsorted(set_wngrid_idx, wngrid_idx), len(set_wngrid_idx)-1)
+                if np.array_equal(set_wngrid_idx[wn_pos], wngrid_idx):
+                    opacity_sets.append((opacity_set, wn_pos))
+        if len(opacity_sets) == 0:
+            return None
+        opacity_set, wn_pos = min(opacity_sets, key=lambda nested: nested[0]['int_nwngrid'])
+
+        logging.info('Cut opacity arrays from a grid in memory')
+        opacity_arrays = {}
+        for name in ['sigma_array', 'sigma_rayleigh_array', 'sigma_cia_array']:
+            if name in opacity_set:
+                opacity_arrays[name] = np.ascontiguousarray(opacity_set[name][...,wn_pos])
+        if 'ktables_array' in opacity_set:
+            opacity_arrays['ktables_array'] = np.ascontiguousarray(opacity_set['ktables_array'][...,wn_pos,:])
+        return opacity_arrays
+
+    def get_opacity_arrays(self, nthreads=1):
+
+        # return the opacity arrays for the current wavenumber grid: sigma_array or ktables_array,
+        # sigma_rayleigh_array and sigma_cia_array
+
+        # try the persistent opacity cache first (arrays are memory mapped from the cache entry). Not used in lazy
+        # temperature mode, where only rayleigh and cia are computed here
+        use_cache = self.opacity_cache and not self.lazy_temperature
+        if use_cache:
+            cache_key = self.get_opacity_cache_key()
+            cached = self.opacity_cache.load(cache_key)
+            if cached:
+                return dict((name, array) for name, array in cached.items() if name.endswith('_array'))
+
+        opacity_arrays = {}
+        if not self.lazy_temperature:
+            if self.params.in_opacity_method in ['xsec_lowres', 'xsec_highres', 'xsec_sampled', 'xsec']:
+                # get sigma array (and interpolate sigma array to pressure profile)
+                opacity_arrays['sigma_array'] = self.get_sigma_array(nthreads=nthreads)
+            elif self.params.in_opacity_method in ['ktab', 'ktable', 'ktables']:
+                # get sigma array (and interpolate sigma array to pressure profile)
+                opacity_arrays['ktables_array'] = self.get_ktables_array(nthreads=nthreads)
+
+        # get sigma rayleigh array (for active and inactive absorbers)
+        opacity_arrays['sigma_rayleigh_array'] = self.get_sigma_rayleigh_array()
+
+        # get collision induced absorption cross sections
+        opacity_arrays['sigma_cia_array'] = self.get_sigma_cia_array()
+
+        if use_cache:
+            self.opacity_cache.save(cache_key, opacity_arrays, {'grid': self.opacity_wngrid, 'units': 'm^2'})
+
+        return opacity_arrays
+
+    def get_opacity_dict(self):
+
+        # cross sections or ktables dictionary of the data class
+        if self.params.in_opacity_method in ['ktab', 'ktable', 'ktables']:
+            return self.data.ktable_dict
+        return self.data.sigma_dict
+
+    def set_opacity_temperature_window(self):
+
+        # lazy temperature mode: build the opacity arrays passed to the cpp code from the temperature slabs
+        # bracketing the layers of the current temperature profile. The cpp code takes the first/last temperature
+        # outside the grid, so a contiguous window containing all the brackets gives the same result as the full grid.
+
+        if not self.lazy_temperature:
+            return
+
+        temp = np.asarray(self.get_opacity_dict()['t'], dtype=np.float64)
+        idx = np.searchsorted(temp, self.temperature_profile, side='right')
+        tmin_idx = max(int(np.min(idx)) - 1, 0)
+        tmax_idx = min(int(np.max(idx)), len(temp) - 1)
+
+        window = self.opacity_temp_window
+        if window and tmin_idx >= window[0] and tmax_idx <= window[1]:
+            return
+
+        # grow the current window if possible, so that small changes of the profile do not rebuild the arrays
+        if window and max(tmax_idx, window[1]) - min(tmin_idx, window[0]) + 1 <= self.params.in_lazy_temperature_slabs:
+            tmin_idx, tmax_idx = min(tmin_idx, window[0]), max(tmax_idx, window[1])
+
+        opacity_array = np.stack([self.get_opacity_slab(t_idx) for t_idx in range(tmin_idx, tmax_idx+1)], axis=2)
+
+        # bounded slab cache: drop the least recently used slabs (those of the window were just used)
+        while len(self.opacity_slabs) > max(self.params.in_lazy_temperature_slabs, tmax_idx-tmin_idx+1):
+            self.opacity_slabs.popitem(last=False)
+
+        if self.params.in_opacity_method in ['ktab', 'ktable', 'ktables']:
+            self.ktables_array = opacity_array
+            self.ktables_array_flat = self.ktables_array.ravel()
+        else:
+            self.sigma_array = opacity_array
+            self.sigma_array_flat = self.sigma_array.ravel()
+        self.sigma_temp = np.ascontiguousarray(temp[tmin_idx:tmax_idx+1])
+        self.opacity_temp_window = (tmin_idx, tmax_idx)
+
+    def get_opacity_slab(self, t_idx):
+
+        # cross sections (gas, layer, wavenumber) or ktables (gas, layer, wavenumber, gauss point) at the t_idx-th
+        # temperature, interpolated to the pressure profile (same interpolation as get_sigma_array/get_ktables_array)
+
+        if t_idx in self.opacity_slabs:
+            slab = self.opacity_slabs.pop(t_idx)
+        else:
+            if self.params.in_opacity_method in ['ktab', 'ktable', 'ktables']:
+                opacity_in = self.data.ktable_dict['kcoeff']
+                shape = (self.int_nwngrid, len(self.data.ktable_dict['weights']))
+            else:
+                opacity_in = self.data.sigma_dict['xsecarr']
+                shape = (self.int_nwngrid,)
+            slab = np.zeros((self.nactivegases, len(self.pressure_profile)) + shape)
+            for mol_idx, mol_val in enumerate(self.active_gases):
+                opacity_in_cut = opacity_in[mol_val][:,t_idx,self.int_wngrid_select]
+                for pressure_idx, bracket in enumerate(self.opacity_slab_brackets):
+                    interp_bracket(opacity_in_cut, bracket, out=slab[mol_idx, pressure_idx])
+
+            temp = self.get_opacity_dict()['t'][t_idx]
+            self.opacity_slabs_touched.add(temp)
+            logging.info('Interpolate opacity temperature slab %.1f K to pressure profile (%i slabs in memory)' %
+                         (temp, len(self.opacity_slabs) + 1))
+
+        self.opacity_slabs[t_idx] = slab # most recently used
+        return slab
+
+    def log_opacity_slabs(self):
+
+        # report the temperature slabs used so far (lazy temperature mode)
+        temp = self.get_opacity_dict()['t']
+        logging.info('Opacity temperature slabs used: %i of %i (%s K)' %
+                     (len(self.opacity_slabs_touched), len(temp),
+                      ', '.join(['%.1f' % val for val in sorted(self.opacity_slabs_touched)])))
+
+    def get_opacity_cache_key(self):
+
+        # hash of all the inputs the opacity arrays depend on: molecules, pressure profile, temperature and wavenumber
+        # grids, cia pairs, and the source files (path, size and modification time)
+        opacity_dict = self.get_opacity_dict()
+        source_files = [get_file_identity(filename) for filename in self.data.opacity_files + self.data.cia_files]
+
+        return self.opacity_cache.get_key('opacity_arrays',
+                                          self.data.opacity_method,
+                                          list(self.active_gases),
+                                          list(self.inactive_gases),
+                                          self.pressure_profile,
+                                          np.asarray(opacity_dict['p']),
+                                          np.asarray(opacity_dict['t']),
+                                          np.asarray(self.int_wngrid),
+                                          list(self.params.atm_cia_pairs),
+                                          np.asarray(self.data.sigma_cia_dict['t']),
+                                          source_files)
+
     def set_mu_profile(self):
 
         # get mu for each layer
@@ -411,64 +683,18 @@ class atmosphere(object):
         sigma_array = np.zeros((self.nactivegases, len(self.pressure_profile), len(self.data.sigma_dict['t']),
                                 self.int_nwngrid))
 
+        # the pressure brackets (indexes and weights) are the same for all molecules, temperatures and wavenumbers,
+        # so get them once per layer, and interpolate whole (temperature, wavenumber) blocks at once.
+        # The result is identical to running np.interp on each (temperature, wavenumber) point.
+        brackets = [get_interp_bracket(pressure_val, self.data.sigma_dict['p']) for pressure_val in pressure_profile_bar]
+
         for mol_idx, mol_val in enumerate(self.active_gases):
 
             sigma_in = self.data.sigma_dict['xsecarr'][mol_val]
-            sigma_in_cut = sigma_in[:,:,self.int_wngrid_idxmin:self.int_wngrid_idxmax]
-
-            if  nthreads <= 1:  # run interpolation on the current thread
-                for pressure_idx, pressure_val in enumerate(pressure_profile_bar):
-                    for temperature_idx, temperature_val in enumerate(self.data.sigma_dict['t']):
-                        for wno_idx, wno_val in enumerate(self.int_wngrid):
-                            sigma_array[mol_idx, pressure_idx, temperature_idx, wno_idx] = \
-                                np.interp(pressure_val, self.data.sigma_dict['p'],
-                                          sigma_in_cut[:,temperature_idx,wno_idx])
-
-            else:
+            sigma_in_cut = sigma_in[:,:,self.int_wngrid_select]
 
-                # run interpolation with multiple threads. threads are used to compute separate pressure levels.
-                # Run simultaneously up to NTHREADS pressure levels.
-
-                logging.info('Running inteprolation with  %i threads' % nthreads)
-
-                nruns = int(self.nlayers/nthreads)
-                remainder = self.nlayers % nthreads
-                for round_idx in range(nruns+1):
-                    gotQueues = dict()
-                    def empty_queues(jobs):
-                        for i, job in enumerate(jobs):
-                            if not queues[i].empty():
-                                if i in gotQueues:
-                                    gotQueues[i] += queues[i].get()
-                                else:
-                                    gotQueues[i] = queues[i].get()
-                    level_min_idx = nthreads*round_idx
-                    if  round_idx == nruns:
-                        if remainder == 0:
-                            break
-                        level_max_idx = self.nlayers
-                    else:
-                        level_max_idx = nthreads*(round_idx+1)
-                    pressure_profile_bar = self.pressure_profile[level_min_idx:level_max_idx]/1e5
-                    queues = [Queue() for pressure_idx, pressure_val in enumerate(pressure_profile_bar)]
-                    jobs = [MultiThread_get_sigma_array(queues[pressure_idx],
-                                                         pressure_idx,
-                                                         pressure_profile_bar,
-                                                         self.nactivegases,
-                                                         self.data.sigma_dict,
-                                                         sigma_in_cut,
-                                                         self.active_gases,
-                                                         self.int_wngrid,
-                                                         self.int_nwngrid,
-                                                         self.int_wngrid_idxmin,
-                                                         self.int_wngrid_idxmax) for pressure_idx, pressure_val in enumerate(pressure_profile_bar)]
-                    for job in jobs:
-                        job.start()
-                    while any([jj.is_alive() for jj in jobs]):
-                        time.sleep(0.01)  # 0.01 Wait a while before next update. Slow down updates for really long runs.
-                        empty_queues(jobs)
-                    for pressure_idx, pressure_val in enumerate(pressure_profile_bar):
-                        sigma_array[mol_idx, round_idx*nthreads+pressure_idx, :, :] = gotQueues[pressure_idx]
+            for pressure_idx, bracket in enumerate(brackets):
+                interp_bracket(sigma_in_cut, bracket, out=sigma_array[mol_idx, pressure_idx])
 
         return sigma_array
 
@@ -482,67 +708,17 @@ class atmosphere(object):
                                  len(self.data.ktable_dict['t']), self.int_nwngrid,
                                  len(self.data.ktable_dict['weights'])))
 
+        # pre-interpolate in pressure and slice in wavenumber to internal grid. Each layer is a weighted
+        # combination of the two bracketing pressure slabs (temperature, wavenumber, k-coeff) of the ktables
+        brackets = [get_interp_bracket(pressure_val, self.data.ktable_dict['p']) for pressure_val in pressure_profile_bar]
+
         for mol_idx, mol_val in enumerate(self.active_gases):
 
             ktable_in = self.data.ktable_dict['kcoeff'][mol_val]
-            if  nthreads <= 1:
-                for pressure_idx, pressure_val in enumerate(pressure_profile_bar): # loop through input pressure grid
-                    for temperature_idx, temperature_val in enumerate(self.data.ktable_dict['t']):# loop through temps
-                        for wno_idx, wno_val in enumerate(self.int_wngrid): # loop through bins
-                            for kc_idx, kc_val in enumerate(self.data.ktable_dict['weights']): # loop through k-coeff (~20)
-                                # store kcoeff array
-                                # pre-interpolate in pressure and slice in wavenumber to internal grid
-                                kcoeff_array[mol_idx, pressure_idx, temperature_idx, wno_idx, kc_idx] = \
-                                    np.interp(pressure_val, self.data.ktable_dict['p'],
-                                              ktable_in[:,:,self.int_wngrid_idxmin:self.int_wngrid_idxmax,:]\
-                                                       [:,temperature_idx,wno_idx,kc_idx])
-            else:
+            ktable_in_cut = ktable_in[:,:,self.int_wngrid_select,:]
 
-
-
-                # run interpolation with multiple threads. threads are used to compute separate pressure levels.
-                # Run simultaneously up to NTHREADS pressure levels.
-
-                logging.info('Running inteprolation with  %i threads' % nthreads)
-
-                nruns = int(self.nlayers/nthreads)
-                remainder = self.nlayers % nthreads
-                for round_idx in range(nruns+1):
-                    gotQueues = dict()
-                    def empty_queues(jobs):
-                        for i, job in enumerate(jobs):
-                            if not queues[i].empty():
-                                if i in gotQueues:
-                                    gotQueues[i] += queues[i].get()
-                                else:
-                                    gotQueues[i] = queues[i].get()
-                    level_min_idx = nthreads*round_idx
-                    if  round_idx == nruns:
-                        if remainder == 0:
-                            break
-                        level_max_idx = self.nlayers
-                    else:
-                        level_max_idx = nthreads*(round_idx+1)
-                    pressure_profile_bar = self.pressure_profile[level_min_idx:level_max_idx]/1e5
-                    queues = [Queue() for pressure_idx, pressure_val in enumerate(pressure_profile_bar)]
-                    jobs = [MultiThread_get_ktables_array(queues[pressure_idx],
-                                                         pressure_idx,
-                                                         pressure_profile_bar,
-                                                         self.nactivegases,
-                                                         self.data.ktable_dict,
-                                                         ktable_in,
-                                                         self.active_gases,
-                                                         self.int_wngrid,
-                                                         self.int_nwngrid,
-                                                         self.int_wngrid_idxmin,
-                                                         self.int_wngrid_idxmax) for pressure_idx, pressure_val in enumerate(pressure_profile_bar)]
-                    for job in jobs:
-                        job.start()
-                    while any([jj.is_alive() for jj in jobs]):
-                        time.sleep(0.01)  # Wait a while before next update. Slow down updates for really long runs.
-                        empty_queues(jobs)
-                    for pressure_idx, pressure_val in enumerate(pressure_profile_bar):
-                        kcoeff_array[mol_idx, round_idx*nthreads+pressure_idx, :, :] = gotQueues[pressure_idx]
+            for pressure_idx, bracket in enumerate(brackets):
+                interp_bracket(ktable_in_cut, bracket, out=kcoeff_array[mol_idx, pressure_idx])
 
         return kcoeff_array
 
@@ -550,8 +726,7 @@ class atmosphere(object):
         logging.info('Interpolate Rayleigh sigma array to pressure profile')
         sigma_rayleigh_array = np.zeros((self.nactivegases+self.ninactivegases, self.int_nwngrid))
         for mol_idx, mol_val in enumerate(self.active_gases+self.inactive_gases):
-            sigma_rayleigh_array[mol_idx,:] =  self.data.sigma_rayleigh_dict[mol_val]\
-                [self.int_wngrid_idxmin:self.int_wngrid_idxmax]
+            sigma_rayleigh_array[mol_idx,:] =  self.data.sigma_rayleigh_dict[mol_val][self.int_wngrid_select]
         return sigma_rayleigh_array
     
     def get_sigma_mie_lee(self):
@@ -658,19 +833,23 @@ class atmosphere(object):
   
 
     def get_sigma_cia_array(self):
-        logging.info('Interpolate CIA sigma array to pressure profile')
-        sigma_cia_array = np.zeros((len(self.params.atm_cia_pairs),
-                                    len(self.data.sigma_cia_dict['t']), self.int_nwngrid))
-        for pair_idx, pair_val in enumerate(self.params.atm_cia_pairs):
-            sigma_cia_array[pair_idx,:,:] = self.data.sigma_cia_dict['xsecarr'][pair_val]\
-                [:,self.int_wngrid_idxmin:self.int_wngrid_idxmax]
-        return sigma_cia_array
+        # the cia array of a given wavenumber range is built only once, and reused by all grids sharing that range
+        # (the culled grid of the observed spectrum has fewer wavenumbers than the full range)
+        wngrid_range = (self.int_wngrid_idxmin, self.int_wngrid_idxmax, self.int_nwngrid)
+        if not wngrid_range in self.sigma_cia_arrays:
+            logging.info('Interpolate CIA sigma array to pressure profile')
+            sigma_cia_array = np.zeros((len(self.params.atm_cia_pairs),
+                                        len(self.data.sigma_cia_dict['t']), self.int_nwngrid))
+            for pair_idx, pair_val in enumerate(self.params.atm_cia_pairs):
+                sigma_cia_array[pair_idx,:,:] = self.data.sigma_cia_dict['xsecarr'][pair_val][:,self.int_wngrid_select]
+            self.sigma_cia_arrays[wngrid_range] = sigma_cia_array
+        return self.sigma_cia_arrays[wngrid_range]
 
     def get_cia_idx(self):
         # return the gas indexes of the molecules inside the pairs
         # used to get the mixing ratios of the individual molecules in the cpp pathintegral
         # the index refers to the full array of active_gas + inactive_gas
-        cia_idx = np.zeros((len(self.params.atm_cia_pairs)*2), dtype=np.int)
+        cia_idx = np.zeros((len(self.params.atm_cia_pairs)*2), dtype=int)
         if self.params.atm_cia:
             c = 0
             for pair_idx, pair_val in enumerate(self.params.atm_cia_pairs):
@@ -1064,110 +1243,10 @@ class atmosphere(object):
         if (wsize %2 == 0):
             wsize += 1
         TP_smooth = movingaverage(TP,wsize)
-        border = np.int((len(TP) - len(TP_smooth))/2)
+        border = int((len(TP) - len(TP_smooth))/2)
         
         #set atmosphere object
         foo = TP[::-1]
         foo[border:-border] = TP_smooth[::-1]
 
         return np.copy( foo , order='C')
-
-
-# Additional classes to manage multithreading tasks
-
-class MultiThread_get_sigma_array(Process):
-
-    # Interpolation of sigma_array to pressure profile
-
-    def __init__(self,
-                 queue,
-                 pressure_idx,
-                 pressure_profile_bar,
-                 nactivegases,
-                 sigma_dict,
-                 sigma_in_cut,
-                 active_gases,
-                 int_wngrid,
-                 int_nwngrid,
-                 int_wngrid_idxmin,
-                 int_wngrid_idxmax):
-
-        Process.__init__(self)
-        self.queue = queue
-        self.pressure_idx = pressure_idx
-        self.pressure_profile_bar = pressure_profile_bar
-        self.nactivegases = nactivegases
-        self.sigma_dict = sigma_dict
-        self.sigma_in_cut = sigma_in_cut
-        self.active_gases = active_gases
-        self.int_wngrid = int_wngrid
-        self.int_nwngrid = int_nwngrid
-        self.int_wngrid_idxmin = int_wngrid_idxmin
-        self.int_wngrid_idxmax = int_wngrid_idxmax
-        return
-
-    def run(self):
-        pressure_val = self.pressure_profile_bar[self.pressure_idx]
-        if cythonised:
-            sigma_array_partial = cy_fun.get_sigma_array_interp(self.sigma_dict['t'],
-                                                                self.sigma_dict['p'],
-                                                                pressure_val,
-                                                                self.sigma_in_cut,
-                                                                self.int_wngrid,
-                                                                self.int_wngrid_idxmin,
-                                                                self.int_wngrid_idxmax)
-        else:
-            sigma_array_partial = np.zeros((len(self.sigma_dict['t']), self.int_nwngrid))
-            for temperature_idx, temperature_val in enumerate(self.sigma_dict['t']):
-                for wno_idx, wno_val in enumerate(self.int_wngrid):
-                    sigma_array_partial[temperature_idx, wno_idx] = \
-                        np.interp(pressure_val, self.sigma_dict['p'], self.sigma_in_cut[:,temperature_idx,wno_idx])
-        self.queue.put(sigma_array_partial)
-        return
-
-class MultiThread_get_ktables_array(Process):
-
-    # Interpolation of sigma_array to pressure profile
-
-    def __init__(self,
-                 queue,
-                 pressure_idx,
-                 pressure_profile_bar,
-                 nactivegases,
-                 ktable_dict,
-                 ktable_in,
-                 active_gases,
-                 int_wngrid,
-                 int_nwngrid,
-                 int_wngrid_idxmin,
-                 int_wngrid_idxmax):
-
-        Process.__init__(self)
-        self.queue = queue
-        self.pressure_idx = pressure_idx
-        self.pressure_profile_bar = pressure_profile_bar
-        self.nactivegases = nactivegases
-        self.ktable_dict = ktable_dict
-        self.ktable_in = ktable_in
-        self.active_gases = active_gases
-        self.int_wngrid = int_wngrid
-        self.int_nwngrid = int_nwngrid
-        self.int_wngrid_idxmin = int_wngrid_idxmin
-        self.int_wngrid_idxmax = int_wngrid_idxmax
-        return
-
-    def run(self):
-        pressure_val = self.pressure_profile_bar[self.pressure_idx]
-        kcoeff_array_partial = np.zeros((len(self.ktable_dict['t']),self.int_nwngrid, len(self.ktable_dict['weights'])))
-        for temperature_idx, temperature_val in enumerate(self.ktable_dict['t']):# loop through temps
-            for wno_idx, wno_val in enumerate(self.int_wngrid): # loop through bins
-                for kc_idx, kc_val in enumerate(self.ktable_dict['weights']): # loop through k-coeff (~20)
-                    # store kcoeff array
-                    # pre-interpolate in pressure and slice in wavenumber to internal grid
-                    kcoeff_array_partial[temperature_idx, wno_idx, kc_idx] = \
-                        np.interp(pressure_val, self.ktable_dict['p'],
-                                  self.ktable_in[:,:,self.int_wngrid_idxmin:self.int_wngrid_idxmax,:]\
-                                                [:,temperature_idx,wno_idx,kc_idx])
-
-        self.queue.put(kcoeff_array_partial)
-        return
\ No newline at end of file
@@ -20,11 +20,16 @@ except:
 import logging
 import numpy as np
 import heapq
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from scipy.interpolate import interp1d
 
 from library_constants import *
 from library_general import *
 from library_emission import *
+from library_opacity import *
+from library_mpi import *
 
 #import license
 #from license import *
@@ -44,55 +49,41 @@ class data(object):
         
         self.params = params
 
-        # compile shared libraries
-        if self.params.gen_compile_cpp:
-            self.compile_shared_libs()
-
-        # set opacity method (ktab, xsec_sampled, xsec_highres)
-        self.get_opacity_method()
-
-        # load ace specific parameters
-        if self.params.gen_ace:
-            self.load_ace_params()
+        # opacity catalogues, loaded once per opacity folder (see get_opacity_files)
+        self.opacity_catalogues = {}
 
+        # persistent cache of the regridded cia tables and of the opacity arrays interpolated to the pressure profile
+        # (see atmosphere.get_opacity_arrays)
+        if self.params.in_opacity_cache_path in ['False', 'None', '', None]:
+            self.opacity_cache = None
+        else:
+            self.opacity_cache = opacity_cache(self.params.in_opacity_cache_path,
+                                               self.params.in_opacity_cache_size*1e9)
 
-        # load observed input spectrum
-        if self.params.mode == 'retrieval':
-            self.load_input_spectrum()
-
-
-
-        # Load external active gases profiles
-        if self.params.atm_active_gases[0] == 'FILE':
-            self.load_active_gases_file()
-
-        # Load external temperature profile
-        if self.params.atm_tp_type.upper() == 'FILE':
-            self.load_tp_profile_file()
-
-        # Preload the cross sections
-        if self.opacity_method == 'xsec_sampled':
-            self.load_sigma_sampled_dict()
-        elif self.opacity_method == 'xsec_highres':
-            self.load_sigma_highres_dict()
-        elif self.opacity_method == 'ktables':
-            self.load_ktables_dict()
+        # node communicator used to share the input data between the MPI processes of a node
+        self.shared_comm = None
+        if self.params.gen_mpi_shared_opacity:
+            self.shared_comm = get_node_comm()
 
-        # Load wavenumber grid of internal model
-        self.load_wavenumber_grid()
+        # loaders running in the background (see load_input_data_prefetch)
+        self.prefetch_tasks = []
+        broadcast = self.params.gen_mpi_broadcast_data and get_mpi_size() > 1
+        prefetch = self.params.in_prefetch_data and self.shared_comm is None and not broadcast
 
-        # Load rayleigh cross secitons
-        self.load_sigma_rayleigh_dict()
+        # compile shared libraries (in the background when prefetching)
+        if self.params.gen_compile_cpp and not prefetch:
+            self.compile_shared_libs()
 
-        # Load CIA cross sections
-        self.load_sigma_cia_dict()
-        
-        # Load MIE coefficients 
-        self.load_mie_indices()
+        # set opacity method (ktab, xsec_sampled, xsec_highres)
+        self.get_opacity_method()
 
-        # Load Phoenix stellar model library or star blackbody
-        if self.params.gen_type.upper() == 'EMISSION':
-            self.load_star_SED()
+        # load all input files
+        if broadcast:
+            self.load_input_data_broadcast()
+        elif prefetch:
+            self.load_input_data_prefetch()
+        else:
+            self.load_input_data()
 
         logging.info('Data object initialised')
 
@@ -126,6 +117,8 @@ class data(object):
         if self.params.atm_mie and self.params.atm_mie_type == 'bh':
             os.system('gcc -fPIC -shared library/MIE/bhmie_lib.c library/MIE/complex.c library/MIE/nrutil.c -o library/MIE/bhmie_lib.so')
 
+        self.shared_libs_compiled = True
+
     def get_opacity_method(self):
 
         if self.params.in_opacity_method in ['xsec_sampled', 'xsec_lowres', 'xsec']:
@@ -138,6 +131,196 @@ class data(object):
             logging.error('You need to select an opacity calculation method. See parameter General->opacity_method')
             exit()
 
+    def load_input_data(self, share_opacity=True):
+
+        # load ace specific parameters
+        if self.params.gen_ace:
+            self.load_ace_params()
+
+        # load observed input spectrum
+        if self.params.mode == 'retrieval':
+            self.load_input_spectrum()
+
+
+        # Load external active gases profiles
+        if self.params.atm_active_gases[0] == 'FILE':
+            self.load_active_gases_file()
+
+        # Load external temperature profile
+        if self.params.atm_tp_type.upper() == 'FILE':
+            self.load_tp_profile_file()
+
+        # Preload the cross sections. With gen_mpi_shared_opacity only one process per node loads them, into
+        # shared memory
+        if self.shared_comm is None or not share_opacity:
+            self.load_opacity_dict()
+        else:
+            self.load_opacity_dict_shared()
+
+        # Load wavenumber grid of internal model
+        self.load_wavenumber_grid()
+
+        # Load rayleigh cross secitons
+        self.load_sigma_rayleigh_dict()
+
+        # Load CIA cross sections
+        self.load_sigma_cia_dict()
+        
+        # Load MIE coefficients 
+        self.load_mie_indices()
+
+        # Load Phoenix stellar model library or star blackbody
+        if self.params.gen_type.upper() == 'EMISSION':
+            self.load_star_SED()
+
+    def load_input_data_prefetch(self):
+
+        # same as load_input_data, but the loaders are all started at once in a thread pool. Each loader waits only
+        # for the loaders it depends on: the opacities for everything defined on the native wavenumber grid, the
+        # observed spectrum for the wavenumber window, the active gases file for the list of molecules.
+        # The attributes set by a loader appear when the loader completes. Accessing one of them before waits
+        # until it is set (see __getattr__), so that the atmosphere only blocks on what it actually uses.
+
+        # the ace parameters change the list of active gases in the parameters object, which is read directly
+        # by the other classes: load them first
+        if self.params.gen_ace:
+            self.load_ace_params()
+
+        pool = ThreadPool(4)
+
+        if self.params.gen_compile_cpp:
+            self.prefetch(pool, data.compile_shared_libs)
+
+        self.prefetch(pool, data.load_mie_indices)
+
+        if self.params.atm_tp_type.upper() == 'FILE':
+            self.prefetch(pool, data.load_tp_profile_file)
+
+        depends = []
+        if self.params.mode == 'retrieval':
+            depends.append(self.prefetch(pool, data.load_input_spectrum))
+        if self.params.atm_active_gases[0] == 'FILE':
+            depends.append(self.prefetch(pool, data.load_active_gases_file))
+
+        opacity = self.prefetch(pool, data.load_opacity_dict, depends)
+        self.prefetch(pool, data.load_wavenumber_grid, [opacity])
+        self.prefetch(pool, data.load_sigma_rayleigh_dict, [opacity])
+        self.prefetch(pool, data.load_sigma_cia_dict, [opacity])
+        if self.params.gen_type.upper() == 'EMISSION':
+            self.prefetch(pool, data.load_star_SED, [opacity])
+
+        pool.close()
+
+    def prefetch(self, pool, loader, depends=[]):
+
+        # run loader in the background, on a copy of this object, once the tasks in depends have completed.
+        # The attributes set by the loader are copied back when it completes. Return the task.
+
+        def run():
+            for task in depends:
+                result = task.get()
+                if isinstance(result, SystemExit):
+                    return result
+            before = dict(self.__dict__)
+            shadow = object.__new__(data)
+            shadow.__dict__.update(before)
+            shadow.prefetch_tasks = []
+            try:
+                loader(shadow)
+            except SystemExit as e:
+                # loaders exit on errors: exit in the main thread instead, when the result is used
+                return e
+            self.__dict__.update((name, val) for name, val in shadow.__dict__.items()
+                                 if name != 'prefetch_tasks' and (not name in before or before[name] is not val))
+
+        task = pool.apply_async(run)
+        self.prefetch_tasks.append(task)
+        return task
+
+    def wait_prefetch(self, name):
+
+        # wait for the loaders running in the background (see prefetch) until the attribute name is set,
+        # or until all of them have completed. Loaders that exited on errors exit here.
+        tasks = self.__dict__.get('prefetch_tasks') or []
+        while tasks and not name in self.__dict__:
+            # poll the running loaders, and stop as soon as the one setting the attribute has completed
+            for task in list(tasks):
+                task.wait(0.01)
+                if task.ready():
+                    tasks.remove(task)
+                    result = task.get()
+                    if isinstance(result, SystemExit):
+                        raise result
+                    if name in self.__dict__:
+                        break
+
+    def __getattr__(self, name):
+
+        # called only for attributes that do not exist (yet): wait for the loaders running in the background
+        if not name.startswith('__'):
+            self.wait_prefetch(name)
+        if name in self.__dict__:
+            return self.__dict__[name]
+        raise AttributeError("'data' object has no attribute '%s'" % name)
+
+    def load_input_data_broadcast(self):
+
+        # read all the input files on the master process only, and broadcast the arrays to the other processes
+        # (or to the first process of each node with gen_mpi_shared_opacity, which then shares them in memory)
+
+        t0 = time.time()
+
+        # the ace parameters (load_ace_params) also change the list of active gases in the parameters object:
+        # it is broadcast with the data, and set in the parameters object of the other processes
+        ace_params = ['atm_active_gases', 'atm_active_gases_mixratios']
+
+        if get_mpi_rank() == 0:
+            names = set(self.__dict__.keys())
+            self.load_input_data(share_opacity=False)
+            attributes = dict((name, val) for name, val in self.__dict__.items() if name not in names)
+            if self.params.gen_ace:
+                attributes['ace_params'] = dict((name, getattr(self.params, name)) for name in ace_params)
+        else:
+            attributes = None
+
+        attributes = broadcast_dict(attributes, node_comm=self.shared_comm)
+        for name, val in attributes.pop('ace_params', {}).items():
+            setattr(self.params, name, list(val))
+        for name, val in attributes.items():
+            setattr(self, name, val)
+
+        logging.info('Input data loaded and broadcast to %i processes in %.1f s' % (get_mpi_size(), time.time()-t0))
+
+    def load_opacity_dict(self):
+
+        if self.opacity_method == 'xsec_sampled':
+            self.load_sigma_sampled_dict()
+        elif self.opacity_method == 'xsec_highres':
+            self.load_sigma_highres_dict()
+        elif self.opacity_method == 'ktables':
+            self.load_ktables_dict()
+
+    def load_opacity_dict_shared(self):
+
+        # the first process of the node loads the cross sections / ktables, which are then moved to a shared
+        # memory segment. The other processes skip the loading and map the same memory, read only.
+        if self.opacity_method == 'ktables':
+            names = ['ktable_dict']
+        else:
+            names = ['sigma_dict']
+        names += ['int_wngrid_native', 'int_nwngrid_native', 'int_wlgrid_native', 'int_nwlgrid_native',
+                  'opacity_files']
+
+        if self.shared_comm.Get_rank() == 0:
+            self.load_opacity_dict()
+            attributes = dict((name, getattr(self, name)) for name in names)
+        else:
+            attributes = None
+
+        attributes = share_dict(self.shared_comm, attributes)
+        for name in names:
+            setattr(self, name, attributes[name])
+
     def load_ace_params(self):
 
         logging.info('Loading ace specific parameters')
@@ -163,8 +346,7 @@ class data(object):
             elif self.opacity_method == 'ktables':
                 opacity_path = self.params.in_ktab_path
 
-            molpath = insensitive_glob(os.path.join(opacity_path, '%s_*' % mol_val))+\
-                      insensitive_glob(os.path.join(opacity_path, '%s.*' % mol_val))
+            molpath = self.get_opacity_files(opacity_path, mol_val)
             if len(molpath)>0:
                 molpath = molpath[0]
                 if os.path.isfile(molpath):
@@ -258,23 +440,23 @@ class data(object):
         ktable_dict = {}
         ktable_dict['kcoeff'] = {}
 
+        # list of loaded files, used to identify the opacity arrays in the opacity cache
+        self.opacity_files = []
+
         # loop through molecules
         for mol_idx, mol_val in enumerate(molecules):
 
             # check that ktable for given molecule exists
-            molpath = insensitive_glob(os.path.join(self.params.in_ktab_path, '%s_*' % mol_val))+ \
-                      insensitive_glob(os.path.join(self.params.in_ktab_path, '%s.*' % mol_val))
+            molpath = self.get_opacity_files(self.params.in_ktab_path, mol_val)
             if len(molpath) > 0:
                 molpath = molpath[0]
             else:
                 logging.error('There is no ktable for %s. Path: %s ' % (mol_val, molpath))
                 exit()
 
-            # load ktable
-            try:
-                ktable = pickle.load(open(molpath, 'rb'), encoding='latin1') # python 3
-            except:
-                ktable = pickle.load(open(molpath)) # python 2
+            # load ktable (binary stores are memory mapped, and already in m^2)
+            ktable, divisor = load_opacity_file(molpath)
+            self.opacity_files.append(molpath)
 
             if mol_idx > 0:
                 # check that ktables are all consistent with each others
@@ -310,20 +492,28 @@ class data(object):
                 T_list, Tmin_idx, Tmax_idx = self.get_temp_range_idx(t)
                 ktable_dict['t'] = T_list.astype(float)
                 ktable_dict['p'] = p.astype(float)
-                ktable_dict['bin_centers'] = bin_centers
-                ktable_dict['bin_edges'] = bin_edges
+
+                # restrict wavenumber range to the window needed by the atmosphere object
+                wn_idxmin, wn_idxmax = self.get_wngrid_window_idx(bin_centers)
+                ktable_dict['bin_centers'] = np.asarray(bin_centers[wn_idxmin:wn_idxmax])
+                ktable_dict['bin_edges'] = np.asarray(bin_edges[wn_idxmin:wn_idxmax+1])
                 ktable_dict['weights'] = weights
                 ktable_dict['ngauss'] = ngauss
 
-            ktable_dict['kcoeff'][mol_val] = ktable['kcoeff'][:,Tmin_idx:Tmax_idx,:,:] / 10000. # from cm^-2 to m^-2
+            # from cm^-2 to m^-2. Binary stores are sliced without reading or copying anything
+            ktable_dict['kcoeff'][mol_val] = scale_opacity(ktable['kcoeff'][:,Tmin_idx:Tmax_idx,wn_idxmin:wn_idxmax,:],
+                                                           divisor)
+            del ktable, kcoeff
 
         logging.info('Loaded temperatures in ktables: %s' % ktable_dict['t'] )
         logging.info('Loaded pressures in ktables: %s ' % ktable_dict['p'])
+        bin_centers = ktable_dict['bin_centers']
+        bin_edges = ktable_dict['bin_edges']
         logging.info('The wavenumber range of the ktables is %.2f - %.2f with %i bins' % (np.min(bin_edges),
                                                                                 np.max(bin_edges), len(bin_centers)))
 
         # set 'native' wavenumber grid
-        self.int_wngrid_native = bin_centers # full wavenumber range
+        self.int_wngrid_native = bin_centers # wavenumber range of the ktables (restricted to the window)
         with np.errstate(divide='ignore'):
             self.int_wlgrid_native = 10000./self.int_wngrid_native
         self.int_nwngrid_native = len(bin_centers)
@@ -339,24 +529,24 @@ class data(object):
         else:
             molecules = self.params.atm_active_gases
 
-        sigma_dict = {}
-        sigma_dict['xsecarr'] = {}
-
-        temp_list_check = []
+        temp_list_check = None
         all_molpaths = []
+        molpaths_dict = {}
 
         logging.info('Check that the same temperatures for all molecules are available.')
 
         for mol_idx, mol_val in enumerate(molecules):
 
-            # select xsec for given molecule and all temperatures available
-            molpaths = insensitive_glob(os.path.join(self.params.in_xsec_path, '%s_T*' % mol_val))
+            # select xsec for given molecule and all temperatures available (files of the form H2O_T600.TauREx.pickle)
+            molpaths = [molpath_val for molpath_val in self.get_opacity_files(self.params.in_xsec_path, mol_val)
+                        if os.path.basename(molpath_val).split('.')[0].split('_')[1:2] and
+                        os.path.basename(molpath_val).split('.')[0].split('_')[1][:1].upper() == 'T']
             if len(molpaths) == 0:
                 logging.error('There is no cross section for %s. Path: %s ' % (mol_val, self.params.in_xsec_path))
                 exit()
 
-            # get list of temperatures available
-            temp_list = []
+            # get the file of each temperature available
+            temp_files = {}
             for molpath_idx, molpath_val in enumerate(molpaths):
                 # check filename
                 tempfield = os.path.basename(molpath_val).split('.')[0].split('_')[1]
@@ -364,69 +554,113 @@ class data(object):
                     logging.error('Filename of the cross section is not valid. Should be of the form H2O_T600.TauREx.pickle.'
                                   ' Check the filename for %s ' % os.path.basename(molpath_val))
                     exit()
-                # get temperature of given file
-                temp_list.append(float(tempfield[1:]))
+                # get temperature of given file. Binary stores come first, and are preferred to pickles
+                if not float(tempfield[1:]) in temp_files:
+                    temp_files[float(tempfield[1:])] = molpath_val
 
             # restrict list of temperature to those needed
-            temp_list_cut, Tmin_idx, Tmax_idx = self.get_temp_range_idx(np.sort(temp_list))
+            temp_list_cut, Tmin_idx, Tmax_idx = self.get_temp_range_idx(np.sort(list(temp_files.keys())))
 
             # check that the restricted list of temperature is the same for all molecules
             if mol_idx > 0:
-                if temp_list_cut != temp_list_check:
+                if not np.array_equal(temp_list_cut, temp_list_check):
                     logging.error('The list of temperatures for all molecules should be the same. %s and %s don\'t share the'
                                   ' same temperatures for the range needed to compute the spectrum. ' %
                                   (molecules[mol_idx], molecules[mol_idx-1]))
                     exit()
-                temp_list_check = temp_list_cut
+            temp_list_check = temp_list_cut
 
-            # loop through temperature list and load all xsec filenames (for all molecules)  into a list
-            # used to get the largest file, hence the finest wavenumber grid
-            # NOTE that here we assume that the largest file has the finest grid!
-
-            for temp in temp_list_cut:
-                molpath_val = insensitive_glob(os.path.join(self.params.in_xsec_path, '%s_T%i*' % (mol_val, int(temp))))[0]
-                all_molpaths.append(molpath_val)
+            # store all xsec filenames (for all molecules) into a list
+            # used to get the finest wavenumber grid, from the opacity catalogue or from the largest file
+            # NOTE that without a catalogue we assume that the largest file has the finest grid!
+            molpaths_dict[mol_val] = [temp_files[temp] for temp in temp_list_cut]
+            all_molpaths += molpaths_dict[mol_val]
 
         logging.info('Beginning loading of cross sections, with interpolation to finest grid. Might take a while...')
 
-        # get largest file in all_molpaths, and get the wavenumber grid. All other xsec will be reinterpolated to this grid
-        largest_file = heapq.nlargest(1, all_molpaths, key=os.path.getsize)[0]
-        largest_xsec_load = pickle.load(open(largest_file, 'rb'), encoding='latin1')
-        wngrid = largest_xsec_load['wno']
+        # get the finest wavenumber grid. All other xsec will be reinterpolated to this grid
+        entries = [self.get_opacity_catalogue_entry(self.params.in_xsec_path, molpath_val) for molpath_val in all_molpaths]
+        if all(entries):
+            # the catalogue gives the resolution of each file
+            largest_file = all_molpaths[np.argmin([entry['resolution'] for entry in entries])]
+        else:
+            # get largest file in all_molpaths
+            largest_file = heapq.nlargest(1, all_molpaths, key=os.path.getsize)[0]
+        largest_xsec_load, divisor = load_opacity_file(largest_file)
+        self.opacity_files = all_molpaths
+        wngrid_full = np.asarray(largest_xsec_load['wno'])
         press_list = np.asarray(largest_xsec_load['p'])
+        del largest_xsec_load
 
-        sigma_array = np.zeros((len(press_list), len(temp_list_cut), len(wngrid)))
+        # restrict wavenumber range to the window needed by the atmosphere object
+        wn_idxmin, wn_idxmax = self.get_wngrid_window_idx(wngrid_full)
+        wngrid = wngrid_full[wn_idxmin:wn_idxmax]
 
-        # loop again through all molecules and temperatures
+        # preallocate the output arrays. Each file is written straight into its temperature slab
         sigma_dict = {}
         sigma_dict['xsecarr'] = {}
         sigma_dict['t'] = np.asarray(temp_list_cut).astype(float)
         sigma_dict['p'] = press_list.astype(float)
         sigma_dict['wno'] = wngrid
-
         for mol_idx, mol_val in enumerate(molecules):
-            logging.info('Doing %s...' % mol_val)
-            for temp_idx, temp_val in enumerate(temp_list_cut):
-                molpath_val = insensitive_glob(os.path.join(self.params.in_xsec_path, '%s_T%i*' % (mol_val, int(temp))))[0]
+            sigma_dict['xsecarr'][mol_val] = np.zeros((len(press_list), len(temp_list_cut), len(wngrid)))
 
-                xsec_load = pickle.load(open(molpath_val, 'rb'), encoding='latin1')
+        def load_file(job):
 
-                if np.shape(xsec_load['xsecarr'])[1] != 1:
-                    logging.error('This cross section has more than one temperature. For high resolution cross section'
-                                  ' only one temperature per file is required. Filename: %s. ' % os.path.basename(molpath_val))
+            # load one (molecule, temperature) file, and interpolate it to the finest grid. Run in a worker thread.
+            # Return the size of the file, and an error message if something is wrong
+            mol_val, temp_idx, molpath_val = job
 
-                # check that all xsec for all molecules and temperatures have the same pressures
+            xsec_load, divisor = load_opacity_file(molpath_val)
 
-                if not np.array_equal(np.asarray(xsec_load['p']), press_list):
-                    logging.error('The cross section %s does not share the same pressure list of %s. '
-                                  ' %s' % (os.path.basename(molpath_val), os.path.basename(largest_file)))
-                    exit()
+            if np.shape(xsec_load['xsecarr'])[1] != 1:
+                logging.error('This cross section has more than one temperature. For high resolution cross section'
+                              ' only one temperature per file is required. Filename: %s. ' % os.path.basename(molpath_val))
+
+            # check that all xsec for all molecules and temperatures have the same pressures
+            if not np.array_equal(np.asarray(xsec_load['p']), press_list):
+                return 0, 'The cross section %s does not share the same pressure list of %s. ' % \
+                       (os.path.basename(molpath_val), os.path.basename(largest_file))
 
-                # inteprolate pressure
-                for press_idx, press_val in enumerate(press_list):
-                    sigma_array[press_idx, temp_idx, :] = np.interp(wngrid, xsec_load['wno'], xsec_load['xsecarr'][press_idx, 0, :])
+            # inteprolate to the finest grid (all pressures at once), and convert from cm^-2 to m^-2
+            if np.array_equal(np.asarray(xsec_load['wno']), wngrid_full):
+                # same grid, no need to interpolate
+                sigma_dict['xsecarr'][mol_val][:, temp_idx, :] = scale_opacity(
+                    xsec_load['xsecarr'][:, 0, wn_idxmin:wn_idxmax], divisor)
+            else:
+                weights = get_interp_weights(wngrid, xsec_load['wno'])
+                sigma_dict['xsecarr'][mol_val][:, temp_idx, :] = scale_opacity(
+                    interp_rows(xsec_load['xsecarr'][:, 0, :], weights), divisor)
 
-            sigma_dict['xsecarr'][mol_val] = sigma_array / 10000.  # from cm^-2 to m^-2
+            return os.path.getsize(molpath_val), None
+
+        jobs = []
+        for mol_idx, mol_val in enumerate(molecules):
+            for temp_idx, molpath_val in enumerate(molpaths_dict[mol_val]):
+                jobs.append((mol_val, temp_idx, molpath_val))
+
+        # load the files in a pool of threads. Only nthreads files are in memory at any time
+        nthreads = self.params.in_load_nthreads
+        if nthreads <= 0:
+            nthreads = multiprocessing.cpu_count()
+        nthreads = min(nthreads, len(jobs))
+        logging.info('Loading %i cross section files with %i threads' % (len(jobs), nthreads))
+
+        time_start = time.time()
+        total_size = 0
+        pool = ThreadPool(nthreads)
+        try:
+            for file_size, error in pool.imap_unordered(load_file, jobs):
+                if error:
+                    logging.error(error)
+                    exit()
+                total_size += file_size
+        finally:
+            pool.terminate()
+        time_load = time.time() - time_start
+
+        logging.info('Loaded %.1f MB of cross sections in %.1f s (%.1f MB/s)' %
+                     (total_size/1e6, time_load, total_size/1e6/max(time_load, 1e-6)))
 
         # set 'native' wavenumber grid
         self.int_wngrid_native = wngrid
@@ -449,22 +683,22 @@ class data(object):
         sigma_dict = {}
         sigma_dict['xsecarr'] = {}
 
+        # list of loaded files, used to identify the opacity arrays in the opacity cache
+        self.opacity_files = []
+
         for mol_idx, mol_val in enumerate(molecules):
 
             # check that xsec for given molecule exists
-            molpath = insensitive_glob(os.path.join(self.params.in_xsec_path, '%s_*' % mol_val))+\
-                      insensitive_glob(os.path.join(self.params.in_xsec_path, '%s.*' % mol_val))
+            molpath = self.get_opacity_files(self.params.in_xsec_path, mol_val)
             if len(molpath) > 0:
                 molpath = molpath[0]
             else:
                 logging.error('There is no cross section for %s. Path: %s ' % (mol_val, self.params.in_xsec_path))
                 exit()
 
-            # load cross sections
-            try:
-                sigma_tmp = pickle.load(open(molpath, 'rb'), encoding='latin1')
-            except:
-                sigma_tmp = pickle.load(open(molpath))
+            # load cross sections (binary stores are memory mapped, and already in m^2)
+            sigma_tmp, divisor = load_opacity_file(molpath)
+            self.opacity_files.append(molpath)
 
             # check that the wavenumber, temperature and pressure grid are the same for all cross sections
             if mol_idx > 0:
@@ -491,9 +725,17 @@ class data(object):
                 T_list, Tmin_idx, Tmax_idx = self.get_temp_range_idx(t)
                 sigma_dict['t'] = T_list.astype(float)
                 sigma_dict['p'] = p.astype(float)
-                sigma_dict['wno'] = sigma_tmp['wno']
 
-            sigma_dict['xsecarr'][mol_val] = sigma_tmp['xsecarr'][:,Tmin_idx:Tmax_idx] / 10000. # from cm^-2 to m^-2
+                # restrict wavenumber range to the window needed by the atmosphere object
+                wn_idxmin, wn_idxmax = self.get_wngrid_window_idx(wno)
+                sigma_dict['wno'] = np.asarray(wno[wn_idxmin:wn_idxmax])
+
+            # from cm^-2 to m^-2. Binary stores are sliced without reading or copying anything
+            sigma_dict['xsecarr'][mol_val] = scale_opacity(sigma_tmp['xsecarr'][:,Tmin_idx:Tmax_idx,wn_idxmin:wn_idxmax],
+                                                           divisor)
+            del sigma_tmp
+
+        wno = sigma_dict['wno']
         logging.info('Temperature range: %s' % sigma_dict['t'] )
         logging.info('Pressure range: %s ' % sigma_dict['p'])
 
@@ -602,44 +844,66 @@ class data(object):
         sigma_dict = {}
         sigma_dict['xsecarr'] = {}
 
+        self.cia_files = []
+
         for pair_val in self.params.atm_cia_pairs:
 
             cia_path = os.path.join(self.params.in_cia_path, '%s.db' % pair_val.upper())
+            self.cia_files.append(cia_path)
 
-            try:
-                sigma_tmp = pickle.load(open(cia_path, 'rb'), encoding='latin1') # python 3
-            except:
-                sigma_tmp = pickle.load(open(cia_path)) # python 2
-
-            t = sigma_tmp['t']
-            wno = sigma_tmp['wno']
-
-            # check cia wavenumber boundaries
-            if np.min(wno) > np.min(self.int_wngrid_native) or np.max(wno) < np.max(self.int_wngrid_native):
-                logging.warning('Internal wavenumber grid overflow for CIA xsec for %s' % pair_val)
-                logging.warning('Internal (native) wavenumber grid range: %f - %f' % (np.min(self.int_wngrid_native),
-                                                                             np.max(self.int_wngrid_native)))
-                logging.warning('CIA cross section wavenumber grid range: %f - %f' % (np.min(wno), np.max(wno)))
-                logging.warning('Assume cia to be zero outside the xsec range')
+            # cia table regridded to the native wavenumber grid, at all temperatures
+            sigma_regrid = self.get_sigma_cia_regrid(pair_val, cia_path)
+            t = sigma_regrid['t']
 
             # restrict temperature range
             T_list, Tmin_idx, Tmax_idx = self.get_temp_range_idx(t)
             sigma_dict['t'] = T_list
             sigma_dict['wno'] = self.int_wngrid_native
-            sigma_dict['xsecarr'][pair_val] = np.zeros((len(sigma_dict['t']), self.int_nwngrid_native))
-
-            # reinterpolate cia xsec to molecule cross section grid and save
-            for t_idx, t_val in enumerate(sigma_dict['t']):
-                sigma_dict['xsecarr'][pair_val][t_idx,:] = np.interp(self.int_wngrid_native, wno,
-                                                                     sigma_tmp['xsecarr'][Tmin_idx+t_idx])
+            sigma_dict['xsecarr'][pair_val] = sigma_regrid['xsecarr'][Tmin_idx:Tmin_idx+len(T_list)]
 
             # load the sigma array in memory
             logging.info('Preload cia cross section for %s' % pair_val)
 
-        del sigma_tmp, t, wno
-
         self.sigma_cia_dict = sigma_dict
 
+    def get_sigma_cia_regrid(self, pair_val, cia_path):
+
+        # return the cia table of a pair interpolated to the native wavenumber grid, at all the temperatures of the
+        # table. The regridded tables are stored in the opacity cache (if enabled), keyed by the native grid
+
+        if self.opacity_cache:
+            cache_key = self.opacity_cache.get_key('cia', pair_val, get_file_identity(cia_path),
+                                                   np.asarray(self.int_wngrid_native))
+            cached = self.opacity_cache.load(cache_key)
+            if cached:
+                return cached
+
+        try:
+            sigma_tmp = pickle.load(open(cia_path, 'rb'), encoding='latin1') # python 3
+        except:
+            sigma_tmp = pickle.load(open(cia_path)) # python 2
+
+        t = np.asarray(sigma_tmp['t'])
+        wno = sigma_tmp['wno']
+
+        # check cia wavenumber boundaries
+        if np.min(wno) > np.min(self.int_wngrid_native) or np.max(wno) < np.max(self.int_wngrid_native):
+            logging.warning('Internal wavenumber grid overflow for CIA xsec for %s' % pair_val)
+            logging.warning('Internal (native) wavenumber grid range: %f - %f' % (np.min(self.int_wngrid_native),
+                                                                         np.max(self.int_wngrid_native)))
+            logging.warning('CIA cross section wavenumber grid range: %f - %f' % (np.min(wno), np.max(wno)))
+            logging.warning('Assume cia to be zero outside the xsec range')
+
+        # reinterpolate cia xsec to the native grid, all temperatures at once
+        sigma_regrid = {'t': t,
+                        'xsecarr': interp_rows(np.asarray(sigma_tmp['xsecarr'], dtype=np.float64),
+                                               get_interp_weights(self.int_wngrid_native, wno))}
+
+        if self.opacity_cache:
+            self.opacity_cache.save(cache_key, sigma_regrid, {'pair': pair_val})
+
+        return sigma_regrid
+
     def load_mie_indices(self):
         '''
         Loading the refractive indices (real/imaginary) for the BH Mie model. 
@@ -784,6 +1048,74 @@ class data(object):
         #     self.intsp_nbingrid_full = len(self.obs_wlgrid)
 
 
+    def get_opacity_files(self, opacity_path, mol_val):
+
+        # cross section or ktable files available for the molecule mol_val in opacity_path (binary stores first).
+        # If the folder has an opacity catalogue (see tools/create_opacity_catalogue.py), files are resolved from the
+        # catalogue, without scanning the folder. Otherwise (or if the files of the molecule have changed since
+        # the catalogue was created) fall back to a case insensitive glob of the folder.
+        if not opacity_path in self.opacity_catalogues:
+            self.opacity_catalogues[opacity_path] = load_opacity_catalogue(opacity_path)
+            if self.opacity_catalogues[opacity_path]:
+                logging.info('Using the opacity catalogue of %s' % opacity_path)
+        catalogue = self.opacity_catalogues[opacity_path]
+
+        if catalogue:
+            entries = get_catalogue_entries(catalogue, mol_val)
+            if entries is not None:
+                return [os.path.join(opacity_path, entry['filename']) for entry in entries]
+
+        return sort_opacity_files(insensitive_glob(os.path.join(opacity_path, '%s_*' % mol_val))+
+                                  insensitive_glob(os.path.join(opacity_path, '%s.*' % mol_val)))
+
+    def get_opacity_catalogue_entry(self, opacity_path, filename):
+
+        # catalogue entry of a given file, among the checked entries of the molecules resolved so far
+        # (see get_opacity_files). None if there is no catalogue, or if the file is not resolved from it
+        catalogue = self.opacity_catalogues.get(opacity_path)
+        if catalogue:
+            for entries in catalogue['checked'].values():
+                for entry in entries or []:
+                    if entry['filename'] == os.path.basename(filename):
+                        return entry
+        return None
+
+    def get_wngrid_window(self):
+
+        # wavenumber range used by the atmosphere object, known before loading any cross section or ktable,
+        # so that only this window is loaded. Return None if the full range of the opacities is needed
+        if not self.params.in_wavenumber_window:
+            return None
+
+        numin = []
+        numax = []
+        if self.params.mode == 'retrieval':
+            # obs_spectrum grid, including the 10% margins of the extended grid
+            numin.append(0.9 * 10000/(self.obs_wlgrid[0] + self.obs_binwidths[0]/2.))
+            numax.append(1.1 * 10000/(self.obs_wlgrid[-1] - self.obs_binwidths[-1]/2.))
+        if self.params.gen_manual_waverange:
+            numin.append(10000/(self.params.gen_wavemax))
+            numax.append(10000/(self.params.gen_wavemin))
+
+        if len(numin) == 0:
+            return None
+        return min(numin), max(numax)
+
+    def get_wngrid_window_idx(self, wno):
+
+        # indexes of the wavenumber window in the opacity grid wno. The window is padded by a few points, so that
+        # the grids defined in load_wavenumber_grid are always inside it
+        window = self.get_wngrid_window()
+        if window is None:
+            return 0, len(wno)
+
+        idx_min = max(np.searchsorted(wno, window[0]) - 3, 0)
+        idx_max = min(np.searchsorted(wno, window[1]) + 3, len(wno))
+        logging.info('Load only the wavenumber window %.2f - %.2f (%i of %i points)' %
+                     (wno[idx_min], wno[idx_max-1], idx_max-idx_min, len(wno)))
+
+        return idx_min, idx_max
+
     def get_native_grid_range_idx(self, numin, numax, gridname):
 
         # restrict native wavenumber range to numin, numax. Return indexes of new range boundaries in native grid
@@ -856,14 +1188,16 @@ class data(object):
 
     def load_star_SED(self):
 
-        # reading in phoenix spectra from folder specified in parameter file
-        all_files = insensitive_glob(os.path.join(self.params.in_star_path, '*.fmt'))
-
-        temperatures = []
-        for filenm in all_files:
-            temp = np.float(os.path.basename(filenm).split('-')[0][3:])
-            temperatures.append(temp)
-        temperatures = np.sort(temperatures)
+        # reading in phoenix spectra from folder specified in parameter file. Use the indexed binary library
+        # if present (see tools/convert_star_library.py), otherwise the individual ascii files
+        library_filename = os.path.join(self.params.in_star_path, STAR_LIBRARY_NAME)
+        if os.path.isfile(library_filename):
+            star_library = read_star_library(library_filename)
+            temperatures = star_library['temperatures']
+        else:
+            star_library = None
+            all_files = insensitive_glob(os.path.join(self.params.in_star_path, '*.fmt'))
+            temperatures = np.sort([get_phoenix_temperature(filenm) for filenm in all_files])
 
         # reading in stellar file
         if self.params.star_use_blackbody or (self.params.star_temp > max(temperatures) or
@@ -881,14 +1215,33 @@ class data(object):
             [tmpselect, idx] = find_nearest(temperatures, self.params.star_temp)
             self.star_blackbody = False
 
-            for file in all_files: #this search is explicit due to compatibility issues with Mac and Linux sorting
-                if np.int(file.split('/')[-1][3:8]) == np.int(tmpselect):
-                    self.SED_filename = file
+            if star_library:
+                self.SED_filename = library_filename
+            else:
+                for file in all_files: #this search is explicit due to compatibility issues with Mac and Linux sorting
+                    if int(file.split('/')[-1][3:8]) == int(tmpselect):
+                        self.SED_filename = file
+
+            # SED already interpolated to the native grid, from the opacity cache
+            SED = None
+            if self.opacity_cache:
+                cache_key = self.opacity_cache.get_key('star_sed', get_file_identity(self.SED_filename),
+                                                       float(tmpselect), np.asarray(self.int_wngrid_native))
+                cached = self.opacity_cache.load(cache_key)
+                if cached:
+                    SED = cached['sed']
+
+            if SED is None:
+                #reading in correct file and interpolating it onto self.int_wngrid_obs
+                if star_library:
+                    SED_raw = get_star_library_spectrum(star_library, idx)
+                else:
+                    SED_raw = read_phoenix_spectrum(self.SED_filename)
+                SED_raw[:,1] *= 10.0 # #converting from ergs to SI
+                SED = np.interp(self.int_wlgrid_native, SED_raw[:,0], SED_raw[:,1])
 
-            #reading in correct file and interpolating it onto self.int_wngrid_obs
-            SED_raw = np.loadtxt(self.SED_filename, dtype='float', comments='#')
-            SED_raw[:,1] *= 10.0 # #converting from ergs to SI
-            SED = np.interp(self.int_wlgrid_native, SED_raw[:,0], SED_raw[:,1])
+                if self.opacity_cache:
+                    self.opacity_cache.save(cache_key, {'sed': SED}, {'temperature': float(tmpselect)})
 
         self.star_sed_native = SED
 
@@ -933,8 +1286,7 @@ class data(object):
                     opacity_path = self.params.in_ktab_path
 
                 # check that xsec for given molecule exists
-                molpath = insensitive_glob(os.path.join(opacity_path, '%s_*' % mol_val))+\
-                          insensitive_glob(os.path.join(opacity_path, '%s.*' % mol_val))
+                molpath = self.get_opacity_files(opacity_path, mol_val)
                 if len(molpath) <= 0: # we don't have xsec/ktable for this moluecule
                     excluded_molecules.append(mol_val)
 
@@ -101,8 +101,8 @@ class emission(object):
                  np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'),
                  np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'),
                  np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.ktables_array_flat
-                 np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # data.ktable_dict['t']
-                 C.c_int, # len(data.ktable_dict['t'])
+                 np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.sigma_temp
+                 C.c_int, # len(atmosphere.sigma_temp)
                  C.c_int, # data.ktable_dict['ngauss']
                  np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # data.ktable_dict['weights']
                  np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'),
@@ -122,11 +122,36 @@ class emission(object):
                  np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'),
                  C.c_void_p]
 
+    def model_batch(self, fit_params, update_atmospheric_parameters):
+
+        # forward models of a list of parameter vectors, returned as an array (nmodels x int_nwngrid).
+        # Same interface as transmission.model_batch, the models are computed one by one
+
+        models = np.zeros((len(fit_params), self.atmosphere.int_nwngrid))
+        for i in range(len(fit_params)):
+            update_atmospheric_parameters(fit_params[i])
+            models[i,:] = self.model()
+        return models
+
+    def model_binned(self, return_full=False, mixratio_mask=False):
+
+        # forward model binned to the observed spectrum (atmosphere.int_binning, mean in each bin).
+        # Same interface as transmission.model_binned, the binning is done in python
+
+        full = self.model(mixratio_mask=mixratio_mask)
+        binned = self.atmosphere.int_binning.apply(full)
+        if return_full:
+            return binned, full
+        return binned
+
     def ctypes_pathintegral(self, return_tau=False, mixratio_mask=False):
         
         if self.params.gen_ace:
             self.atmosphere.set_ACE(mixratio_mask)
 
+        # temperature slabs of the opacities needed by the current profile (lazy temperature mode)
+        self.atmosphere.set_opacity_temperature_window()
+
         #setting up output array
         FpFs = zeros((self.atmosphere.int_nwngrid), dtype=np.float64, order='C')
         tau = zeros((self.atmosphere.int_nwngrid*self.atmosphere.nlayers), dtype=np.float64, order='C')
@@ -144,11 +169,11 @@ class emission(object):
                                              self.atmosphere.mie_bottomP,
                                              self.atmosphere.pressure_profile,
                                              self.atmosphere.sigma_array_flat,
-                                             self.data.sigma_dict['t'],
-                                             len(self.data.sigma_dict['t']),
+                                             self.atmosphere.sigma_temp,
+                                             len(self.atmosphere.sigma_temp),
                                              self.atmosphere.sigma_rayleigh_array_flat,
                                              len(self.data.sigma_cia_dict['xsecarr']),
-                                             np.asarray(self.atmosphere.cia_idx, dtype=np.float),
+                                             np.asarray(self.atmosphere.cia_idx, dtype=float),
                                              len(self.atmosphere.cia_idx),
                                              self.atmosphere.sigma_cia_array_flat,
                                              self.data.sigma_cia_dict['t'],
@@ -167,32 +192,12 @@ class emission(object):
 
 
 
-        out = np.zeros((len(FpFs)))
-        out[:] = FpFs
-
         if return_tau:
-
-            tauout = np.zeros((self.atmosphere.int_nwngrid, self.atmosphere.nlayers))
-            for i in range(self.atmosphere.int_nwngrid):
-                for j in range(self.atmosphere.nlayers-1):
-                    tauout[i,j] = tau[i + j*self.atmosphere.int_nwngrid]
-
-            tauout = np.fliplr(np.rot90(tauout))
-
-            del(FpFs)
-            del(tau)
-
-            return tauout
-
+            # contribution function (nlayers x nwngrid, layers and wavenumbers in reverse order): view of the tau
+            # array filled by the kernel (tau[wn + layer*nwngrid])
+            return tau.reshape(self.atmosphere.nlayers, self.atmosphere.int_nwngrid)[::-1, ::-1]
         else:
-
-            out = np.zeros((len(FpFs)))
-            out[:] = FpFs
-
-            del(FpFs)
-            del(tau)
-
-            return out
+            return FpFs
 
     def ctypes_pathintegral_ktab(self, return_tau=False, mixratio_mask=False):
 
@@ -201,6 +206,9 @@ class emission(object):
 
             self.set_ACE(mixratio_mask)
 
+        # temperature slabs of the opacities needed by the current profile (lazy temperature mode)
+        self.atmosphere.set_opacity_temperature_window()
+
         #setting up output array
         FpFs = zeros((self.atmosphere.int_nwngrid), dtype=np.float64, order='C')
         tau = zeros((self.atmosphere.int_nwngrid*self.atmosphere.nlayers), dtype=np.float64, order='C')
@@ -219,13 +227,13 @@ class emission(object):
                                              self.atmosphere.pressure_profile,
                                              self.atmosphere.mie_opacity,
                                              self.atmosphere.ktables_array_flat,
-                                             self.data.ktable_dict['t'],
-                                             len(self.data.ktable_dict['t']),
+                                             self.atmosphere.sigma_temp,
+                                             len(self.atmosphere.sigma_temp),
                                              self.data.ktable_dict['ngauss'],
                                              self.data.ktable_dict['weights'],
                                              self.atmosphere.sigma_rayleigh_array_flat,
                                              len(self.data.sigma_cia_dict['xsecarr']),
-                                             np.asarray(self.atmosphere.cia_idx, dtype=np.float),
+                                             np.asarray(self.atmosphere.cia_idx, dtype=float),
                                              len(self.atmosphere.cia_idx),
                                              self.atmosphere.sigma_cia_array_flat,
                                              self.data.sigma_cia_dict['t'],
@@ -243,31 +251,11 @@ class emission(object):
 
 
 
-        out = np.zeros((len(FpFs)))
-        out[:] = FpFs
-
         if return_tau:
-
-            tauout = np.zeros((self.atmosphere.int_nwngrid, self.atmosphere.nlayers))
-            for i in range(self.atmosphere.int_nwngrid):
-                for j in range(self.atmosphere.nlayers-1):
-                    tauout[i,j] = tau[i + j*self.atmosphere.int_nwngrid]
-
-            tauout = np.fliplr(np.rot90(tauout))
-
-            del(FpFs)
-            del(tau)
-
-            return tauout
-
+            # contribution function (nlayers x nwngrid, layers and wavenumbers in reverse order): view of the tau
+            # array filled by the kernel (tau[wn + layer*nwngrid])
+            return tau.reshape(self.atmosphere.nlayers, self.atmosphere.int_nwngrid)[::-1, ::-1]
         else:
-
-            out = np.zeros((len(FpFs)))
-            out[:] = FpFs
-
-            del(FpFs)
-            del(tau)
-
-            return out
+            return FpFs
 
 
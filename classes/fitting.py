@@ -66,6 +66,15 @@ class fitting(object):
         self.forwardmodel = forwardmodel
 
         self.forwardmodel_type = type(forwardmodel).__name__ #used???
+
+        # full resolution spectrum of the last likelihood evaluation (only if Fitting->return_full_spectrum)
+        self.model_full = None
+
+        # values of the parameter groups (composition, temperature, radius, clouds, mie) of the last call of
+        # update_atmospheric_parameters, wavenumber grid of that call, and groups changed by that call
+        self.fit_params_groups = None
+        self.fit_params_wngrid = None
+        self.changed_parameters = None
         logging.info('Radiative transfer model: %s' % self.forwardmodel_type)
 
         # MPI support
@@ -444,6 +453,7 @@ class fitting(object):
 
 
         count = 0 # used to iterate over fit_params[count]
+        groups = {} # values of each group of parameters, to find the groups changed since the last call
 
         if not self.params.gen_ace: # not using the chemically consistent model
 
@@ -495,6 +505,8 @@ class fitting(object):
 
                 count += 1
 
+            groups['composition'] = list(fit_params[:count])
+
         ####################################################################################
         # Mixing ratios of all gases are transformed using a centered-log-ratio transformation.
         # * NOT WORKING
@@ -526,6 +538,7 @@ class fitting(object):
             if self.params.fit_fit_ace_co: # c/o ratio
                 self.atmosphere.ace_co = fit_params[count]
                 count += 1
+            groups['composition'] = list(fit_params[:count])
 
         ####################################################################################
         # Temperature-pressure profile
@@ -534,6 +547,7 @@ class fitting(object):
             TP_params = fit_params[count:count+self.fit_TP_nparams]
             self.forwardmodel.atmosphere.temperature_profile = self.forwardmodel.atmosphere.TP_profile(fit_params=TP_params)
             count += self.fit_TP_nparams
+            groups['temperature'] = list(TP_params)
 
         # #####################################################
         # # Mean molecular weight.
@@ -572,6 +586,7 @@ class fitting(object):
         # Radius
         if self.params.fit_fit_radius:
             self.forwardmodel.atmosphere.planet_radius = fit_params[count]*RJUP
+            groups['radius'] = list(fit_params[count:count+1])
             count += 1
 
         # #####################################################
@@ -585,11 +600,13 @@ class fitting(object):
         # Clouds pressure
         if self.params.fit_fit_clouds_pressure:
             self.forwardmodel.atmosphere.clouds_pressure = np.power(10, fit_params[count])
+            groups['clouds'] = list(fit_params[count:count+1])
             count += 1
             
         ####################################################################################
         # Mie scattering
         if self.params.fit_fit_mie:
+            mie_start = count
             self.forwardmodel.atmosphere.mie_f = np.power(10,fit_params[count])
             count += 1
             if self.params.fit_fit_mie_radius:
@@ -606,6 +623,7 @@ class fitting(object):
             if self.params.fit_fit_mie_cloud_bottomP:
                 self.forwardmodel.atmosphere.mie_topP = np.power(10,fit_params[count])
                 count += 1
+            groups['mie'] = list(fit_params[mie_start:count])
 
         # if self.params.fit_fit_P0:
         # DEPRECTED
@@ -615,23 +633,38 @@ class fitting(object):
         # END. All parameters have been extracted from fit_params
         ####################################################################################
 
+        # groups of parameters changed since the last call (all of them in the first call, or if the wavenumber
+        # grid has been changed, e.g. by output). The profiles depending only on unchanged groups are not updated,
+        # e.g. only the altitude profile when only the radius changes. The transmission model then reuses the
+        # extinction of the layers (see transmission.use_extinction_cache)
+        if self.fit_params_groups is None or self.fit_params_wngrid is not self.atmosphere.int_wngrid:
+            changed = set(groups)
+        else:
+            changed = set([name for name in groups if groups[name] != self.fit_params_groups.get(name)])
+        self.fit_params_groups = groups
+        self.fit_params_wngrid = self.atmosphere.int_wngrid
+        self.changed_parameters = changed
+        self.forwardmodel.changed_parameters = changed # the transmission model reuses the extinction of the layers
+
         # Update the state of the atmosphere
 
-        self.atmosphere.set_mu_profile() # update the planet mmw
+        if 'composition' in changed or self.params.gen_ace:
+            self.atmosphere.set_mu_profile() # update the planet mmw
 
-        if self.fit_TP_nparams > 0:  # density profile changes only if the temperature changes
+        if self.fit_TP_nparams > 0 and 'temperature' in changed:  # density profile changes only if the temperature changes
             self.forwardmodel.atmosphere.set_density_profile()
 
         if not self.params.gen_ace:
             # update altitude, gravity and scale height profile
-            self.forwardmodel.atmosphere.set_altitude_gravity_scaleheight_profile()
+            if changed & set(['composition', 'temperature', 'radius']):
+                self.forwardmodel.atmosphere.set_altitude_gravity_scaleheight_profile()
         else:
             # if running the chiemical consistent model, set the corresponding parameters (this will use
             # atmosphere.ace_metallicity and atmosphere.ace_co set above
             self.forwardmodel.atmosphere.set_ace_params()
             # Note that if gen_ace is True, set_altitude_gravity_scaleheight_profile is called from the
             # transmission/emission object
-        if self.params.fit_fit_mie: #updates mie scattering slope
+        if self.params.fit_fit_mie and 'mie' in changed: #updates mie scattering slope
             self.forwardmodel.atmosphere.get_mie_opacities()
 
 
@@ -642,14 +675,15 @@ class fitting(object):
         self.update_atmospheric_parameters(fit_params)
         
         # get forward model and bin
-        model_out = self.forwardmodel.model()
-
         if self.params.in_opacity_method in ['xsec_sampled', 'xsec_lowres', 'xsec']:
-            # bin if using sampled cross sections
-            model = [model_out[self.atmosphere.int_bingrididx == i].mean() for i in range(1, self.atmosphere.int_nbingrid+1)]
-            #model_binned = cy_fun.runtime_bin_spectrum(model, self.atmosphere.int_bingrididx, self.atmosphere.int_nbingrid)
+            # bin if using sampled cross sections (done by the forward model kernel)
+            if self.params.fit_return_full_spectrum:
+                model, self.model_full = self.forwardmodel.model_binned(return_full=True)
+            else:
+                model = self.forwardmodel.model_binned()
         elif self.params.in_opacity_method in ['ktab', 'ktable', 'ktables']:
             # interpolate if using ktables
+            model_out = self.forwardmodel.model()
             model = np.interp(self.data.obs_wngrid, self.atmosphere.int_wngrid, model_out)
 
         # get chi2
@@ -45,6 +45,10 @@ class output(object):
 
         self.nthreads = nthreads
 
+        # temperature slabs of the opacities used during the fit
+        if self.params.in_lazy_temperature:
+            self.atmosphere.log_opacity_slabs()
+
         types = ['downhill', 'mcmc', 'nest']
         func_types = [self.store_downhill_solution,
                       self.store_mcmc_solutions,
@@ -283,8 +287,7 @@ class output(object):
 
         wavegrid  = self.atmosphere.int_wngrid
         nwavegrid = self.atmosphere.int_nwngrid
-        bingrid   = self.atmosphere.int_bingrididx
-        nbingrid = self.atmosphere.int_nbingrid
+        binning   = self.atmosphere.int_binning
 
         # update atmospheric parameters to current solution
         self.fitting.update_atmospheric_parameters(fit_params)
@@ -304,12 +307,10 @@ class output(object):
 
         if self.params.in_opacity_method in ['xsec_sampled', 'xsec_lowres', 'xsec']:
             # bin if using sampled cross sections
-            solution['obs_spectrum'][:,3] = np.asarray([model[bingrid == i].mean()
-                                                       for i in range(1, nbingrid+1)])
+            solution['obs_spectrum'][:,3] = binning.apply(model)
         elif self.params.in_opacity_method in ['ktab', 'ktable', 'ktables']:
             # interpolate if using ktables @todo interpolation doesnt work very well, temporarily switched it to binning 
-            solution['obs_spectrum'][:,3] = np.asarray([model[bingrid == i].mean()
-                                                       for i in range(1, nbingrid+1)])
+            solution['obs_spectrum'][:,3] = binning.apply(model)
 #             solution['obs_spectrum'][:,3] =  np.interp(self.data.obs_wlgrid[::-1], self.atmosphere.int_wlgrid[::-1], model)
             
 
@@ -324,12 +325,10 @@ class output(object):
 
             if self.params.in_opacity_method in ['xsec_sampled', 'xsec_lowres', 'xsec']:
                 # bin if using sampled cross sections
-                solution['obs_spectrum'][:,4] = np.asarray([sigmasp[bingrid == i].mean()
-                                                           for i in range(1, nbingrid+1)])
+                solution['obs_spectrum'][:,4] = binning.apply(sigmasp)
             elif self.params.in_opacity_method in ['ktab', 'ktable', 'ktables']:
                 # interpolate if using ktables @todo interpolation doesnt work very well, temporarily switched it to binning 
-                solution['obs_spectrum'][:,4] = np.asarray([sigmasp[bingrid == i].mean()
-                                                           for i in range(1, nbingrid+1)])
+                solution['obs_spectrum'][:,4] = binning.apply(sigmasp)
 #                 solution['obs_spectrum'][:,4] =  np.interp(self.data.obs_wlgrid[::-1], self.atmosphere.int_wlgrid[::-1], sigmasp)
 
         # calculate contribution function
@@ -463,15 +462,15 @@ class output(object):
         weights = []
         nspectra = int(self.params.out_sigma_spectrum_frac * np.shape(solution['tracedata'])[0])
 
-        models = np.zeros((nspectra, self.atmosphere.int_nwngrid)) # number of possible combinations
         weights = np.zeros((nspectra))
+        fit_params_iter = []
         for i in range(nspectra):
             rand_idx = random.randint(0, np.shape(solution['tracedata'])[0])
-            fit_params_iter = solution['tracedata'][rand_idx]
+            fit_params_iter.append(solution['tracedata'][rand_idx])
             weights[i] = solution['weights'][rand_idx]
-            self.fitting.update_atmospheric_parameters(fit_params_iter)
-            model = self.fitting.forwardmodel.model()
-            models[i, :] = self.fitting.forwardmodel.model()
+
+        # all the sampled models in one batch
+        models = self.fitting.forwardmodel.model_batch(fit_params_iter, self.fitting.update_atmospheric_parameters)
 
         std_spectrum = np.zeros((self.atmosphere.int_nwngrid))
         for i in range(self.atmosphere.int_nwngrid):
@@ -120,6 +120,10 @@ class parameters(object):
         self.gen_type              = self.getpar('General','type')
         self.gen_ace              = self.getpar('General','ace', 'bool')
         self.gen_compile_cpp       = self.getpar('General','compile_cpp', 'bool')
+        self.gen_mpi_shared_opacity = self.getpar('General','mpi_shared_opacity', 'bool')
+        self.gen_mpi_broadcast_data = self.getpar('General','mpi_broadcast_data', 'bool')
+        self.gen_transmission_kernel = self.getpar('General','transmission_kernel')
+        self.gen_tau_saturation    = self.getpar('General','tau_saturation', 'float')
         self.gen_run_gui           = False
 
         # section Input
@@ -133,6 +137,15 @@ class parameters(object):
         self.in_xsec_path          = self.getpar('Input','xsec_path')
         self.in_ktab_path          = self.getpar('Input','ktab_path')
         self.in_custom_temp_range  = self.getpar('Input','custom_temp_range', 'list-float')
+        self.in_load_nthreads      = self.getpar('Input','load_nthreads', 'int')
+        self.in_prefetch_data      = self.getpar('Input','prefetch_data', 'bool')
+        self.in_lazy_temperature   = self.getpar('Input','lazy_temperature', 'bool')
+        self.in_lazy_temperature_slabs = self.getpar('Input','lazy_temperature_slabs', 'int')
+        self.in_wavenumber_window  = self.getpar('Input','wavenumber_window', 'bool')
+        self.in_wavenumber_culling = self.getpar('Input','wavenumber_culling', 'bool')
+        self.in_opacity_cache_path = self.getpar('Input','opacity_cache_path')
+        self.in_opacity_cache_size = self.getpar('Input','opacity_cache_size', 'float')
+        self.in_opacity_grids      = self.getpar('Input','opacity_grids', 'int')
 
         self.in_cia_path           = self.getpar('Input','cia_path')
         self.in_mie_path           = self.getpar('Input','mie_path')
@@ -226,6 +239,7 @@ class parameters(object):
         #self.fit_couple_mu           = self.getpar('Fitting','couple_mu', 'bool')
         #self.fit_inactive_mu_rescale = self.getpar('Fitting','inactive_mu_rescale', 'bool')
         self.fit_mixratio_log        = self.getpar('Fitting','mixratio_log', 'bool')
+        self.fit_return_full_spectrum = self.getpar('Fitting','return_full_spectrum', 'bool')
         #self.fit_clr_trans           = self.getpar('Fitting','clr_trans', 'bool')
 
         # fit / fix parameters
@@ -11,6 +11,7 @@
 import numpy
 import ctypes as C
 import numpy as np
+import scipy.linalg.blas as blas
 
 from library_constants import *
 from library_general import *
@@ -85,11 +86,54 @@ class transmission(object):
                 C.c_void_p,
                 C.c_void_p]
 
+            self.pathintegral_lib.init_context.restype = C.c_void_p
+            self.pathintegral_lib.init_context.argtypes = [
+                C.c_int, # atmosphere.int_nwngrid
+                C.c_int, # atmosphere.nlayers
+                C.c_int, # atmosphere.nactivegases
+                C.c_int, # atmosphere.ninactivegases
+                C.c_int, # params.atm_rayleigh
+                C.c_int, # params.atm_mie
+                C.c_int, # params.atm_cia
+                C.c_int, # params.atm_clouds
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.sigma_array_flat
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.sigma_temp
+                C.c_int, # len(atmosphere.sigma_temp)
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.sigma_rayleigh_array_flat
+                C.c_int, # number of cia pairs
+                np.ctypeslib.ndpointer(dtype=np.double, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.cia_idx
+                C.c_int, # len(atmosphere.cia_idx)
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.sigma_cia_array_flat
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # data.sigma_cia_dict['t']
+                C.c_int] # len(data.sigma_cia_dict['t'])
+
+            # matrix form of the path integral
+            self.pathintegral_lib.extinction.argtypes = [
+                C.c_void_p, # kernel context
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.density_profile
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.active_mixratio_profile
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.inactive_mixratio_profile
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.temperature_profile
+                C.c_void_p] # extinction
+            self.pathintegral_lib.path_lengths.argtypes = [
+                C.c_void_p, # kernel context
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.altitude_profile
+                C.c_double, # atmosphere.planet_radius
+                C.c_void_p, # path lengths
+                C.c_void_p] # dz
+
+            if self.params.gen_transmission_kernel == 'matrix':
+                logging.info('Use matrix form of the transmission path integral')
+                self.model = self.matrix_pathintegral_xsec
+
 
         elif self.params.in_opacity_method in ['ktab', 'ktable', 'ktables']: # using k tables
             # loading c++ pathintegral library
             self.pathintegral_lib = C.CDLL('./library/ctypes_pathintegral_transmission_ktab.so', mode=C.RTLD_GLOBAL)
             self.model = self.ctypes_pathintegral_ktab
+            if self.params.gen_transmission_kernel == 'matrix':
+                logging.warning('The matrix form of the transmission path integral is only available for cross '
+                                'sections. Using the loop path integral for k-tables')
             # set arguments for ctypes libraries
             self.pathintegral_lib.path_integral.argtypes = [
                 C.c_int, # atmosphere.int_nwngrid
@@ -101,8 +145,8 @@ class transmission(object):
                 C.c_int, # params.atm_cia
                 C.c_int, # params.atm_clouds
                 np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.ktables_array_flat
-                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # data.ktable_dict['t']
-                C.c_int, # len(data.ktable_dict['t'])
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.sigma_temp
+                C.c_int, # len(atmosphere.sigma_temp)
                 C.c_int, # data.ktable_dict['ngauss']
                 np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # data.ktable_dict['weights']
                 np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'),
@@ -127,140 +171,445 @@ class transmission(object):
                 C.c_void_p,
                 C.c_void_p]
 
+            self.pathintegral_lib.init_context.restype = C.c_void_p
+            self.pathintegral_lib.init_context.argtypes = [
+                C.c_int, # atmosphere.int_nwngrid
+                C.c_int, # atmosphere.nlayers
+                C.c_int, # atmosphere.nactivegases
+                C.c_int, # atmosphere.ninactivegases
+                C.c_int, # params.atm_rayleigh
+                C.c_int, # params.atm_mie
+                C.c_int, # params.atm_cia
+                C.c_int, # params.atm_clouds
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.ktables_array_flat
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.sigma_temp
+                C.c_int, # len(atmosphere.sigma_temp)
+                C.c_int, # data.ktable_dict['ngauss']
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # data.ktable_dict['weights']
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.sigma_rayleigh_array_flat
+                C.c_int, # number of cia pairs
+                np.ctypeslib.ndpointer(dtype=np.double, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.cia_idx
+                C.c_int, # len(atmosphere.cia_idx)
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.sigma_cia_array_flat
+                np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # data.sigma_cia_dict['t']
+                C.c_int] # len(data.sigma_cia_dict['t'])
+
+        # kernel context of the c++ path integral (see get_kernel_context)
+        self.kernel_context = None
+        self.kernel_inputs = None
+        self.kernel_bins = None
+
+        # extinction of the layers (cross sections, see get_extinction) and the inputs it was computed with
+        self.extinction = None
+        self.extinction_inputs = None
+
+        # parameter groups changed by the last fitting step (set by fitting.update_atmospheric_parameters), see
+        # use_extinction_cache
+        self.changed_parameters = None
+        self.pathintegral_lib.evaluate.argtypes = [
+            C.c_void_p, # kernel context
+            C.c_double, # atmosphere.clouds_pressure
+            C.c_double, # atmosphere.mie_topP
+            C.c_double, # atmosphere.mie_bottomP
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.mie_opacity
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.pressure_profile
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.density_profile
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.altitude_profile
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.active_mixratio_profile
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.inactive_mixratio_profile
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # atmosphere.temperature_profile
+            C.c_double, # atmosphere.planet_radius
+            C.c_double, # params.star_radius
+            C.c_void_p, # absorption
+            C.c_void_p] # tau
+        self.pathintegral_lib.free_context.argtypes = [C.c_void_p]
+        self.pathintegral_lib.set_tau_saturation.argtypes = [
+            C.c_void_p, # kernel context
+            C.c_double] # params.gen_tau_saturation
+        self.pathintegral_lib.set_bins.argtypes = [
+            C.c_void_p, # kernel context
+            C.c_int, # number of bins
+            np.ctypeslib.ndpointer(dtype=np.int32, ndim=1, flags='C_CONTIGUOUS'), # bin of each wavenumber
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS')] # weight of each wavenumber
+        self.pathintegral_lib.evaluate_binned.argtypes = self.pathintegral_lib.evaluate.argtypes[:-2] + [
+            C.c_void_p, # binned spectrum
+            C.c_void_p] # full resolution spectrum (or None)
+        self.pathintegral_lib.evaluate_batch.argtypes = [
+            C.c_void_p, # kernel context
+            C.c_int, # number of models
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # clouds_pressure of each model
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # mie_topP of each model
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # mie_bottomP of each model
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # mie_opacity, stacked
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # pressure_profile, stacked
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # density_profile, stacked
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # altitude_profile, stacked
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # active_mixratio_profile, stacked
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # inactive_mixratio_profile, stacked
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # temperature_profile, stacked
+            np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS'), # planet_radius of each model
+            C.c_double, # params.star_radius
+            C.c_void_p] # absorption (nmodels x nwngrid)
+
+
+    def get_kernel_context(self):
+
+        # the inputs of the c++ path integral that do not change between forward model calls (opacities,
+        # temperature and wavenumber grids, cia indexes, flags) are registered once in a kernel context, that
+        # also owns the scratch memory of the path integral. A new context is created only if one of these
+        # inputs has changed (e.g. new wavenumber grid or temperature window of the opacities, or contributions
+        # switched off in the opacity contributions)
+
+        if self.params.in_opacity_method in ['ktab', 'ktable', 'ktables']:
+            opacity_inputs = [self.atmosphere.ktables_array_flat,
+                              self.atmosphere.sigma_temp,
+                              len(self.atmosphere.sigma_temp),
+                              self.data.ktable_dict['ngauss'],
+                              self.data.ktable_dict['weights']]
+        else:
+            opacity_inputs = [self.atmosphere.sigma_array_flat,
+                              self.atmosphere.sigma_temp,
+                              len(self.atmosphere.sigma_temp)]
+
+        inputs = [self.atmosphere.int_nwngrid,
+                  self.atmosphere.nlayers,
+                  self.atmosphere.nactivegases,
+                  self.atmosphere.ninactivegases,
+                  self.params.atm_rayleigh,
+                  self.params.atm_mie,
+                  self.params.atm_cia,
+                  self.params.atm_clouds] + opacity_inputs + [
+                  self.atmosphere.sigma_rayleigh_array_flat,
+                  len(self.data.sigma_cia_dict['xsecarr']),
+                  self.atmosphere.cia_idx,
+                  len(self.atmosphere.cia_idx),
+                  self.atmosphere.sigma_cia_array_flat,
+                  self.data.sigma_cia_dict['t'],
+                  len(self.data.sigma_cia_dict['t'])]
+
+        if self.kernel_context is not None:
+            # arrays are compared by identity: the context only keeps pointers to them
+            if all([new is old if isinstance(new, np.ndarray) else new == old
+                    for new, old in zip(inputs, self.kernel_inputs)]):
+                return self.kernel_context
+            self.free_kernel_context()
+
+        # the cia indexes are copied by the context
+        args = [np.asarray(arg, dtype=np.float64) if arg is self.atmosphere.cia_idx else arg for arg in inputs]
+        self.kernel_context = C.c_void_p(self.pathintegral_lib.init_context(*args))
+        self.kernel_inputs = inputs # keep a reference to the arrays used by the context
+        self.pathintegral_lib.set_tau_saturation(self.kernel_context, self.params.gen_tau_saturation)
+
+        return self.kernel_context
+
+    def free_kernel_context(self):
+
+        if self.kernel_context is not None:
+            self.pathintegral_lib.free_context(self.kernel_context)
+            self.kernel_context = None
+            self.kernel_inputs = None
+            self.kernel_bins = None
+            self.extinction = None
+            self.extinction_inputs = None
+
+    def __del__(self):
+
+        if getattr(self, 'kernel_context', None) is not None:
+            self.free_kernel_context()
+
+    def get_extinction_profiles(self):
+
+        # profiles the extinction of the layers depends on (with the opacities of the kernel context)
+        return [self.atmosphere.density_profile,
+                self.atmosphere.active_mixratio_profile.ravel(),
+                self.atmosphere.inactive_mixratio_profile.ravel(),
+                self.atmosphere.temperature_profile]
+
+    def set_extinction_inputs(self, context):
+
+        # register the inputs of the current model. The extinction itself is only computed if a later model
+        # has the same inputs (see get_extinction)
+        self.extinction = None
+        self.extinction_inputs = [context] + [np.copy(profile) for profile in self.get_extinction_profiles()]
+
+    def same_extinction_inputs(self, context):
+
+        # True if the extinction of the layers is the same as in the last model, i.e. only the radius, the clouds
+        # or mie scattering have changed (e.g. radius steps of the fit, see fitting.update_atmospheric_parameters)
+        if self.extinction_inputs is None or self.extinction_inputs[0] is not context:
+            return False
+        return all([np.array_equal(new, old) for new, old in zip(self.get_extinction_profiles(),
+                                                                 self.extinction_inputs[1:])])
+
+    def use_extinction_cache(self, context):
+
+        # True if the model can be computed from the cached extinction of the layers. This is only done for the
+        # model following a fitting step that changed the radius, the clouds or mie scattering only, and not with
+        # tau_saturation (the matrix form of the path integral does not stop saturated lines of sight). Otherwise
+        # the loop kernel is used, so that the spectrum of a set of parameters does not depend on the previous model
+        changed = self.changed_parameters
+        self.changed_parameters = None
+        if changed and changed <= set(['radius', 'clouds', 'mie']) and self.params.gen_tau_saturation <= 0 and \
+                self.same_extinction_inputs(context):
+            return True
+        self.set_extinction_inputs(context)
+        return False
+
+    def get_extinction(self, context):
+
+        # extinction of each layer (nlayers x nwngrid), computed by the c++ kernel without mie scattering and clouds.
+        # It is kept until the opacities or the density, mixing ratio and temperature profiles change
+
+        if not self.same_extinction_inputs(context):
+            self.set_extinction_inputs(context)
+        if self.extinction is None:
+            self.extinction = np.zeros((self.atmosphere.nlayers, self.atmosphere.int_nwngrid), dtype=np.float64,
+                                       order='C')
+            self.pathintegral_lib.extinction(context,
+                                             self.atmosphere.density_profile,
+                                             self.atmosphere.active_mixratio_profile.ravel(),
+                                             self.atmosphere.inactive_mixratio_profile.ravel(),
+                                             self.atmosphere.temperature_profile,
+                                             C.c_void_p(self.extinction.ctypes.data))
+        return self.extinction
+
+    def model_binned(self, return_full=False, mixratio_mask=False):
+
+        # forward model binned to the observed spectrum (atmosphere.int_binning, mean in each bin). The binning
+        # is done in the c++ kernel (evaluate_binned), so that the full resolution spectrum is not returned to python
+        # unless return_full is True. In that case returns (binned spectrum, full resolution spectrum)
+
+        if self.model == self.matrix_pathintegral_xsec:
+            full = self.model(mixratio_mask=mixratio_mask)
+            binned = self.atmosphere.int_binning.apply(full)
+            if return_full:
+                return binned, full
+            return binned
+
+        if self.params.gen_ace:
+            self.atmosphere.set_ACE(mixratio_mask)
+
+        # temperature slabs of the opacities needed by the current profile (lazy temperature mode)
+        self.atmosphere.set_opacity_temperature_window()
+
+        context = self.get_kernel_context()
+
+        if self.model == self.ctypes_pathintegral_xsec and self.use_extinction_cache(context):
+            # same extinction as the last model: matrix form of the path integral (see ctypes_pathintegral_xsec)
+            full = self.matrix_path_integral(self.get_extinction(context))
+            binned = self.atmosphere.int_binning.apply(full)
+            if return_full:
+                return binned, full
+            return binned
+
+        bins = self.atmosphere.int_binning
+        if self.kernel_bins is not bins:
+            self.pathintegral_lib.set_bins(context, bins.nbins, bins.bin_idx, bins.bin_weight)
+            self.kernel_bins = bins
+
+        binned = zeros((bins.nbins), dtype=np.float64, order='C')
+        if return_full:
+            full = zeros((self.atmosphere.int_nwngrid), dtype=np.float64, order='C')
+            full_pointer = C.c_void_p(full.ctypes.data)
+        else:
+            full_pointer = None
+
+        self.pathintegral_lib.evaluate_binned(context,
+                                              self.atmosphere.clouds_pressure,
+                                              self.atmosphere.mie_topP,
+                                              self.atmosphere.mie_bottomP,
+                                              self.atmosphere.mie_opacity,
+                                              self.atmosphere.pressure_profile,
+                                              self.atmosphere.density_profile,
+                                              self.atmosphere.altitude_profile,
+                                              self.atmosphere.active_mixratio_profile.ravel(),
+                                              self.atmosphere.inactive_mixratio_profile.ravel(),
+                                              self.atmosphere.temperature_profile,
+                                              self.atmosphere.planet_radius,
+                                              self.params.star_radius,
+                                              C.c_void_p(binned.ctypes.data),
+                                              full_pointer)
+
+        if return_full:
+            return binned, full
+        return binned
+
+    # atmosphere attributes passed to the kernel for each model of a batch (see model_batch)
+    batch_profiles = ['clouds_pressure', 'mie_topP', 'mie_bottomP', 'mie_opacity', 'pressure_profile',
+                      'density_profile', 'altitude_profile', 'active_mixratio_profile', 'inactive_mixratio_profile',
+                      'temperature_profile', 'planet_radius']
+
+    def model_batch(self, fit_params, update_atmospheric_parameters):
+
+        # forward models of a list of parameter vectors, returned as an array (nmodels x int_nwngrid).
+        # update_atmospheric_parameters (e.g. fitting.update_atmospheric_parameters) sets the state of the atmosphere
+        # for one parameter vector. The profiles of all the models are collected first, and the path integral of all
+        # the models is computed in one call of the c++ kernel (evaluate_batch), parallelised over the models in the
+        # openmp version. In lazy temperature mode (the opacity window depends on the temperature profile) and with
+        # the matrix path integral, the models are computed one by one.
+        # The atmosphere is left in the state of the last parameter vector.
+
+        nmodels = len(fit_params)
+
+        if self.atmosphere.lazy_temperature or self.model == self.matrix_pathintegral_xsec:
+            models = np.zeros((nmodels, self.atmosphere.int_nwngrid))
+            for i in range(nmodels):
+                update_atmospheric_parameters(fit_params[i])
+                models[i,:] = self.model()
+            return models
+
+        profiles = dict((name, []) for name in self.batch_profiles)
+        for i in range(nmodels):
+            update_atmospheric_parameters(fit_params[i])
+            if self.params.gen_ace:
+                self.atmosphere.set_ACE(False)
+            for name in self.batch_profiles:
+                profiles[name].append(np.array(getattr(self.atmosphere, name), dtype=np.float64).ravel())
+
+        self.changed_parameters = None
+
+        absorption = np.zeros((nmodels, self.atmosphere.int_nwngrid), dtype=np.float64, order='C')
+        self.pathintegral_lib.evaluate_batch(self.get_kernel_context(),
+                                             nmodels,
+                                             *([np.concatenate(profiles[name]) for name in self.batch_profiles] +
+                                               [self.params.star_radius, C.c_void_p(absorption.ctypes.data)]))
+
+        return absorption
 
     def ctypes_pathintegral_xsec(self, return_tau=False, mixratio_mask=False):
 
         if self.params.gen_ace:
             self.atmosphere.set_ACE(mixratio_mask)
 
+        # temperature slabs of the opacities needed by the current profile (lazy temperature mode)
+        self.atmosphere.set_opacity_temperature_window()
+
+        # if only the radius, the clouds or mie scattering have changed since the last model, the optical depths
+        # are obtained from the cached extinction of the layers with the matrix form of the path integral, instead
+        # of integrating the cross sections along each line of sight again (see use_extinction_cache)
+        context = self.get_kernel_context()
+        if self.use_extinction_cache(context):
+            return self.matrix_path_integral(self.get_extinction(context), return_tau=return_tau)
+
         #setting up output array
         absorption = zeros((self.atmosphere.int_nwngrid), dtype=np.float64, order='C')
         tau = zeros((self.atmosphere.int_nwngrid*self.atmosphere.nlayers), dtype=np.float64, order='C')
 
         
         #running c++ path integral
-        self.pathintegral_lib.path_integral(self.atmosphere.int_nwngrid,
-                                            self.atmosphere.nlayers,
-                                            self.atmosphere.nactivegases,
-                                            self.atmosphere.ninactivegases,
-                                            self.params.atm_rayleigh,
-                                            self.params.atm_mie,
-                                            self.params.atm_cia,
-                                            self.params.atm_clouds,
-                                            self.atmosphere.sigma_array_flat,
-                                            self.data.sigma_dict['t'],
-                                            len(self.data.sigma_dict['t']),
-                                            self.atmosphere.sigma_rayleigh_array_flat,
-                                            len(self.data.sigma_cia_dict['xsecarr']),
-                                            np.asarray(self.atmosphere.cia_idx, dtype=np.float),
-                                            len(self.atmosphere.cia_idx),
-                                            self.atmosphere.sigma_cia_array_flat,
-                                            self.data.sigma_cia_dict['t'],
-                                            len(self.data.sigma_cia_dict['t']),
-                                            self.atmosphere.clouds_pressure,
-                                            self.atmosphere.mie_topP,
-                                            self.atmosphere.mie_bottomP,
-                                            self.atmosphere.mie_opacity,
-                                            self.atmosphere.pressure_profile,
-                                            self.atmosphere.density_profile,
-                                            self.atmosphere.altitude_profile,
-                                            self.atmosphere.active_mixratio_profile.flatten(),
-                                            self.atmosphere.inactive_mixratio_profile.flatten(),
-                                            self.atmosphere.temperature_profile,
-                                            self.atmosphere.planet_radius,
-                                            self.params.star_radius,
-                                            C.c_void_p(absorption.ctypes.data),
-                                            C.c_void_p(tau.ctypes.data))
-
-        out = np.zeros((len(absorption)))
-        out[:] = absorption
+        self.pathintegral_lib.evaluate(context,
+                                       self.atmosphere.clouds_pressure,
+                                       self.atmosphere.mie_topP,
+                                       self.atmosphere.mie_bottomP,
+                                       self.atmosphere.mie_opacity,
+                                       self.atmosphere.pressure_profile,
+                                       self.atmosphere.density_profile,
+                                       self.atmosphere.altitude_profile,
+                                       self.atmosphere.active_mixratio_profile.ravel(),
+                                       self.atmosphere.inactive_mixratio_profile.ravel(),
+                                       self.atmosphere.temperature_profile,
+                                       self.atmosphere.planet_radius,
+                                       self.params.star_radius,
+                                       C.c_void_p(absorption.ctypes.data),
+                                       C.c_void_p(tau.ctypes.data))
 
         if return_tau:
+            # contribution function (nlayers x nwngrid, layers and wavenumbers in reverse order): view of the tau
+            # array filled by the kernel (tau[wn + layer*nwngrid])
+            return tau.reshape(self.atmosphere.nlayers, self.atmosphere.int_nwngrid)[::-1, ::-1]
+        else:
+            return absorption
 
-            tauout = np.zeros((self.atmosphere.int_nwngrid, self.atmosphere.nlayers))
-            for i in range(self.atmosphere.int_nwngrid):
-                for j in range(self.atmosphere.nlayers):
-                    tauout[i,j] = tau[i + j*self.atmosphere.int_nwngrid]
-            tauout = np.fliplr(np.rot90(tauout))
 
-            del(absorption)
-            del(tau)
+    def matrix_pathintegral_xsec(self, return_tau=False, mixratio_mask=False):
 
-            return tauout
+        # matrix form of the path integral (transmission_kernel = matrix). The c++ kernel returns the extinction
+        # of each layer (nlayers x nwngrid) and the path lengths matrix (upper triangular, nlayers x nlayers).
+        # The optical depths of all the lines of sight are their product, computed with one BLAS call (dtrmm)
 
-        else:
+        if self.params.gen_ace:
+            self.atmosphere.set_ACE(mixratio_mask)
+
+        # temperature slabs of the opacities needed by the current profile (lazy temperature mode)
+        self.atmosphere.set_opacity_temperature_window()
+
+        context = self.get_kernel_context()
+        return self.matrix_path_integral(self.get_extinction(context), return_tau=return_tau)
+
+    def matrix_path_integral(self, extinction, return_tau=False):
+
+        # path integral in matrix form from the extinction of the layers (see get_extinction): only the path
+        # lengths depend on the radius and altitude profile
+
+        nlayers = self.atmosphere.nlayers
+        path = np.zeros((nlayers, nlayers), dtype=np.float64, order='C')
+        dz = np.zeros((nlayers), dtype=np.float64, order='C')
 
-            del(absorption)
-            del(tau)
+        self.pathintegral_lib.path_lengths(self.get_kernel_context(),
+                                           self.atmosphere.altitude_profile,
+                                           self.atmosphere.planet_radius,
+                                           C.c_void_p(path.ctypes.data),
+                                           C.c_void_p(dz.ctypes.data))
 
-            return out
+        # tau = path x extinction, computed as tau.T = extinction.T x path.T on the (Fortran ordered) transposed
+        # views, to avoid copies. The extinction array is kept
+        tau = blas.dtrmm(1.0, path.T, extinction.T, side=1, lower=1).T
 
+        # mie scattering is added to all the path of the lines of sight with impact parameter within the mie layer
+        pressure = self.atmosphere.pressure_profile
+        if self.params.atm_mie:
+            mie_layers = (pressure >= self.atmosphere.mie_topP) & (pressure <= self.atmosphere.mie_bottomP)
+            tau[mie_layers] += np.outer(np.dot(path[mie_layers], self.atmosphere.density_profile),
+                                        self.atmosphere.mie_opacity)
+
+        transmittance = np.exp(-tau)
+        absorbed = 1. - transmittance
+        if self.params.atm_clouds:
+            # opaque cloud deck
+            cloudy_layers = pressure >= self.atmosphere.clouds_pressure
+            transmittance[cloudy_layers] = 1.
+            absorbed[cloudy_layers] = 1.
+
+        integral = 2.*np.dot((self.atmosphere.planet_radius+self.atmosphere.altitude_profile)*dz, absorbed)
+        absorption = ((self.atmosphere.planet_radius**2) + integral) / (self.params.star_radius**2)
+
+        if return_tau:
+            return transmittance[::-1, ::-1]
+        else:
+            return absorption
 
     def ctypes_pathintegral_ktab(self, return_tau=False, mixratio_mask=False):
 
         if self.params.gen_ace:
             self.atmosphere.set_ACE(mixratio_mask)
 
+        # temperature slabs of the opacities needed by the current profile (lazy temperature mode)
+        self.atmosphere.set_opacity_temperature_window()
+
 
         #setting up output array
         absorption = zeros((self.atmosphere.int_nwngrid), dtype=np.float64, order='C')
         tau = zeros((self.atmosphere.int_nwngrid*self.atmosphere.nlayers), dtype=np.float64, order='C')
         #running c++ path integral
-        self.pathintegral_lib.path_integral(self.atmosphere.int_nwngrid,
-                                            self.atmosphere.nlayers,
-                                            self.atmosphere.nactivegases,
-                                            self.atmosphere.ninactivegases,
-                                            self.params.atm_rayleigh,
-                                            self.params.atm_mie,
-                                            self.params.atm_cia,
-                                            self.params.atm_clouds,
-                                            self.atmosphere.ktables_array_flat,
-                                            self.data.ktable_dict['t'],
-                                            len(self.data.ktable_dict['t']),
-                                            self.data.ktable_dict['ngauss'],
-                                            self.data.ktable_dict['weights'],
-                                            self.atmosphere.sigma_rayleigh_array_flat,
-                                            len(self.data.sigma_cia_dict['xsecarr']),
-                                            np.asarray(self.atmosphere.cia_idx, dtype=np.float),
-                                            len(self.atmosphere.cia_idx),
-                                            self.atmosphere.sigma_cia_array_flat,
-                                            self.data.sigma_cia_dict['t'],
-                                            len(self.data.sigma_cia_dict['t']),
-                                            self.atmosphere.clouds_pressure,
-                                            self.atmosphere.mie_topP,
-                                            self.atmosphere.mie_bottomP,
-                                            self.atmosphere.mie_opacity,
-                                            self.atmosphere.pressure_profile,
-                                            self.atmosphere.density_profile,
-                                            self.atmosphere.altitude_profile,
-                                            self.atmosphere.active_mixratio_profile.flatten(),
-                                            self.atmosphere.inactive_mixratio_profile.flatten(),
-                                            self.atmosphere.temperature_profile,
-                                            self.atmosphere.planet_radius,
-                                            self.params.star_radius,
-                                            C.c_void_p(absorption.ctypes.data),
-                                            C.c_void_p(tau.ctypes.data))
-
-        out = np.zeros((len(absorption)))
-        out[:] = absorption
+        self.pathintegral_lib.evaluate(self.get_kernel_context(),
+                                       self.atmosphere.clouds_pressure,
+                                       self.atmosphere.mie_topP,
+                                       self.atmosphere.mie_bottomP,
+                                       self.atmosphere.mie_opacity,
+                                       self.atmosphere.pressure_profile,
+                                       self.atmosphere.density_profile,
+                                       self.atmosphere.altitude_profile,
+                                       self.atmosphere.active_mixratio_profile.ravel(),
+                                       self.atmosphere.inactive_mixratio_profile.ravel(),
+                                       self.atmosphere.temperature_profile,
+                                       self.atmosphere.planet_radius,
+                                       self.params.star_radius,
+                                       C.c_void_p(absorption.ctypes.data),
+                                       C.c_void_p(tau.ctypes.data))
 
         if return_tau:
-
-            tauout = np.zeros((self.atmosphere.int_nwngrid, self.atmosphere.nlayers))
-            for i in range(self.atmosphere.int_nwngrid):
-                for j in range(self.atmosphere.nlayers):
-                    tauout[i,j] = tau[i + j*self.atmosphere.int_nwngrid]
-
-            tauout = np.fliplr(np.rot90(tauout))
-
-            del(absorption)
-            del(tau)
-
-            return tauout
-
+            # contribution function (nlayers x nwngrid, layers and wavenumbers in reverse order): view of the tau
+            # array filled by the kernel (tau[wn + layer*nwngrid])
+            return tau.reshape(self.atmosphere.nlayers, self.atmosphere.int_nwngrid)[::-1, ::-1]
         else:
-
-            del(absorption)
-            del(tau)
-
-            return out
\ No newline at end of file
+            return absorption
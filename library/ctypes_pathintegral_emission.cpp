@@ -28,6 +28,7 @@
 #include <iostream>
 #include <string>
 #include <sstream>
+#include "pathintegral_interp.h"
 
 using namespace std;
 
@@ -73,7 +74,7 @@ extern "C" {
         double* dz = new double[nlayers];
         double* sigma_interp = new double[nwngrid*nlayers*nactive];
         double* sigma_cia_interp = new double[nwngrid * nlayers * cia_npairs];
-        double sigma, sigma_l, sigma_r;
+        double sigma;
         double tau, tau_cia, dtau, dtau1, tau_sum1, tau_sum2, dtau_cia, mu, tau_tot,eta;
         double p;
         double mu1, mu2, mu3, mu4, w1, w2, w3, w4;
@@ -110,85 +111,13 @@ extern "C" {
         }
 
         // interpolate sigma array to the temperature profile
-        for (int j=0; j<nlayers; j++) {
-
-            if (sigma_ntemp == 1) { //
-                for (int wn=0; wn<nwngrid; wn++) {
-                    for (int l=0;l<nactive;l++) {
-                        sigma_interp[wn + nwngrid*(j + l*nlayers)] = sigma_array[wn + nwngrid*(sigma_ntemp*(j + l*nlayers))];
-                    }
-                }
-            } else {
-                if (temperature[j] > sigma_temp[sigma_ntemp-1]) {
-                    for (int wn=0; wn<nwngrid; wn++) {
-                        for (int l=0;l<nactive;l++) {
-                            sigma_interp[wn + nwngrid*(j + l*nlayers)] = sigma_array[wn + nwngrid*(sigma_ntemp-1 + sigma_ntemp*(j + l*nlayers))];
-                        }
-                    }
-                } else if (temperature[j] < sigma_temp[0]) {
-                    for (int wn=0; wn<nwngrid; wn++) {
-                        for (int l=0;l<nactive;l++) {
-                            sigma_interp[wn + nwngrid*(j + l*nlayers)] = sigma_array[wn + nwngrid*(sigma_ntemp*(j + l*nlayers))];
-                        }
-                    }
-                } else {
-                    for (int t=1; t<sigma_ntemp; t++) {
-                        if ((temperature[j] >= sigma_temp[t-1]) && (temperature[j] < sigma_temp[t])) {
-                            #pragma omp parallel for private(sigma_l, sigma_r, sigma)
-                            for (int wn=0; wn<nwngrid; wn++) {
-                                for (int l=0;l<nactive;l++) {
-                                    sigma_l = sigma_array[wn + nwngrid*(t-1 + sigma_ntemp*(j + l*nlayers))];
-                                    sigma_r = sigma_array[wn + nwngrid*(t + sigma_ntemp*(j + l*nlayers))];
-                                    sigma = sigma_l + (sigma_r-sigma_l)*(temperature[j]-sigma_temp[t-1])/(sigma_temp[t]-sigma_temp[t-1]);
-                                    sigma_interp[wn + nwngrid*(j + l*nlayers)] = sigma;
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        }
-
+        TemperatureWeights opacity_weights, cia_weights;
+        opacity_weights.update(nlayers, temperature, sigma_temp, sigma_ntemp, false);
+        interpolate_temperature(sigma_array, nactive, nlayers, sigma_ntemp, nwngrid, true, opacity_weights, sigma_interp);
 
         // interpolate sigma CIA array to the temperature profile
-        for (int j=0; j<nlayers; j++) {
-            if (sigma_cia_ntemp == 1) { //
-                for (int wn=0; wn<nwngrid; wn++) {
-                     for (int l=0;l<cia_npairs;l++) {
-                        sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp*l)];
-                     }
-                }
-            } else {
-                if (temperature[j] > sigma_cia_temp[sigma_cia_ntemp-1]) {
-                    for (int wn=0; wn<nwngrid; wn++) {
-                         for (int l=0;l<cia_npairs;l++) {
-                            sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp-1 + sigma_cia_ntemp*l)];
-                         }
-                    }
-                } else if  (temperature[j] <  sigma_cia_temp[0]) {
-                    for (int wn=0; wn<nwngrid; wn++) {
-                         for (int l=0;l<cia_npairs;l++) {
-                            sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp*l)];
-                         }
-                    }
-                } else {
-                    for (int t=1; t<sigma_cia_ntemp; t++) {
-                        if ((temperature[j] > sigma_cia_temp[t-1]) && (temperature[j] < sigma_cia_temp[t])) {
-                            #pragma omp parallel for private(sigma_l, sigma_r, sigma)
-                            for (int wn=0; wn<nwngrid; wn++) {
-                                for (int l=0;l<cia_npairs;l++) {
-                                    sigma_l = sigma_cia[wn + nwngrid*(t-1 + sigma_cia_ntemp*l)];
-                                    sigma_r = sigma_cia[wn + nwngrid*(t + sigma_cia_ntemp*l)];
-                                    sigma = sigma_l + (sigma_r-sigma_l)*(temperature[j]-sigma_cia_temp[t-1])/(sigma_cia_temp[t]-sigma_cia_temp[t-1]);
-                                    sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma;
-                                }
-                            }
-                        }
-                    }
-                 }
-            }
-        }
-
+        cia_weights.update(nlayers, temperature, sigma_cia_temp, sigma_cia_ntemp, false);
+        interpolate_temperature(sigma_cia, cia_npairs, nlayers, sigma_cia_ntemp, nwngrid, false, cia_weights, sigma_cia_interp);
 
         // get mixing ratio of individual molecules in the collision induced absorption (CIA) pairs
         for (int c=0; c<cia_npairs;c++) {
@@ -27,6 +27,7 @@
 #include <iostream>
 #include <string>
 #include <sstream>
+#include "pathintegral_interp.h"
 
 using namespace std;
 
@@ -77,7 +78,7 @@ extern "C" {
         double* dz = new double[nlayers];
         double* ktab_interp = new double[ngauss*nwngrid*nlayers*nactive];
         double* sigma_cia_interp = new double[nwngrid * nlayers * cia_npairs];
-        double sigma, sigma_l, sigma_r;
+        double sigma;
         double tau, tau_cia, dtau, dtau1, tau_sum1, tau_sum2, dtau_cia, mu, tau_tot,eta;
         double p;
         double mu1, mu2, mu3, mu4, w1, w2, w3, w4;
@@ -115,93 +116,14 @@ extern "C" {
             }
         }
 
-        // interpolate ktab array to the temperature profile
-        for (int j=0; j<nlayers; j++) {
-            //cout << temperature[j] << endl;
-            if (temperature[j] > ktab_temp[ktab_ntemp-1]) { // temperature higher than ktab
-                for (int wn=0; wn<nwngrid; wn++) {
-                    for (int l=0;l<nactive;l++) {
-                        for (int g=0; g<ngauss; g++) {
-                            ktab_interp[g + ngauss*(wn + nwngrid*(j + l*nlayers))] =  ktab_array[g + ngauss*(wn + nwngrid*(ktab_ntemp-1 + ktab_ntemp*(j + l*nlayers)))];
-                        }
-                    }
-                }
-            } else if (temperature[j] < ktab_temp[0]) { // temperature lower than ktab
-                for (int wn=0; wn<nwngrid; wn++) {
-                    for (int l=0;l<nactive;l++) {
-                        for (int g=0; g<ngauss; g++) {
-                            ktab_interp[g + ngauss*(wn + nwngrid*(j + l*nlayers))] = ktab_array[g + ngauss*(wn + nwngrid*(ktab_ntemp*(j + l*nlayers)))];
-                        }
-                    }
-                }
-            } else {
-                if (ktab_ntemp == 1) { // This only happens for create_spectrum (when temperature is part of sigma_t)
-                    for (int wn=0; wn<nwngrid; wn++) {
-                        for (int l=0;l<nactive;l++) {
-                            for (int g=0; g<ngauss; g++) {
-                                ktab_interp[g + ngauss * (wn + nwngrid*(j + l*nlayers))] = ktab_array[g + ngauss*(wn + nwngrid*(ktab_ntemp*(j + l*nlayers)))];
-                            }
-                        }
-                    }
-                } else {
-                    for (int t=1; t<ktab_ntemp; t++) {
-                        if ((temperature[j] >= ktab_temp[t-1]) && (temperature[j] < ktab_temp[t])) {
-                            #pragma omp parallel for private(sigma_l, sigma_r, sigma)
-                            for (int wn=0; wn<nwngrid; wn++) {
-                                for (int l=0;l<nactive;l++) {
-                                    for (int g=0; g<ngauss; g++) {
-                                        sigma_l = ktab_array[g + ngauss*(wn + nwngrid*(t-1 + ktab_ntemp*(j + l*nlayers)))];
-                                        sigma_r = ktab_array[g + ngauss*(wn + nwngrid*(t + ktab_ntemp*(j + l*nlayers)))];
-                                        sigma = sigma_l + (sigma_r-sigma_l)*(log10(temperature[j])-log10(ktab_temp[t-1]))/(log10(ktab_temp[t])-log10(ktab_temp[t-1]));
-                                        ktab_interp[g + ngauss*(wn + nwngrid*(j + l*nlayers))] = sigma;
-                                     }
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        }
+        // interpolate ktab array to the temperature profile (log10(T) for k-tables)
+        TemperatureWeights opacity_weights, cia_weights;
+        opacity_weights.update(nlayers, temperature, ktab_temp, ktab_ntemp, true);
+        interpolate_temperature(ktab_array, nactive, nlayers, ktab_ntemp, nwngrid*ngauss, true, opacity_weights, ktab_interp);
 
         // interpolate sigma CIA array to the temperature profile
-        for (int j=0; j<nlayers; j++) {
-            if (sigma_cia_ntemp == 1) { //
-                for (int wn=0; wn<nwngrid; wn++) {
-                     for (int l=0;l<cia_npairs;l++) {
-                        sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp*l)];
-                     }
-                }
-            } else {
-                if (temperature[j] > sigma_cia_temp[sigma_cia_ntemp-1]) {
-                    for (int wn=0; wn<nwngrid; wn++) {
-                         for (int l=0;l<cia_npairs;l++) {
-                            sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp-1 + sigma_cia_ntemp*l)];
-                         }
-                    }
-                } else if  (temperature[j] <  sigma_cia_temp[0]) {
-                    for (int wn=0; wn<nwngrid; wn++) {
-                         for (int l=0;l<cia_npairs;l++) {
-                            sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp*l)];
-                         }
-                    }
-                } else {
-                    for (int t=1; t<sigma_cia_ntemp; t++) {
-                        if ((temperature[j] > sigma_cia_temp[t-1]) && (temperature[j] < sigma_cia_temp[t])) {
-                            #pragma omp parallel for private(sigma_l, sigma_r, sigma)
-                            for (int wn=0; wn<nwngrid; wn++) {
-                                for (int l=0;l<cia_npairs;l++) {
-                                    sigma_l = sigma_cia[wn + nwngrid*(t-1 + sigma_cia_ntemp*l)];
-                                    sigma_r = sigma_cia[wn + nwngrid*(t + sigma_cia_ntemp*l)];
-                                    sigma = sigma_l + (sigma_r-sigma_l)*(temperature[j]-sigma_cia_temp[t-1])/(sigma_cia_temp[t]-sigma_cia_temp[t-1]);
-                                    sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma;
-                                }
-                            }
-                        }
-                    }
-                 }
-            }
-        }
-
+        cia_weights.update(nlayers, temperature, sigma_cia_temp, sigma_cia_ntemp, false);
+        interpolate_temperature(sigma_cia, cia_npairs, nlayers, sigma_cia_ntemp, nwngrid, false, cia_weights, sigma_cia_interp);
 
         // get mixing ratio of individual molecules in the collision induced absorption (CIA) pairs
         for (int c=0; c<cia_npairs;c++) {
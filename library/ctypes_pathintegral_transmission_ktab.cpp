@@ -20,171 +20,198 @@
 #include <iostream>
 #include <string>
 #include <sstream>
+#include "pathintegral_geometry.h"
+#include "pathintegral_interp.h"
 
 using namespace std;
 
+// Kernel context: the inputs that do not change between forward model calls (opacities, grids, flags)
+// are registered once with init_context, together with the scratch memory and the path lengths.
+// Each call of evaluate then only passes the profiles, clouds and radii.
+namespace {
+
+struct TransmissionContext {
+    int nwngrid;
+    int nlayers;
+    int nactive;
+    int ninactive;
+    int rayleigh;
+    int mie;
+    int cia;
+    int clouds;
+    const double * ktab_array;
+    const double * ktab_temp;
+    int ktab_ntemp;
+    int ngauss;
+    const double * ktab_weights;
+    const double * sigma_rayleigh;
+    int cia_npairs;
+    std::vector<double> cia_idx;
+    const double * sigma_cia;
+    const double * sigma_cia_temp;
+    int sigma_cia_ntemp;
+    std::vector<double> ktab_interp;
+    std::vector<double> sigma_cia_interp;
+    TemperatureWeights opacity_weights;
+    TemperatureWeights cia_weights;
+    PathGeometry geometry;
+    int nbins;                      // binning of the spectrum to the observations (see set_bins)
+    std::vector<int> bin_idx;
+    std::vector<double> bin_weight;
+    std::vector<int> bin_count;
+    std::vector<double> absorption; // full resolution spectrum and tau, when not returned (evaluate_binned)
+    std::vector<double> tau;
+    double tau_saturation;          // optical depth above which a line of sight is opaque (0: disabled)
+};
+
+static void set_context(TransmissionContext * ctx,
+                        const int nwngrid,
+                        const int nlayers,
+                        const int nactive,
+                        const int ninactive,
+                        const int rayleigh,
+                        const int mie,
+                        const int cia,
+                        const int clouds,
+                        const double * ktab_array,
+                        const double * ktab_temp,
+                        const int ktab_ntemp,
+                        const int ngauss,
+                        const double * ktab_weights,
+                        const double * sigma_rayleigh,
+                        const int cia_npairs,
+                        const double * cia_idx,
+                        const int cia_nidx,
+                        const double * sigma_cia,
+                        const double * sigma_cia_temp,
+                        const int sigma_cia_ntemp) {
+
+    ctx->nwngrid = nwngrid;
+    ctx->nlayers = nlayers;
+    ctx->nactive = nactive;
+    ctx->ninactive = ninactive;
+    ctx->rayleigh = rayleigh;
+    ctx->mie = mie;
+    ctx->cia = cia;
+    ctx->clouds = clouds;
+    ctx->ktab_array = ktab_array;
+    ctx->ktab_temp = ktab_temp;
+    ctx->ktab_ntemp = ktab_ntemp;
+    ctx->ngauss = ngauss;
+    ctx->ktab_weights = ktab_weights;
+    ctx->sigma_rayleigh = sigma_rayleigh;
+    ctx->cia_npairs = cia_npairs;
+    ctx->cia_idx.assign(cia_idx, cia_idx + cia_nidx);
+    ctx->sigma_cia = sigma_cia;
+    ctx->sigma_cia_temp = sigma_cia_temp;
+    ctx->sigma_cia_ntemp = sigma_cia_ntemp;
+    ctx->ktab_interp.resize(ngauss*nwngrid*nlayers*nactive);
+    ctx->sigma_cia_interp.resize(nwngrid*nlayers*cia_npairs);
+}
+
+}
+
 extern "C" {
 
-    void path_integral(const int nwngrid,
-                       const int nlayers,
-                       const int nactive,
-                       const int ninactive,
-                       const int rayleigh,
-					   const int mie,
-                       const int cia,
-                       const int clouds,
-                       const double * ktab_array,
-                       const double * ktab_temp,
-                       const int ktab_ntemp,
-                       const int ngauss,
-                       const double * ktab_weights,
-                       const double * sigma_rayleigh,
-                       const int cia_npairs,
-                       const double * cia_idx,
-                       const int cia_nidx,
-                       const double * sigma_cia,
-                       const double * sigma_cia_temp,
-                       const int sigma_cia_ntemp,
-                       const double cloud_topP,
-					   const double mie_topP,
-					   const double mie_bottomP,
-					   const double * sigma_mie,
-                       const double * pressure,
-                       const double * density,
-                       const double * z,
-                       const double * active_mixratio,
-                       const double * inactive_mixratio,
-                       const double * temperature,
-                       const double planet_radius,
-                       const double star_radius,
-                       void * absorptionv,
-                       void * tauv) {
+    void * init_context(const int nwngrid,
+                        const int nlayers,
+                        const int nactive,
+                        const int ninactive,
+                        const int rayleigh,
+                        const int mie,
+                        const int cia,
+                        const int clouds,
+                        const double * ktab_array,
+                        const double * ktab_temp,
+                        const int ktab_ntemp,
+                        const int ngauss,
+                        const double * ktab_weights,
+                        const double * sigma_rayleigh,
+                        const int cia_npairs,
+                        const double * cia_idx,
+                        const int cia_nidx,
+                        const double * sigma_cia,
+                        const double * sigma_cia_temp,
+                        const int sigma_cia_ntemp) {
+
+        // the arrays are not copied: they must stay alive (and at the same address) until free_context
+        TransmissionContext * ctx = new TransmissionContext;
+        ctx->nbins = 0;
+        ctx->tau_saturation = 0.;
+        set_context(ctx, nwngrid, nlayers, nactive, ninactive, rayleigh, mie, cia, clouds,
+                    ktab_array, ktab_temp, ktab_ntemp, ngauss, ktab_weights, sigma_rayleigh, cia_npairs, cia_idx, cia_nidx,
+                    sigma_cia, sigma_cia_temp, sigma_cia_ntemp);
+        return (void *) ctx;
+    }
 
+    void free_context(void * contextv) {
+
+        delete (TransmissionContext *) contextv;
+    }
+
+    static void evaluate_context(void * contextv,
+                                 const double cloud_topP,
+                                 const double mie_topP,
+                                 const double mie_bottomP,
+                                 const double * sigma_mie,
+                                 const double * pressure,
+                                 const double * density,
+                                 const double * z,
+                                 const double * active_mixratio,
+                                 const double * inactive_mixratio,
+                                 const double * temperature,
+                                 const double planet_radius,
+                                 const double star_radius,
+                                 void * absorptionv,
+                                 void * tauv) {
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+
+        const int nwngrid = ctx->nwngrid;
+        const int nlayers = ctx->nlayers;
+        const int nactive = ctx->nactive;
+        const int ninactive = ctx->ninactive;
+        const int rayleigh = ctx->rayleigh;
+        const int mie = ctx->mie;
+        const int cia = ctx->cia;
+        const int clouds = ctx->clouds;
+        const double * ktab_array = ctx->ktab_array;
+        const double * ktab_temp = ctx->ktab_temp;
+        const int ktab_ntemp = ctx->ktab_ntemp;
+        const int ngauss = ctx->ngauss;
+        const double * ktab_weights = ctx->ktab_weights;
+        const double * sigma_rayleigh = ctx->sigma_rayleigh;
+        const int cia_npairs = ctx->cia_npairs;
+        const double * cia_idx = ctx->cia_idx.data();
+        const double * sigma_cia = ctx->sigma_cia;
+        const double * sigma_cia_temp = ctx->sigma_cia_temp;
+        const int sigma_cia_ntemp = ctx->sigma_cia_ntemp;
 
         double * absorption = (double *) absorptionv;
         double * tau = (double *) tauv;
 
-        // setting up arrays and variables
-        //double* tau = new double[nlayers*nwngrid];
-        double* dz = new double[nlayers];
-        double* dlarray = new double[nlayers*nlayers];
-        double* ktab_interp = new double[ngauss*nwngrid*nlayers*nactive];
-        double* sigma_cia_interp = new double[nwngrid * nlayers * cia_npairs];
-        double sigma, sigma_l, sigma_r;
+        // setting up arrays and variables (scratch memory owned by the context)
+        double* ktab_interp = ctx->ktab_interp.data();
+        double* sigma_cia_interp = ctx->sigma_cia_interp.data();
+        double sigma;
         double x1_idx[cia_npairs][nlayers];
         double x2_idx[cia_npairs][nlayers];
-        double tautmp, transtmp, transtot, exptau,  integral;
-        double cld_factor, cld_rho;
-        double p;
-        int count, count_orig, count2, t_idx;
-
-        //dz array
-        for (int j=0; j<(nlayers); j++) {
-            if ((j+1) == nlayers) {
-                dz[j] = z[j] - z[j-1];
-            } else {
-                dz[j] = z[j+1] - z[j];
-            }
-        }
+        double tautmp, transtmp, transtot, integral;
+        int count, count_orig, count2;
 
-        // dl array
-        count = 0;
-        for (int j=0; j<(nlayers); j++) {
-            for (int k=0; k < (nlayers - j); k++) {
-                p = pow((planet_radius+dz[0]/2.+z[j]),2);
-                if (k == 0) {
-                    dlarray[count] = 2.0 * sqrt(pow((planet_radius + dz[0]/2. + z[j] + dz[j]/2.),2) - p);
-                } else {
-                    dlarray[count] = 2.0 * (sqrt(pow((planet_radius + dz[0]/2. + z[k+j] + dz[j+k]/2.),2) - p) -  sqrt(pow((planet_radius + dz[0]/2. + z[k+j-1] + dz[j+k-1]/2.  ),2) - p));
-                }
-                count += 1;
-            }
-        }
+        // dz and dl arrays, only recomputed if the altitude profile or the planet radius have changed
+        ctx->geometry.update(nlayers, z, planet_radius);
+        const double * dz = ctx->geometry.dz.data();
+        const double * dlarray = ctx->geometry.dlarray.data();
 
-
-        // interpolate ktab array to the temperature profile
-        for (int j=0; j<nlayers; j++) {
-            if (temperature[j] > ktab_temp[ktab_ntemp-1]) { // temperature higher than ktab
-                for (int wn=0; wn<nwngrid; wn++) {
-                    for (int l=0;l<nactive;l++) {
-                        for (int g=0; g<ngauss; g++) {
-                            ktab_interp[g + ngauss*(wn + nwngrid*(j + l*nlayers))] =  ktab_array[g + ngauss*(wn + nwngrid*(ktab_ntemp-1 + ktab_ntemp*(j + l*nlayers)))];
-                        }
-                    }
-                }
-            } else if (temperature[j] < ktab_temp[0]) { // temperature lower than ktab
-                for (int wn=0; wn<nwngrid; wn++) {
-                    for (int l=0;l<nactive;l++) {
-                        for (int g=0; g<ngauss; g++) {
-                            ktab_interp[g + ngauss*(wn + nwngrid*(j + l*nlayers))] = ktab_array[g + ngauss*(wn + nwngrid*(ktab_ntemp*(j + l*nlayers)))];
-                        }
-                    }
-                }
-            } else {
-                if (ktab_ntemp == 1) { // This only happens for create_spectrum (when temperature is part of sigma_t)
-                    for (int wn=0; wn<nwngrid; wn++) {
-                        for (int l=0;l<nactive;l++) {
-                            for (int g=0; g<ngauss; g++) {
-                                ktab_interp[g + ngauss * (wn + nwngrid*(j + l*nlayers))] = ktab_array[g + ngauss*(wn + nwngrid*(ktab_ntemp*(j + l*nlayers)))];
-                            }
-                        }
-                    }
-                } else {
-                    for (int t=1; t<ktab_ntemp; t++) {
-                        if ((temperature[j] >= ktab_temp[t-1]) && (temperature[j] < ktab_temp[t])) {
-                            for (int wn=0; wn<nwngrid; wn++) {
-                                for (int l=0;l<nactive;l++) {
-                                    for (int g=0; g<ngauss; g++) {
-                                        sigma_l = ktab_array[g + ngauss*(wn + nwngrid*(t-1 + ktab_ntemp*(j + l*nlayers)))];
-                                        sigma_r = ktab_array[g + ngauss*(wn + nwngrid*(t + ktab_ntemp*(j + l*nlayers)))];
-                                        sigma = sigma_l + (sigma_r-sigma_l)*(log10(temperature[j])-log10(ktab_temp[t-1]))/(log10(ktab_temp[t])-log10(ktab_temp[t-1]));
-                                        ktab_interp[g + ngauss*(wn + nwngrid*(j + l*nlayers))] = sigma;
-                                     }
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        }
+        // interpolate ktab array to the temperature profile (log10(T) for k-tables)
+        ctx->opacity_weights.update(nlayers, temperature, ktab_temp, ktab_ntemp, true);
+        interpolate_temperature(ktab_array, nactive, nlayers, ktab_ntemp, nwngrid*ngauss, true, ctx->opacity_weights, ktab_interp);
 
         // interpolate sigma CIA array to the temperature profile
-        for (int j=0; j<nlayers; j++) {
-            if (sigma_cia_ntemp == 1) { //
-                for (int wn=0; wn<nwngrid; wn++) {
-                     for (int l=0;l<cia_npairs;l++) {
-                        sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp*l)];
-                     }
-                }
-            } else {
-                if (temperature[j] > sigma_cia_temp[sigma_cia_ntemp-1]) {
-                    for (int wn=0; wn<nwngrid; wn++) {
-                         for (int l=0;l<cia_npairs;l++) {
-                            sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp-1 + sigma_cia_ntemp*l)];
-                         }
-                    }
-                } else if  (temperature[j] <  sigma_cia_temp[0]) {
-                    for (int wn=0; wn<nwngrid; wn++) {
-                         for (int l=0;l<cia_npairs;l++) {
-                            sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp*l)];
-                         }
-                    }
-                } else {
-                    for (int t=1; t<sigma_cia_ntemp; t++) {
-                        if ((temperature[j] > sigma_cia_temp[t-1]) && (temperature[j] < sigma_cia_temp[t])) {
-                            #pragma omp parallel for private(sigma_l, sigma_r, sigma)
-                            for (int wn=0; wn<nwngrid; wn++) {
-                                for (int l=0;l<cia_npairs;l++) {
-                                    sigma_l = sigma_cia[wn + nwngrid*(t-1 + sigma_cia_ntemp*l)];
-                                    sigma_r = sigma_cia[wn + nwngrid*(t + sigma_cia_ntemp*l)];
-                                    sigma = sigma_l + (sigma_r-sigma_l)*(temperature[j]-sigma_cia_temp[t-1])/(sigma_cia_temp[t]-sigma_cia_temp[t-1]);
-                                    sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma;
-                                }
-                            }
-                        }
-                    }
-                 }
-            }
+        if (cia == 1) {
+            ctx->cia_weights.update(nlayers, temperature, sigma_cia_temp, sigma_cia_ntemp, false);
+            interpolate_temperature(sigma_cia, cia_npairs, nlayers, sigma_cia_ntemp, nwngrid, false, ctx->cia_weights, sigma_cia_interp);
         }
 
         // get mixing ratio of individual molecules in the collision induced absorption (CIA) pairs
@@ -204,31 +231,63 @@ extern "C" {
          }
 
 
+        // the layers below the cloud top (pressure higher than cloud_topP) are opaque: their contribution to the
+        // integral is the same for all wavenumbers
+        int cloud_top = 0;
+        double cloud_integral = 0.;
+        if (clouds == 1) {
+            while ((cloud_top < nlayers) && (pressure[cloud_top] >= cloud_topP)) {
+                cloud_integral += ((planet_radius+z[cloud_top])*(1.0)*dz[cloud_top]);
+                cloud_top += 1;
+            }
+        }
+        const double tau_saturation = ctx->tau_saturation;
+        double transcont;
+
         // calculate absorption
         count2 = 0;
         for (int wn=0; wn < nwngrid; wn++) {
-            count = 0;
-            integral = 0.0;
+            integral = cloud_integral;
+            for (int j=0; j<cloud_top; j++) {
+                tau[count2] = 1.0;
+                count2 += 1;
+            }
             //cout << " integral 0 " << integral << endl;
-            //cout << " count 0 " << count << endl;
-    		for (int j=0; j<(nlayers); j++) { 	// loop through atmosphere layers, z[0] to z[nlayers]
+    		for (int j=cloud_top; j<(nlayers); j++) { 	// loop through atmosphere layers, z[0] to z[nlayers]
 
-                count_orig = count;
+                count_orig = j*nlayers - (j*(j-1))/2; // first path length of layer j in dlarray
 
-                if ((clouds == 1) && (pressure[j] >= cloud_topP)) {
-                    //cout << j << " YES " << pressure[j] << endl;
-                    for (int k=0; k < (nlayers-j); k++) { // loop through each layer to sum up path length
-                        count += 1;
+                // calculate rayleigh and cia separtely from cross sections
+                // firstly get tau
+                count = count_orig;
+                tautmp = 0.;
+                for (int k=0; k < (nlayers-j); k++) { // loop through each layer to sum up path length
+                    if (rayleigh == 1) {
+                       for (int l=0;l<nactive;l++) {
+                            tautmp += sigma_rayleigh[wn + nwngrid*l] * active_mixratio[k+j+nlayers*l] * density[j+k] * dlarray[count];
+                       }
+                       for (int l=0; l<ninactive; l++) {
+                            tautmp += sigma_rayleigh[wn + nwngrid*(l+nactive)] * inactive_mixratio[k+j+nlayers*l] * density[j+k] * dlarray[count];
+                       }
                     }
-                    //exptau = exp(-tautmp);
-                    integral += ((planet_radius+z[j])*(1.0)*dz[j]);
-                    tau[count2] = 1.0;
-                    //cout << count2 << " " << tau[count2] << endl;
-                    //cout << count << " j " << j << " z " << z[j] << " dz " << dz[j] << " exptau  " << exptau << " integral " << integral << endl;
-                    count2 += 1;
-                } else {
+                    if (cia == 1) {
+                        for (int c=0; c<cia_npairs;c++) {
+                            tautmp += sigma_cia_interp[wn + nwngrid*((k+j) + c*nlayers)] * x1_idx[c][k+j]*x2_idx[c][k+j] * density[j+k]*density[j+k] * dlarray[count];
+                        }
+                    }
+                    //calculating mie scattering model
+                    if ((mie == 1) && (pressure[j] >= mie_topP) && (pressure[j] <= mie_bottomP)){
+                        tautmp += sigma_mie[wn] * density[j+k] *dlarray[count];
+                    }
+                    count += 1;
+                }
+                transcont = exp(-tautmp);
 
-                    transtot = 1.;
+                transtot = 1.;
+                if ((tau_saturation > 0.) && (tautmp > tau_saturation)) {
+                    // line of sight saturated by the continuum: the gases do not change its contribution
+                    transtot = 0.;
+                } else {
                     for (int l=0;l<nactive;l++) {
                         transtmp = 0;
                         for (int g=0; g<ngauss; g++) {
@@ -239,45 +298,27 @@ extern "C" {
                                 sigma = ktab_interp[g + ngauss*(wn + nwngrid*((k+j) + l*nlayers))];
                                 tautmp += (sigma * active_mixratio[k+j+nlayers*l] * density[k+j] * dlarray[count]);
                                 count += 1;
+
+                                // saturated gauss point: its transmission is zero
+                                if ((tau_saturation > 0.) && (tautmp > tau_saturation)) {
+                                    break;
+                                }
                             }
                             //cout << tautmp << " " << exp(-tautmp) << " " << ktab_weights[g] << endl;
-                            transtmp += exp(-tautmp) * ktab_weights[g];
-                        }
-                        transtot *= transtmp;
-                    }
-
-                    // calculate rayleigh and cia separtely from cross sections
-                    // firstly get tau
-                    count = count_orig;
-                    tautmp = 0.;
-                    for (int k=0; k < (nlayers-j); k++) { // loop through each layer to sum up path length
-                        if (rayleigh == 1) {
-                           for (int l=0;l<nactive;l++) {
-                                tautmp += sigma_rayleigh[wn + nwngrid*l] * active_mixratio[k+j+nlayers*l] * density[j+k] * dlarray[count];
-                           }
-                           for (int l=0; l<ninactive; l++) {
-                                tautmp += sigma_rayleigh[wn + nwngrid*(l+nactive)] * inactive_mixratio[k+j+nlayers*l] * density[j+k] * dlarray[count];
-                           }
-                        }
-                        if (cia == 1) {
-                            for (int c=0; c<cia_npairs;c++) {
-                                tautmp += sigma_cia[wn + nwngrid*c] * x1_idx[c][k+j]*x2_idx[c][k+j] * density[j+k]*density[j+k] * dlarray[count];
+                            if (!((tau_saturation > 0.) && (tautmp > tau_saturation))) {
+                                transtmp += exp(-tautmp) * ktab_weights[g];
                             }
                         }
-                        //calculating mie scattering model
-						if ((mie == 1) && (pressure[j] >= mie_topP) && (pressure[j] <= mie_bottomP)){
-							tautmp += sigma_mie[wn] * density[j+k] *dlarray[count];
-						}
-                        count += 1;
+                        transtot *= transtmp;
                     }
-                    transtot *= exp(-tautmp);
-
-                    integral += ((planet_radius+z[j])*(1.0-transtot)*dz[j]);
-                    tau[count2] = 1.0 - transtot;
-                    //cout << count2 << " " << transtot << endl;
-                    //cout << count << " j " << j << " z " << z[j] << " dz " << dz[j] << " exptau  " << exptau << " integral " << integral << endl;
-                    count2 += 1;
+                    transtot *= transcont;
                 }
+
+                integral += ((planet_radius+z[j])*(1.0-transtot)*dz[j]);
+                tau[count2] = 1.0 - transtot;
+                //cout << count2 << " " << transtot << endl;
+                //cout << count << " j " << j << " z " << z[j] << " dz " << dz[j] << " exptau  " << exptau << " integral " << integral << endl;
+                count2 += 1;
             }
             integral *= 2.0;
             //cout << integral << endl;
@@ -287,12 +328,194 @@ extern "C" {
 
         }
 //        cout << "END" << endl;
+    }
+
+    void evaluate(void * contextv,
+                  const double cloud_topP,
+                  const double mie_topP,
+                  const double mie_bottomP,
+                  const double * sigma_mie,
+                  const double * pressure,
+                  const double * density,
+                  const double * z,
+                  const double * active_mixratio,
+                  const double * inactive_mixratio,
+                  const double * temperature,
+                  const double planet_radius,
+                  const double star_radius,
+                  void * absorptionv,
+                  void * tauv) {
+
+        evaluate_context(contextv, cloud_topP, mie_topP, mie_bottomP, sigma_mie, pressure, density, z,
+                         active_mixratio, inactive_mixratio, temperature, planet_radius, star_radius, absorptionv, tauv);
+    }
+
+    void set_bins(void * contextv,
+                  const int nbins,
+                  const int * bin_idx,
+                  const double * bin_weight) {
+
+        // register the binning of the spectrum used by evaluate_binned: bin index of each wavenumber (-1 if the
+        // wavenumber is outside the bins) and weight of each wavenumber in its bin (1/number of wavenumbers in
+        // the bin for the mean)
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+        ctx->nbins = nbins;
+        ctx->bin_idx.assign(bin_idx, bin_idx + ctx->nwngrid);
+        ctx->bin_weight.assign(bin_weight, bin_weight + ctx->nwngrid);
+        ctx->bin_count.assign(nbins, 0);
+        for (int wn=0; wn<ctx->nwngrid; wn++) {
+            if (bin_idx[wn] >= 0) {
+                ctx->bin_count[bin_idx[wn]] += 1;
+            }
+        }
+    }
+
+    void set_tau_saturation(void * contextv,
+                            const double tau_saturation) {
+
+        // optical depth above which the slant path accumulation of a line of sight stops, the line of sight being
+        // taken as opaque (0 to disable)
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+        ctx->tau_saturation = tau_saturation;
+    }
+
+    void evaluate_binned(void * contextv,
+                         const double cloud_topP,
+                         const double mie_topP,
+                         const double mie_bottomP,
+                         const double * sigma_mie,
+                         const double * pressure,
+                         const double * density,
+                         const double * z,
+                         const double * active_mixratio,
+                         const double * inactive_mixratio,
+                         const double * temperature,
+                         const double planet_radius,
+                         const double star_radius,
+                         void * binnedv,
+                         void * absorptionv) {
+
+        // same as evaluate, but returns the spectrum binned with the bins of set_bins (nbins, empty bins are nan).
+        // The full resolution spectrum is also returned in absorptionv, unless it is NULL
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+        const int nwngrid = ctx->nwngrid;
+        double * binned = (double *) binnedv;
+        double * absorption = (double *) absorptionv;
+
+        if (absorption == NULL) {
+            ctx->absorption.resize(nwngrid);
+            absorption = ctx->absorption.data();
+        }
+        ctx->tau.resize(nwngrid*ctx->nlayers);
+
+        evaluate_context(contextv, cloud_topP, mie_topP, mie_bottomP, sigma_mie, pressure, density, z,
+                         active_mixratio, inactive_mixratio, temperature, planet_radius, star_radius,
+                         (void *) absorption, (void *) ctx->tau.data());
+
+        for (int b=0; b<ctx->nbins; b++) {
+            binned[b] = 0.;
+        }
+        for (int wn=0; wn<nwngrid; wn++) {
+            if (ctx->bin_idx[wn] >= 0) {
+                binned[ctx->bin_idx[wn]] += absorption[wn] * ctx->bin_weight[wn];
+            }
+        }
+        for (int b=0; b<ctx->nbins; b++) {
+            if (ctx->bin_count[b] == 0) {
+                binned[b] = NAN;
+            }
+        }
+    }
+
+    void evaluate_batch(void * contextv,
+                        const int nmodels,
+                        const double * cloud_topP,
+                        const double * mie_topP,
+                        const double * mie_bottomP,
+                        const double * sigma_mie,
+                        const double * pressure,
+                        const double * density,
+                        const double * z,
+                        const double * active_mixratio,
+                        const double * inactive_mixratio,
+                        const double * temperature,
+                        const double * planet_radius,
+                        const double star_radius,
+                        void * absorptionv) {
+
+        // evaluate nmodels forward models sharing the same opacities. The profiles of the models are stacked
+        // (e.g. temperature is nmodels x nlayers), the spectra are returned in absorption (nmodels x nwngrid).
+        // The openmp version runs the models in parallel, each thread with its own copy of the context
+        // (scratch memory and path lengths).
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+        const long nwngrid = ctx->nwngrid;
+        const long nlayers = ctx->nlayers;
+        const long nactive = ctx->nactive;
+        const long ninactive = ctx->ninactive;
+        double * absorption = (double *) absorptionv;
+
+        #pragma omp parallel
+        {
+            TransmissionContext local = *ctx;
+            std::vector<double> tau(nwngrid*nlayers);
+
+            #pragma omp for schedule(dynamic)
+            for (int m=0; m<nmodels; m++) {
+                evaluate_context((void *) &local, cloud_topP[m], mie_topP[m], mie_bottomP[m], sigma_mie + m*nwngrid,
+                                 pressure + m*nlayers, density + m*nlayers, z + m*nlayers,
+                                 active_mixratio + m*nactive*nlayers, inactive_mixratio + m*ninactive*nlayers,
+                                 temperature + m*nlayers, planet_radius[m], star_radius,
+                                 (void *) (absorption + m*nwngrid), (void *) tau.data());
+            }
+        }
+    }
+
+    void path_integral(const int nwngrid,
+                       const int nlayers,
+                       const int nactive,
+                       const int ninactive,
+                       const int rayleigh,
+					   const int mie,
+                       const int cia,
+                       const int clouds,
+                       const double * ktab_array,
+                       const double * ktab_temp,
+                       const int ktab_ntemp,
+                       const int ngauss,
+                       const double * ktab_weights,
+                       const double * sigma_rayleigh,
+                       const int cia_npairs,
+                       const double * cia_idx,
+                       const int cia_nidx,
+                       const double * sigma_cia,
+                       const double * sigma_cia_temp,
+                       const int sigma_cia_ntemp,
+                       const double cloud_topP,
+					   const double mie_topP,
+					   const double mie_bottomP,
+					   const double * sigma_mie,
+                       const double * pressure,
+                       const double * density,
+                       const double * z,
+                       const double * active_mixratio,
+                       const double * inactive_mixratio,
+                       const double * temperature,
+                       const double planet_radius,
+                       const double star_radius,
+                       void * absorptionv,
+                       void * tauv) {
 
-        delete[] dlarray;
-        delete[] ktab_interp;
-        delete[] sigma_cia_interp;
-        dlarray = NULL;
-        ktab_interp = NULL;
-        sigma_cia_interp = NULL;
+        // single call interface: the context is kept between calls, so that the scratch memory and
+        // the path lengths are only reallocated / recomputed when needed
+        static TransmissionContext ctx;
+        set_context(&ctx, nwngrid, nlayers, nactive, ninactive, rayleigh, mie, cia, clouds,
+                    ktab_array, ktab_temp, ktab_ntemp, ngauss, ktab_weights, sigma_rayleigh, cia_npairs, cia_idx, cia_nidx,
+                    sigma_cia, sigma_cia_temp, sigma_cia_ntemp);
+        evaluate_context((void *) &ctx, cloud_topP, mie_topP, mie_bottomP, sigma_mie, pressure, density, z,
+                 active_mixratio, inactive_mixratio, temperature, planet_radius, star_radius, absorptionv, tauv);
     }
 }
@@ -27,165 +27,190 @@
 #include <iostream>
 #include <string>
 #include <sstream>
+#include "pathintegral_geometry.h"
+#include "pathintegral_interp.h"
 
 using namespace std;
 
+// Kernel context: the inputs that do not change between forward model calls (opacities, grids, flags)
+// are registered once with init_context, together with the scratch memory and the path lengths.
+// Each call of evaluate then only passes the profiles, clouds and radii.
+namespace {
+
+struct TransmissionContext {
+    int nwngrid;
+    int nlayers;
+    int nactive;
+    int ninactive;
+    int rayleigh;
+    int mie;
+    int cia;
+    int clouds;
+    const double * sigma_array;
+    const double * sigma_temp;
+    int sigma_ntemp;
+    const double * sigma_rayleigh;
+    int cia_npairs;
+    std::vector<double> cia_idx;
+    const double * sigma_cia;
+    const double * sigma_cia_temp;
+    int sigma_cia_ntemp;
+    std::vector<double> sigma_interp;
+    std::vector<double> sigma_cia_interp;
+    TemperatureWeights opacity_weights;
+    TemperatureWeights cia_weights;
+    PathGeometry geometry;
+    int nbins;                      // binning of the spectrum to the observations (see set_bins)
+    std::vector<int> bin_idx;
+    std::vector<double> bin_weight;
+    std::vector<int> bin_count;
+    std::vector<double> absorption; // full resolution spectrum and tau, when not returned (evaluate_binned)
+    std::vector<double> tau;
+    double tau_saturation;          // optical depth above which a line of sight is opaque (0: disabled)
+};
+
+static void set_context(TransmissionContext * ctx,
+                        const int nwngrid,
+                        const int nlayers,
+                        const int nactive,
+                        const int ninactive,
+                        const int rayleigh,
+                        const int mie,
+                        const int cia,
+                        const int clouds,
+                        const double * sigma_array,
+                        const double * sigma_temp,
+                        const int sigma_ntemp,
+                        const double * sigma_rayleigh,
+                        const int cia_npairs,
+                        const double * cia_idx,
+                        const int cia_nidx,
+                        const double * sigma_cia,
+                        const double * sigma_cia_temp,
+                        const int sigma_cia_ntemp) {
+
+    ctx->nwngrid = nwngrid;
+    ctx->nlayers = nlayers;
+    ctx->nactive = nactive;
+    ctx->ninactive = ninactive;
+    ctx->rayleigh = rayleigh;
+    ctx->mie = mie;
+    ctx->cia = cia;
+    ctx->clouds = clouds;
+    ctx->sigma_array = sigma_array;
+    ctx->sigma_temp = sigma_temp;
+    ctx->sigma_ntemp = sigma_ntemp;
+    ctx->sigma_rayleigh = sigma_rayleigh;
+    ctx->cia_npairs = cia_npairs;
+    ctx->cia_idx.assign(cia_idx, cia_idx + cia_nidx);
+    ctx->sigma_cia = sigma_cia;
+    ctx->sigma_cia_temp = sigma_cia_temp;
+    ctx->sigma_cia_ntemp = sigma_cia_ntemp;
+    ctx->sigma_interp.resize(nwngrid*nlayers*nactive);
+    ctx->sigma_cia_interp.resize(nwngrid*nlayers*cia_npairs);
+}
+
+}
+
 extern "C" {
 
-    void path_integral(const int nwngrid,
-                       const int nlayers,
-                       const int nactive,
-                       const int ninactive,
-                       const int rayleigh,
-					   const int mie,
-                       const int cia,
-                       const int clouds,
-                       const double * sigma_array,
-                       const double * sigma_temp,
-                       const int sigma_ntemp,
-                       const double * sigma_rayleigh,
-                       const int cia_npairs,
-                       const double * cia_idx,
-                       const int cia_nidx,
-                       const double * sigma_cia,
-                       const double * sigma_cia_temp,
-                       const int sigma_cia_ntemp,
-                       const double cloud_topP,
-					   const double mie_topP,
-					   const double mie_bottomP,
-					   const double * sigma_mie,
-                       const double * pressure,
-                       const double * density,
-                       const double * z,
-                       const double * active_mixratio,
-                       const double * inactive_mixratio,
-                       const double * temperature,
-                       const double planet_radius,
-                       const double star_radius,
-                       void * absorptionv,
-                       void * tauv) {
+    void * init_context(const int nwngrid,
+                        const int nlayers,
+                        const int nactive,
+                        const int ninactive,
+                        const int rayleigh,
+                        const int mie,
+                        const int cia,
+                        const int clouds,
+                        const double * sigma_array,
+                        const double * sigma_temp,
+                        const int sigma_ntemp,
+                        const double * sigma_rayleigh,
+                        const int cia_npairs,
+                        const double * cia_idx,
+                        const int cia_nidx,
+                        const double * sigma_cia,
+                        const double * sigma_cia_temp,
+                        const int sigma_cia_ntemp) {
+
+        // the arrays are not copied: they must stay alive (and at the same address) until free_context
+        TransmissionContext * ctx = new TransmissionContext;
+        ctx->nbins = 0;
+        ctx->tau_saturation = 0.;
+        set_context(ctx, nwngrid, nlayers, nactive, ninactive, rayleigh, mie, cia, clouds,
+                    sigma_array, sigma_temp, sigma_ntemp, sigma_rayleigh, cia_npairs, cia_idx, cia_nidx,
+                    sigma_cia, sigma_cia_temp, sigma_cia_ntemp);
+        return (void *) ctx;
+    }
+
+    void free_context(void * contextv) {
 
-//    	double mie_topP;
-//    	mie_topP = 1e-5;
+        delete (TransmissionContext *) contextv;
+    }
+
+    static void evaluate_context(void * contextv,
+                                 const double cloud_topP,
+                                 const double mie_topP,
+                                 const double mie_bottomP,
+                                 const double * sigma_mie,
+                                 const double * pressure,
+                                 const double * density,
+                                 const double * z,
+                                 const double * active_mixratio,
+                                 const double * inactive_mixratio,
+                                 const double * temperature,
+                                 const double planet_radius,
+                                 const double star_radius,
+                                 void * absorptionv,
+                                 void * tauv) {
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+
+        const int nwngrid = ctx->nwngrid;
+        const int nlayers = ctx->nlayers;
+        const int nactive = ctx->nactive;
+        const int ninactive = ctx->ninactive;
+        const int rayleigh = ctx->rayleigh;
+        const int mie = ctx->mie;
+        const int cia = ctx->cia;
+        const int clouds = ctx->clouds;
+        const double * sigma_array = ctx->sigma_array;
+        const double * sigma_temp = ctx->sigma_temp;
+        const int sigma_ntemp = ctx->sigma_ntemp;
+        const double * sigma_rayleigh = ctx->sigma_rayleigh;
+        const int cia_npairs = ctx->cia_npairs;
+        const double * cia_idx = ctx->cia_idx.data();
+        const double * sigma_cia = ctx->sigma_cia;
+        const double * sigma_cia_temp = ctx->sigma_cia_temp;
+        const int sigma_cia_ntemp = ctx->sigma_cia_ntemp;
 
         double * absorption = (double *) absorptionv;
         double * tau = (double *) tauv;
 
-        // setting up arrays and variables
-        //double* tau = new double[nlayers*nwngrid];
-        double* dz = new double[nlayers];
-        double* dlarray = new double[nlayers*nlayers];
-        double* sigma_interp = new double[nwngrid*nlayers*nactive];
-        double* sigma_cia_interp = new double[nwngrid * nlayers * cia_npairs];
-        double sigma, sigma_l, sigma_r;
+        // setting up arrays and variables (scratch memory owned by the context)
+        double* sigma_interp = ctx->sigma_interp.data();
+        double* sigma_cia_interp = ctx->sigma_cia_interp.data();
+        double sigma;
         double x1_idx[cia_npairs][nlayers];
         double x2_idx[cia_npairs][nlayers];
         double tautmp, exptau,  integral;
-        double cld_factor, cld_rho;
-        double p;
-        int count, count2, t_idx;
-
-        //dz array
-        for (int j=0; j<(nlayers); j++) {
-            if ((j+1) == nlayers) {
-                dz[j] = z[j] - z[j-1];
-            } else {
-                dz[j] = z[j+1] - z[j];
-            }
-        }
+        int count;
+
+        // dz and dl arrays, only recomputed if the altitude profile or the planet radius have changed
+        ctx->geometry.update(nlayers, z, planet_radius);
+        const double * dz = ctx->geometry.dz.data();
+        const double * dlarray = ctx->geometry.dlarray.data();
 
-        // dl array
-        count = 0;
-        for (int j=0; j<(nlayers); j++) {
-            for (int k=0; k < (nlayers - j); k++) {
-                p = pow((planet_radius+dz[0]/2.+z[j]),2);
-                if (k == 0) {
-                    dlarray[count] = 2.0 * sqrt(pow((planet_radius + dz[0]/2. + z[j] + dz[j]/2.),2) - p);
-                } else {
-                    dlarray[count] = 2.0 * (sqrt(pow((planet_radius + dz[0]/2. + z[k+j] + dz[j+k]/2.),2) - p) -  sqrt(pow((planet_radius + dz[0]/2. + z[k+j-1] + dz[j+k-1]/2.  ),2) - p));
-                }
-                count += 1;
-            }
-        }
         // interpolate sigma array to the temperature profile
-        for (int j=0; j<nlayers; j++) {
-            if (temperature[j] > sigma_temp[sigma_ntemp-1]) {
-                for (int wn=0; wn<nwngrid; wn++) {
-                    for (int l=0;l<nactive;l++) {
-                        sigma_interp[wn + nwngrid*(j + l*nlayers)] = sigma_array[wn + nwngrid*(sigma_ntemp-1 + sigma_ntemp*(j + l*nlayers))];
-                    }
-                }
-            } else if (temperature[j] < sigma_temp[0]) {
-                for (int wn=0; wn<nwngrid; wn++) {
-                    for (int l=0;l<nactive;l++) {
-                        sigma_interp[wn + nwngrid*(j + l*nlayers)] = sigma_array[wn + nwngrid*(sigma_ntemp*(j + l*nlayers))];
-                    }
-                }
-            } else {
-                if (sigma_ntemp == 1) { // This only happens for create_spectrum (when temperature is part of sigma_t)
-                    for (int wn=0; wn<nwngrid; wn++) {
-                        for (int l=0;l<nactive;l++) {
-                            sigma_interp[wn + nwngrid*(j + l*nlayers)] = sigma_array[wn + nwngrid*(sigma_ntemp*(j + l*nlayers))];
-                        }
-                    }
-                } else {
-                    for (int t=1; t<sigma_ntemp; t++) {
-                        if ((temperature[j] >= sigma_temp[t-1]) && (temperature[j] < sigma_temp[t])) {
-                            #pragma omp parallel for private(sigma_l, sigma_r, sigma)
-                            for (int wn=0; wn<nwngrid; wn++) {
-                                for (int l=0;l<nactive;l++) {
-                                    sigma_l = sigma_array[wn + nwngrid*(t-1 + sigma_ntemp*(j + l*nlayers))];
-                                    sigma_r = sigma_array[wn + nwngrid*(t + sigma_ntemp*(j + l*nlayers))];
-                                    sigma = sigma_l + (sigma_r-sigma_l)*(temperature[j]-sigma_temp[t-1])/(sigma_temp[t]-sigma_temp[t-1]);
-                                    sigma_interp[wn + nwngrid*(j + l*nlayers)] = sigma;
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        }
+        ctx->opacity_weights.update(nlayers, temperature, sigma_temp, sigma_ntemp, false);
+        interpolate_temperature(sigma_array, nactive, nlayers, sigma_ntemp, nwngrid, true, ctx->opacity_weights, sigma_interp);
 
         // interpolate sigma CIA array to the temperature profile
-        for (int j=0; j<nlayers; j++) {
-            if (sigma_cia_ntemp == 1) { //
-                for (int wn=0; wn<nwngrid; wn++) {
-                     for (int l=0;l<cia_npairs;l++) {
-                        sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp*l)];
-                     }
-                }
-            } else {
-                if (temperature[j] > sigma_cia_temp[sigma_cia_ntemp-1]) {
-                    for (int wn=0; wn<nwngrid; wn++) {
-                         for (int l=0;l<cia_npairs;l++) {
-                            sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp-1 + sigma_cia_ntemp*l)];
-                         }
-                    }
-                } else if  (temperature[j] <  sigma_cia_temp[0]) {
-                    for (int wn=0; wn<nwngrid; wn++) {
-                         for (int l=0;l<cia_npairs;l++) {
-                            sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma_cia[wn + nwngrid*(sigma_cia_ntemp*l)];
-                         }
-                    }
-                } else {
-                    for (int t=1; t<sigma_cia_ntemp; t++) {
-                        if ((temperature[j] > sigma_cia_temp[t-1]) && (temperature[j] < sigma_cia_temp[t])) {
-                            #pragma omp parallel for private(sigma_l, sigma_r, sigma)
-                            for (int wn=0; wn<nwngrid; wn++) {
-                                for (int l=0;l<cia_npairs;l++) {
-                                    sigma_l = sigma_cia[wn + nwngrid*(t-1 + sigma_cia_ntemp*l)];
-                                    sigma_r = sigma_cia[wn + nwngrid*(t + sigma_cia_ntemp*l)];
-                                    sigma = sigma_l + (sigma_r-sigma_l)*(temperature[j]-sigma_cia_temp[t-1])/(sigma_cia_temp[t]-sigma_cia_temp[t-1]);
-                                    sigma_cia_interp[wn +  nwngrid*(j + l*nlayers)] = sigma;
-                                }
-                            }
-                        }
-                    }
-                 }
-            }
+        if (cia == 1) {
+            ctx->cia_weights.update(nlayers, temperature, sigma_cia_temp, sigma_cia_ntemp, false);
+            interpolate_temperature(sigma_cia, cia_npairs, nlayers, sigma_cia_ntemp, nwngrid, false, ctx->cia_weights, sigma_cia_interp);
         }
 
-
         // get mixing ratio of individual molecules in the collision induced absorption (CIA) pairs
         for (int c=0; c<cia_npairs;c++) {
              if (int(cia_idx[c*2]) >= nactive) {
@@ -202,68 +227,78 @@ extern "C" {
             }
          }
 
+        // the layers below the cloud top (pressure higher than cloud_topP) are opaque: their contribution to the
+        // integral is the same for all wavenumbers
+        int cloud_top = 0;
+        double cloud_integral = 0.;
+        if (clouds == 1) {
+            while ((cloud_top < nlayers) && (pressure[cloud_top] >= cloud_topP)) {
+                cloud_integral += ((planet_radius+z[cloud_top])*(1.0)*dz[cloud_top]);
+                cloud_top += 1;
+            }
+        }
+        const double tau_saturation = ctx->tau_saturation;
+
         // calculate absorption
         #pragma omp parallel for schedule(dynamic) private(tautmp, sigma, count, integral, exptau)
         for (int wn=0; wn < nwngrid; wn++) {
-            count = 0;
-            integral = 0.0;
+            integral = cloud_integral;
+            for (int j=0; j<cloud_top; j++) {
+                tau[wn + j*nwngrid] = 1.0;
+            }
             //cout << " integral 0 " << integral << endl;
-            //cout << " count 0 " << count << endl;
-    		for (int j=0; j<(nlayers); j++) { 	// loop through atmosphere layers, z[0] to z[nlayers]
+    		for (int j=cloud_top; j<(nlayers); j++) { 	// loop through atmosphere layers, z[0] to z[nlayers]
     			tautmp = 0.0;
-                if ((clouds == 1) && (pressure[j] >= cloud_topP)) {
-                    //cout << j << " YES " << pressure[j] << endl;
-                    for (int k=0; k < (nlayers-j); k++) { // loop through each layer to sum up path length
-                        count += 1;
-                    }
-                    //exptau = exp(-tautmp);
-                    integral += ((planet_radius+z[j])*(1.0)*dz[j]);
-                    tau[wn + j*nwngrid] = 1.0;
-                    //cout << count << " j " << j << " z " << z[j] << " dz " << dz[j] << " exptau  " << exptau << " integral " << integral << endl;
-                } else {
-                    //cout << j << " NO " << pressure[j] << endl;
+                count = j*nlayers - (j*(j-1))/2; // first path length of layer j in dlarray
 
-                    for (int k=0; k < (nlayers-j); k++) { // loop through each layer to sum up path length
+                for (int k=0; k < (nlayers-j); k++) { // loop through each layer to sum up path length
 
-
-                        // calculate optical depth due to clouds
-                        // calculate optical depths due to active absorbing gases (absorption + rayleigh scattering)
-                        for (int l=0;l<nactive;l++) {
-                            sigma = sigma_interp[wn + nwngrid*((k+j) + l*nlayers)];
-                            tautmp += (sigma * active_mixratio[k+j+nlayers*l] * density[k+j] * dlarray[count]);
-                            //cout << " j " << j  << " k " << k  << " count " << count << " sigma " << sigma << " active_mixratio " << active_mixratio[k+j+nlayers*l] << " density " << density[k+j] << " dlarray " << dlarray[count] << " tau " << (sigma * active_mixratio[k+j+nlayers*l] * density[k+j] * dlarray[count]) << endl;
-                            //cout << " j " << j  << " k " << k  << " count " << count << " sigma_rayleigh " << sigma_rayleigh[wn + nwngrid*l] << " active_mixratio " << active_mixratio[k+j+nlayers*l] << " density " << density[k+j] << " dlarray " << dlarray[count] << endl;
-                            if (rayleigh == 1) {
-                                tautmp += sigma_rayleigh[wn + nwngrid*l] * active_mixratio[k+j+nlayers*l] * density[j+k] * dlarray[count];
-                            }
-                        }
-
-                        // calculating optical depth due inactive gases (rayleigh scattering)
+                    // calculate optical depth due to clouds
+                    // calculate optical depths due to active absorbing gases (absorption + rayleigh scattering)
+                    for (int l=0;l<nactive;l++) {
+                        sigma = sigma_interp[wn + nwngrid*((k+j) + l*nlayers)];
+                        tautmp += (sigma * active_mixratio[k+j+nlayers*l] * density[k+j] * dlarray[count]);
+                        //cout << " j " << j  << " k " << k  << " count " << count << " sigma " << sigma << " active_mixratio " << active_mixratio[k+j+nlayers*l] << " density " << density[k+j] << " dlarray " << dlarray[count] << " tau " << (sigma * active_mixratio[k+j+nlayers*l] * density[k+j] * dlarray[count]) << endl;
+                        //cout << " j " << j  << " k " << k  << " count " << count << " sigma_rayleigh " << sigma_rayleigh[wn + nwngrid*l] << " active_mixratio " << active_mixratio[k+j+nlayers*l] << " density " << density[k+j] << " dlarray " << dlarray[count] << endl;
                         if (rayleigh == 1) {
-                            for (int l=0; l<ninactive; l++) {
-                                //cout << sigma_rayleigh[wn + nwngrid*(l+nactive)] << " " << inactive_mixratio[k+j+nlayers*l] << " " << density[j+k] << " " << dlarray[count] << endl;
-                                //tautmp += sigma_rayleigh[wn + nwngrid*(l+nactive)] * inactive_mixratio[k+j+nlayers*l] * density[j+k] * dlarray[count];
-                                tautmp += sigma_rayleigh[wn + nwngrid*(l+nactive)] * inactive_mixratio[k+j+nlayers*l] * density[j+k] * dlarray[count];
-                            }
+                            tautmp += sigma_rayleigh[wn + nwngrid*l] * active_mixratio[k+j+nlayers*l] * density[j+k] * dlarray[count];
                         }
-                        // calculating optical depth due to collision induced absorption
-                        if (cia == 1) {
-                            for (int c=0; c<cia_npairs;c++) {
-                                tautmp += sigma_cia[wn + nwngrid*c] * x1_idx[c][k+j]*x2_idx[c][k+j] * density[j+k]*density[j+k] * dlarray[count];
-                            }
+                    }
+
+                    // calculating optical depth due inactive gases (rayleigh scattering)
+                    if (rayleigh == 1) {
+                        for (int l=0; l<ninactive; l++) {
+                            //cout << sigma_rayleigh[wn + nwngrid*(l+nactive)] << " " << inactive_mixratio[k+j+nlayers*l] << " " << density[j+k] << " " << dlarray[count] << endl;
+                            //tautmp += sigma_rayleigh[wn + nwngrid*(l+nactive)] * inactive_mixratio[k+j+nlayers*l] * density[j+k] * dlarray[count];
+                            tautmp += sigma_rayleigh[wn + nwngrid*(l+nactive)] * inactive_mixratio[k+j+nlayers*l] * density[j+k] * dlarray[count];
                         }
-                        //calculating mie scattering model
-                        if ((mie == 1) && (pressure[j] >= mie_topP) && (pressure[j] <= mie_bottomP)){
-                        	tautmp += sigma_mie[wn] * density[j+k] *dlarray[count];
+                    }
+                    // calculating optical depth due to collision induced absorption
+                    if (cia == 1) {
+                        for (int c=0; c<cia_npairs;c++) {
+                            tautmp += sigma_cia_interp[wn + nwngrid*((k+j) + c*nlayers)] * x1_idx[c][k+j]*x2_idx[c][k+j] * density[j+k]*density[j+k] * dlarray[count];
                         }
+                    }
+                    //calculating mie scattering model
+                    if ((mie == 1) && (pressure[j] >= mie_topP) && (pressure[j] <= mie_bottomP)){
+                    	tautmp += sigma_mie[wn] * density[j+k] *dlarray[count];
+                    }
 
-                        count += 1;
+                    count += 1;
+
+                    // saturated line of sight: the rest of the path does not change its contribution
+                    if ((tau_saturation > 0.) && (tautmp > tau_saturation)) {
+                        break;
                     }
+                }
+                if ((tau_saturation > 0.) && (tautmp > tau_saturation)) {
+                    exptau = 0.;
+                } else {
                     exptau = exp(-tautmp);
-                    integral += ((planet_radius+z[j])*(1.0-exptau)*dz[j]);
-                    tau[wn + j*nwngrid] =  exptau;
-                    //cout << count << " j " << j << " z " << z[j] << " dz " << dz[j] << " exptau  " << exptau << " integral " << integral << endl;
                 }
+                integral += ((planet_radius+z[j])*(1.0-exptau)*dz[j]);
+                tau[wn + j*nwngrid] =  exptau;
+                //cout << count << " j " << j << " z " << z[j] << " dz " << dz[j] << " exptau  " << exptau << " integral " << integral << endl;
             }
             integral *= 2.0;
             //cout << integral << endl;
@@ -271,12 +306,313 @@ extern "C" {
             //cout << wn << " " << absorption[wn] << endl;
         }
 //        cout << "END" << endl;
+    }
+
+    void evaluate(void * contextv,
+                  const double cloud_topP,
+                  const double mie_topP,
+                  const double mie_bottomP,
+                  const double * sigma_mie,
+                  const double * pressure,
+                  const double * density,
+                  const double * z,
+                  const double * active_mixratio,
+                  const double * inactive_mixratio,
+                  const double * temperature,
+                  const double planet_radius,
+                  const double star_radius,
+                  void * absorptionv,
+                  void * tauv) {
+
+        evaluate_context(contextv, cloud_topP, mie_topP, mie_bottomP, sigma_mie, pressure, density, z,
+                         active_mixratio, inactive_mixratio, temperature, planet_radius, star_radius, absorptionv, tauv);
+    }
+
+    void set_bins(void * contextv,
+                  const int nbins,
+                  const int * bin_idx,
+                  const double * bin_weight) {
+
+        // register the binning of the spectrum used by evaluate_binned: bin index of each wavenumber (-1 if the
+        // wavenumber is outside the bins) and weight of each wavenumber in its bin (1/number of wavenumbers in
+        // the bin for the mean)
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+        ctx->nbins = nbins;
+        ctx->bin_idx.assign(bin_idx, bin_idx + ctx->nwngrid);
+        ctx->bin_weight.assign(bin_weight, bin_weight + ctx->nwngrid);
+        ctx->bin_count.assign(nbins, 0);
+        for (int wn=0; wn<ctx->nwngrid; wn++) {
+            if (bin_idx[wn] >= 0) {
+                ctx->bin_count[bin_idx[wn]] += 1;
+            }
+        }
+    }
+
+    void set_tau_saturation(void * contextv,
+                            const double tau_saturation) {
+
+        // optical depth above which the slant path accumulation of a line of sight stops, the line of sight being
+        // taken as opaque (0 to disable)
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+        ctx->tau_saturation = tau_saturation;
+    }
+
+    void evaluate_binned(void * contextv,
+                         const double cloud_topP,
+                         const double mie_topP,
+                         const double mie_bottomP,
+                         const double * sigma_mie,
+                         const double * pressure,
+                         const double * density,
+                         const double * z,
+                         const double * active_mixratio,
+                         const double * inactive_mixratio,
+                         const double * temperature,
+                         const double planet_radius,
+                         const double star_radius,
+                         void * binnedv,
+                         void * absorptionv) {
+
+        // same as evaluate, but returns the spectrum binned with the bins of set_bins (nbins, empty bins are nan).
+        // The full resolution spectrum is also returned in absorptionv, unless it is NULL
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+        const int nwngrid = ctx->nwngrid;
+        double * binned = (double *) binnedv;
+        double * absorption = (double *) absorptionv;
+
+        if (absorption == NULL) {
+            ctx->absorption.resize(nwngrid);
+            absorption = ctx->absorption.data();
+        }
+        ctx->tau.resize(nwngrid*ctx->nlayers);
+
+        evaluate_context(contextv, cloud_topP, mie_topP, mie_bottomP, sigma_mie, pressure, density, z,
+                         active_mixratio, inactive_mixratio, temperature, planet_radius, star_radius,
+                         (void *) absorption, (void *) ctx->tau.data());
+
+        for (int b=0; b<ctx->nbins; b++) {
+            binned[b] = 0.;
+        }
+        for (int wn=0; wn<nwngrid; wn++) {
+            if (ctx->bin_idx[wn] >= 0) {
+                binned[ctx->bin_idx[wn]] += absorption[wn] * ctx->bin_weight[wn];
+            }
+        }
+        for (int b=0; b<ctx->nbins; b++) {
+            if (ctx->bin_count[b] == 0) {
+                binned[b] = NAN;
+            }
+        }
+    }
+
+    void evaluate_batch(void * contextv,
+                        const int nmodels,
+                        const double * cloud_topP,
+                        const double * mie_topP,
+                        const double * mie_bottomP,
+                        const double * sigma_mie,
+                        const double * pressure,
+                        const double * density,
+                        const double * z,
+                        const double * active_mixratio,
+                        const double * inactive_mixratio,
+                        const double * temperature,
+                        const double * planet_radius,
+                        const double star_radius,
+                        void * absorptionv) {
+
+        // evaluate nmodels forward models sharing the same opacities. The profiles of the models are stacked
+        // (e.g. temperature is nmodels x nlayers), the spectra are returned in absorption (nmodels x nwngrid).
+        // The openmp version runs the models in parallel, each thread with its own copy of the context
+        // (scratch memory and path lengths).
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+        const long nwngrid = ctx->nwngrid;
+        const long nlayers = ctx->nlayers;
+        const long nactive = ctx->nactive;
+        const long ninactive = ctx->ninactive;
+        double * absorption = (double *) absorptionv;
+
+        #pragma omp parallel
+        {
+            TransmissionContext local = *ctx;
+            std::vector<double> tau(nwngrid*nlayers);
+
+            #pragma omp for schedule(dynamic)
+            for (int m=0; m<nmodels; m++) {
+                evaluate_context((void *) &local, cloud_topP[m], mie_topP[m], mie_bottomP[m], sigma_mie + m*nwngrid,
+                                 pressure + m*nlayers, density + m*nlayers, z + m*nlayers,
+                                 active_mixratio + m*nactive*nlayers, inactive_mixratio + m*ninactive*nlayers,
+                                 temperature + m*nlayers, planet_radius[m], star_radius,
+                                 (void *) (absorption + m*nwngrid), (void *) tau.data());
+            }
+        }
+    }
+
+    void extinction(void * contextv,
+                    const double * density,
+                    const double * active_mixratio,
+                    const double * inactive_mixratio,
+                    const double * temperature,
+                    void * extinctionv) {
+
+        // extinction coefficient of each layer (nlayers x nwngrid), i.e. the optical depth per unit path length
+        // due to absorption, rayleigh scattering and cia. Used by the matrix form of the path integral, where the
+        // optical depths are obtained as the product of the path lengths matrix and this extinction matrix
+        // (see transmission.matrix_pathintegral_xsec). Mie scattering and clouds are applied afterwards.
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+
+        const int nwngrid = ctx->nwngrid;
+        const int nlayers = ctx->nlayers;
+        const int nactive = ctx->nactive;
+        const int ninactive = ctx->ninactive;
+        const int cia_npairs = ctx->cia_npairs;
+        const double * sigma_rayleigh = ctx->sigma_rayleigh;
+        const double * cia_idx = ctx->cia_idx.data();
+
+        double * ext = (double *) extinctionv;
+        double * sigma_interp = ctx->sigma_interp.data();
+        double * sigma_cia_interp = ctx->sigma_cia_interp.data();
+        std::vector<double> x1_idx(cia_npairs*nlayers);
+        std::vector<double> x2_idx(cia_npairs*nlayers);
+
+        // interpolate sigma array to the temperature profile
+        ctx->opacity_weights.update(nlayers, temperature, ctx->sigma_temp, ctx->sigma_ntemp, false);
+        interpolate_temperature(ctx->sigma_array, nactive, nlayers, ctx->sigma_ntemp, nwngrid, true,
+                                ctx->opacity_weights, sigma_interp);
+
+        // interpolate sigma CIA array to the temperature profile
+        if (ctx->cia == 1) {
+            ctx->cia_weights.update(nlayers, temperature, ctx->sigma_cia_temp, ctx->sigma_cia_ntemp, false);
+            interpolate_temperature(ctx->sigma_cia, cia_npairs, nlayers, ctx->sigma_cia_ntemp, nwngrid, false,
+                                    ctx->cia_weights, sigma_cia_interp);
+        }
+
+        // get mixing ratio of individual molecules in the collision induced absorption (CIA) pairs
+        for (int c=0; c<cia_npairs;c++) {
+            for (int j=0;j<nlayers;j++) {
+                if (int(cia_idx[c*2]) >= nactive) {
+                    x1_idx[j + c*nlayers] = inactive_mixratio[j+nlayers*(int(cia_idx[c*2])-nactive)];
+                    x2_idx[j + c*nlayers] = inactive_mixratio[j+nlayers*(int(cia_idx[c*2+1])-nactive)];
+                } else {
+                    x1_idx[j + c*nlayers] = active_mixratio[j+nlayers*int(cia_idx[c*2])];
+                    x2_idx[j + c*nlayers] = active_mixratio[j+nlayers*int(cia_idx[c*2+1])];
+                }
+            }
+        }
+
+        // same terms as the path integral above, per unit path length
+        #pragma omp parallel for
+        for (int j=0; j<nlayers; j++) {
+            double * ext_j = ext + (long) j*nwngrid;
+            for (int wn=0; wn<nwngrid; wn++) {
+                ext_j[wn] = 0.;
+            }
+            for (int l=0;l<nactive;l++) {
+                const double * sigma_l = sigma_interp + (long) nwngrid*(j + l*nlayers);
+                const double x = active_mixratio[j+nlayers*l] * density[j];
+                for (int wn=0; wn<nwngrid; wn++) {
+                    ext_j[wn] += sigma_l[wn] * x;
+                }
+                if (ctx->rayleigh == 1) {
+                    for (int wn=0; wn<nwngrid; wn++) {
+                        ext_j[wn] += sigma_rayleigh[wn + nwngrid*l] * x;
+                    }
+                }
+            }
+            if (ctx->rayleigh == 1) {
+                for (int l=0; l<ninactive; l++) {
+                    const double x = inactive_mixratio[j+nlayers*l] * density[j];
+                    for (int wn=0; wn<nwngrid; wn++) {
+                        ext_j[wn] += sigma_rayleigh[wn + nwngrid*(l+nactive)] * x;
+                    }
+                }
+            }
+            if (ctx->cia == 1) {
+                for (int c=0; c<cia_npairs;c++) {
+                    const double * sigma_c = sigma_cia_interp + (long) nwngrid*(j + c*nlayers);
+                    const double x = x1_idx[j + c*nlayers]*x2_idx[j + c*nlayers] * density[j]*density[j];
+                    for (int wn=0; wn<nwngrid; wn++) {
+                        ext_j[wn] += sigma_c[wn] * x;
+                    }
+                }
+            }
+        }
+    }
+
+    void path_lengths(void * contextv,
+                      const double * z,
+                      const double planet_radius,
+                      void * pathv,
+                      void * dzv) {
+
+        // path lengths as a (nlayers x nlayers) upper triangular matrix: element [j, j+k] is the path length
+        // in layer j+k of the line of sight with impact parameter j. Also returns the layer thickness dz
+
+        TransmissionContext * ctx = (TransmissionContext *) contextv;
+        const int nlayers = ctx->nlayers;
+        double * path = (double *) pathv;
+        double * dz = (double *) dzv;
+
+        ctx->geometry.update(nlayers, z, planet_radius);
+
+        int count = 0;
+        for (int j=0; j<nlayers; j++) {
+            dz[j] = ctx->geometry.dz[j];
+            for (int k=0; k<j; k++) {
+                path[k + j*nlayers] = 0.;
+            }
+            for (int k=0; k < (nlayers - j); k++) {
+                path[k + j + j*nlayers] = ctx->geometry.dlarray[count];
+                count += 1;
+            }
+        }
+    }
+
+    void path_integral(const int nwngrid,
+                       const int nlayers,
+                       const int nactive,
+                       const int ninactive,
+                       const int rayleigh,
+					   const int mie,
+                       const int cia,
+                       const int clouds,
+                       const double * sigma_array,
+                       const double * sigma_temp,
+                       const int sigma_ntemp,
+                       const double * sigma_rayleigh,
+                       const int cia_npairs,
+                       const double * cia_idx,
+                       const int cia_nidx,
+                       const double * sigma_cia,
+                       const double * sigma_cia_temp,
+                       const int sigma_cia_ntemp,
+                       const double cloud_topP,
+					   const double mie_topP,
+					   const double mie_bottomP,
+					   const double * sigma_mie,
+                       const double * pressure,
+                       const double * density,
+                       const double * z,
+                       const double * active_mixratio,
+                       const double * inactive_mixratio,
+                       const double * temperature,
+                       const double planet_radius,
+                       const double star_radius,
+                       void * absorptionv,
+                       void * tauv) {
 
-        delete[] dlarray;
-        delete[] sigma_interp;
-        delete[] sigma_cia_interp;
-        dlarray = NULL;
-        sigma_interp = NULL;
-        sigma_cia_interp = NULL;
+        // single call interface: the context is kept between calls, so that the scratch memory and
+        // the path lengths are only reallocated / recomputed when needed
+        static TransmissionContext ctx;
+        set_context(&ctx, nwngrid, nlayers, nactive, ninactive, rayleigh, mie, cia, clouds,
+                    sigma_array, sigma_temp, sigma_ntemp, sigma_rayleigh, cia_npairs, cia_idx, cia_nidx,
+                    sigma_cia, sigma_cia_temp, sigma_cia_ntemp);
+        evaluate_context((void *) &ctx, cloud_topP, mie_topP, mie_bottomP, sigma_mie, pressure, density, z,
+                 active_mixratio, inactive_mixratio, temperature, planet_radius, star_radius, absorptionv, tauv);
     }
 }
@@ -4,6 +4,11 @@ import numpy as np
 import ctypes as C
 from scipy.stats.mstats_basic import tmean
 
+from library_opacity import write_opacity_store, read_opacity_store
+
+# name of the indexed binary library of stellar spectra, in the star_path folder (see tools/convert_star_library.py)
+STAR_LIBRARY_NAME = 'TauREx.starlib'
+
 def black_body(lamb, temp):
     #small function calculating plank black body
     #input: microns, kelvin
@@ -22,6 +27,47 @@ def black_body(lamb, temp):
     
     return BB * 1e-6
 
+def get_phoenix_temperature(filename):
+    # effective temperature of a Phoenix spectrum, from the file name (e.g. lte05800-4.50-0.0...fmt)
+    return float(os.path.basename(filename).split('-')[0][3:])
+
+def read_phoenix_spectrum(filename):
+    # read an ASCII Phoenix spectrum: wavelength (micron), flux (ergs)
+    return np.loadtxt(filename, dtype='float', comments='#')
+
+def write_star_library(filenames, library_filename):
+    '''
+    Pack the Phoenix spectra in filenames into one indexed binary file (opacity store format).
+    The spectra are sorted by temperature and concatenated in the array 'sed' (npoints, 2: wavelength, flux),
+    so that each spectrum is a contiguous block. 'offsets' and 'lengths' give the position of each spectrum.
+    '''
+
+    spectra = {}
+    for filename in sorted(filenames):
+        # with duplicate temperatures, the last file (in alphabetical order) is used
+        spectra[get_phoenix_temperature(filename)] = filename
+    temperatures = np.sort(list(spectra.keys()))
+
+    seds = [read_phoenix_spectrum(spectra[temp])[:,:2] for temp in temperatures]
+    lengths = np.asarray([len(sed) for sed in seds], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+
+    write_opacity_store(library_filename,
+                        {'temperatures': temperatures,
+                         'offsets': offsets,
+                         'lengths': lengths,
+                         'sed': np.ascontiguousarray(np.concatenate(seds))},
+                        {'filenames': [os.path.basename(spectra[temp]) for temp in temperatures]})
+
+def read_star_library(library_filename):
+    # index of the library (temperatures, offsets, lengths) in memory, spectra memory mapped
+    return read_opacity_store(library_filename)
+
+def get_star_library_spectrum(star_library, idx):
+    # return the idx-th spectrum of the library as a (npoints, 2) array: wavelength (micron), flux (ergs)
+    offset = star_library['offsets'][idx]
+    return np.array(star_library['sed'][offset:offset+star_library['lengths'][idx]])
+
 def fit_brightness_temp(wave,flux):
     '''
     function fitting a black body to given flux-wavelength 
@@ -113,7 +113,7 @@ def round_base(x, base=.05):
 def binspectrum(spectrum_in, resolution):
     wavegrid, dlamb_grid = get_specgrid(R=resolution,lambda_min=np.min(spectrum_in[:,0]),lambda_max=np.max(spectrum_in[:,0]))
     spec_bin_grid, spec_bin_grid_idx = get_specbingrid(wavegrid, spectrum_in[:,0])
-    spectrum_binned = [spectrum_in[:,1][spec_bin_grid_idx == i].mean() for i in range(1,len(spec_bin_grid))]
+    spectrum_binned = binning_operator.from_bingrid_idx(spec_bin_grid_idx, len(spec_bin_grid)-1).apply(spectrum_in[:,1])
     return transpose(vstack((wavegrid, spectrum_binned)))
 
 def get_specgrid( R=5000, lambda_min=0.1, lambda_max=20.0):
@@ -170,6 +170,112 @@ def get_specbingrid(wavegrid, specgrid, binwidths=None):
     return bingrid, bingrid_idx
 
 
+class binning_operator(object):
+
+    # sparse (CSR) operator binning a spectrum sampled on a grid of npoints points to nbins bins. The entries
+    # (point, weight) are sorted by bin, bin i uses the entries offsets[i] to offsets[i+1]. The binned spectrum
+    # is the weighted sum of the points in each bin (the weights of a bin sum up to one). Empty bins are nan.
+    # Built once for a pair of grids, applied in O(npoints) to a spectrum (npoints) or to a stack of
+    # spectra (N x npoints)
+
+    def __init__(self, bins, points, weights, nbins, npoints):
+
+        order = np.argsort(bins, kind='mergesort')
+        self.nbins = nbins
+        self.npoints = npoints
+        self.points = np.asarray(points)[order].astype(np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64)[order]
+        self.bin_count = np.bincount(np.asarray(bins, dtype=np.int64), minlength=nbins)
+        self.offsets = np.zeros(nbins+1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(self.bin_count)
+        self.nonempty = self.bin_count > 0
+
+        # if each point is in one bin at most, bin of each point (-1 outside the bins) and weight of each point
+        # in its bin. This is the form used by the transmission kernel (set_bins), None otherwise
+        self.bin_idx = None
+        self.bin_weight = None
+        if np.all(np.bincount(self.points, minlength=npoints) <= 1):
+            self.bin_idx = np.empty(npoints, dtype=np.int32)
+            self.bin_idx[:] = -1
+            self.bin_idx[self.points] = np.repeat(np.arange(nbins, dtype=np.int32), self.bin_count)
+            self.bin_weight = np.zeros(npoints)
+            self.bin_weight[self.points] = self.weights
+
+    @classmethod
+    def from_bingrid_idx(cls, bingrid_idx, nbins):
+
+        # mean of the points in each bin, from the bin index array of get_specbingrid (bins 1 to nbins, anything
+        # else is outside the bins)
+
+        bingrid_idx = np.asarray(bingrid_idx)
+        valid = np.zeros(len(bingrid_idx), dtype=bool)
+        valid[np.isfinite(bingrid_idx)] = True
+        valid[valid] = (bingrid_idx[valid] >= 1) & (bingrid_idx[valid] <= nbins)
+        bins = bingrid_idx[valid].astype(np.int64) - 1
+        bin_count = np.bincount(bins, minlength=nbins)
+
+        return cls(bins, np.where(valid)[0], 1./bin_count[bins], nbins, len(bingrid_idx))
+
+    @classmethod
+    def from_edges(cls, specgrid, bin_low, bin_high):
+
+        # fractional overlap binning: each point of specgrid covers the interval between the midpoints with its
+        # neighbours (as in get_specbingrid), and is weighted by the fraction of the bin [bin_low, bin_high]
+        # it covers. A point can contribute to more than one bin. specgrid can be increasing or decreasing
+
+        specgrid = np.asarray(specgrid, dtype=np.float64)
+        bin_low = np.asarray(bin_low, dtype=np.float64)
+        bin_high = np.asarray(bin_high, dtype=np.float64)
+        nbins = len(bin_low)
+
+        order = np.argsort(specgrid, kind='mergesort')
+        grid = specgrid[order]
+        edges = np.empty(len(grid)+1)
+        edges[1:-1] = (grid[1:] + grid[:-1])/2.
+        edges[0] = grid[0] - (grid[1]-grid[0])/2.
+        edges[-1] = grid[-1] + (grid[-1]-grid[-2])/2.
+
+        # sorted points overlapping each bin: first to last (excluded)
+        first = np.searchsorted(edges[1:], bin_low, side='right')
+        last = np.searchsorted(edges[:-1], bin_high, side='left')
+        count = np.maximum(last - first, 0)
+        bins = np.repeat(np.arange(nbins), count)
+        start = np.cumsum(count) - count
+        sorted_points = np.repeat(first, count) + np.arange(np.sum(count)) - np.repeat(start, count)
+
+        overlap = np.minimum(edges[sorted_points+1], bin_high[bins]) - np.maximum(edges[sorted_points], bin_low[bins])
+        keep = overlap > 0
+        bins, sorted_points, overlap = bins[keep], sorted_points[keep], overlap[keep]
+        total = np.bincount(bins, weights=overlap, minlength=nbins)
+
+        return cls(bins, order[sorted_points], overlap/total[bins], nbins, len(specgrid))
+
+    def apply(self, spectrum):
+
+        # bin a spectrum (npoints) or a stack of spectra (N x npoints)
+
+        spectrum = np.asarray(spectrum)
+        binned = np.empty(spectrum.shape[:-1] + (self.nbins,))
+        binned[:] = np.nan
+        if len(self.points) > 0:
+            values = spectrum[..., self.points] * self.weights
+            binned[..., self.nonempty] = np.add.reduceat(values, self.offsets[:-1][self.nonempty], axis=-1)
+
+        return binned
+
+
+def get_binning_operator(wavegrid, specgrid, binwidths=None):
+    # binning operator from the points of specgrid to the bins centred on wavegrid: mean of the points in the bins
+    # of get_specbingrid or, if the bin widths are given, fractional overlap of the points with the bins
+
+    if not isinstance(binwidths, (np.ndarray, np.generic)):
+        bingrid, bingrid_idx = get_specbingrid(wavegrid, specgrid)
+        return binning_operator.from_bingrid_idx(bingrid_idx, len(wavegrid))
+    else:
+        wavegrid = np.asarray(wavegrid)
+        return binning_operator.from_edges(specgrid, wavegrid-binwidths/2., wavegrid+binwidths/2.)
+
+
 def plot_bin(spectrum, R, ycol=1, yadg=0., **kwargs):
     sptmp = np.zeros((len(spectrum[:,0]),2))
     sptmp[:,0] = spectrum[:,0]
@@ -286,3 +392,74 @@ def insensitive_glob(pattern):
     def either(c):
         return '[%s%s]'%(c.lower(),c.upper()) if c.isalpha() else c
     return glob.glob(''.join(map(either,pattern)))
+
+def get_interp_bracket(x, xp):
+    ''' Bracketing indexes of the scalar x in the increasing grid xp, used by interp_bracket.
+        Returns (j, dx, dxp): if dx is None the result is simply the j-th element of the grid,
+        otherwise the result is interpolated between j and j+1, with dx = x - xp[j] and dxp = xp[j+1] - xp[j].
+        Values outside the grid are clamped to the first/last element, as in np.interp '''
+    xp = np.asarray(xp, dtype=np.float64)
+    if x < xp[0]:
+        return 0, None, None
+    if x >= xp[-1]:
+        return len(xp)-1, None, None
+    j = np.searchsorted(xp, x, side='right') - 1
+    if xp[j] == x:
+        return j, None, None
+    return j, x - xp[j], xp[j+1] - xp[j]
+
+def interp_bracket(fp, bracket, out=None):
+    ''' Linear interpolation of fp along its first axis, using the bracket returned by get_interp_bracket.
+        The arithmetic is the same as np.interp, so the result is identical to calling
+        np.interp(x, xp, fp[:, i, j, ...]) for every element, without looping over the other axes '''
+    j, dx, dxp = bracket
+    if out is None:
+        out = np.empty(fp.shape[1:])
+    if dx is None:
+        out[...] = fp[j]
+        return out
+    with np.errstate(invalid='ignore'):
+        np.subtract(fp[j+1], fp[j], out=out)
+        out /= dxp
+        out *= dx
+        out += fp[j]
+    # same fallback as np.interp for infinite values
+    nan = np.isnan(out)
+    if np.any(nan):
+        left = np.asarray(fp[j])[nan]
+        right = np.asarray(fp[j+1])[nan]
+        with np.errstate(invalid='ignore'):
+            slope = (right - left)/dxp
+            value = slope*(dx - dxp) + right
+        value[np.isnan(value) & (left == right)] = left[np.isnan(value) & (left == right)]
+        out[nan] = value
+    return out
+
+def get_interp_weights(x, xp):
+    ''' Bracketing indexes and distances of the points x in the increasing grid xp, used by interp_rows.
+        Computed once, they can be applied to any number of arrays sampled on xp '''
+    x = np.asarray(x, dtype=np.float64)
+    xp = np.asarray(xp, dtype=np.float64)
+    j = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp)-1)
+    # points matching a grid point exactly, or outside the grid, take the value of a grid point (as np.interp)
+    exact = (x < xp[0]) | (x >= xp[-1]) | (xp[j] == x)
+    j[x < xp[0]] = 0
+    jp1 = np.minimum(j + 1, len(xp)-1)
+    return j, jp1, x - xp[j], xp[jp1] - xp[j], exact
+
+def interp_rows(fp, weights):
+    ''' Linear interpolation along the last axis of fp, with the weights returned by get_interp_weights.
+        Same arithmetic as np.interp, so the result is identical to calling np.interp on every row of fp '''
+    j, jp1, dx, dxp, exact = weights
+    left = fp[..., j]
+    right = fp[..., jp1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = (right - left)/dxp*dx + left
+        out[..., exact] = left[..., exact]
+        # same fallback as np.interp for infinite values
+        nan = np.isnan(out) & ~np.isnan(left) & ~np.isnan(right)
+        if np.any(nan):
+            value = ((right - left)/dxp*(dx - dxp) + right)
+            value[np.isnan(value) & (left == right)] = left[np.isnan(value) & (left == right)]
+            out[nan] = value[nan]
+    return out
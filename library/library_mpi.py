@@ -0,0 +1,162 @@
+'''
+    TauREx v2 - Development version - DO NOT DISTRIBUTE
+
+    MPI support functions: node level shared memory
+
+    Developers: Ingo Waldmann, Marco Rocchetto (University College London)
+
+'''
+
+import logging
+import numpy as np
+
+try:
+    from mpi4py import MPI
+    MPIimport = True
+except ImportError:
+    MPIimport = False
+
+# arrays smaller than this (in bytes) are simply copied to all processes
+SHARED_MIN_SIZE = 2**20
+
+# MPI windows of the shared arrays. They must stay alive as long as the arrays are used
+_shared_windows = []
+
+
+def get_mpi_size():
+
+    if MPIimport:
+        return MPI.COMM_WORLD.Get_size()
+    return 1
+
+
+def get_mpi_rank():
+
+    if MPIimport:
+        return MPI.COMM_WORLD.Get_rank()
+    return 0
+
+
+def get_node_comm():
+
+    # communicator of the processes running on the same node (MPI-3). None if MPI is not available
+    if not MPIimport or MPI.COMM_WORLD.Get_size() <= 1:
+        return None
+    return MPI.COMM_WORLD.Split_type(MPI.COMM_TYPE_SHARED)
+
+
+def shared_array(comm, shape, dtype, source=None):
+
+    # allocate an array in a shared memory window of the node communicator comm (collective call).
+    # The memory is allocated by the first process of the node, that copies source into it. All other
+    # processes map the same memory, read only.
+
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    if comm.Get_rank() != 0:
+        nbytes = 0
+    win = MPI.Win.Allocate_shared(nbytes, dtype.itemsize, comm=comm)
+    _shared_windows.append(win)
+    buf, itemsize = win.Shared_query(0)
+    array = np.ndarray(buffer=buf, dtype=dtype, shape=shape)
+    if comm.Get_rank() == 0 and source is not None:
+        array[...] = source
+    comm.Barrier()
+    if comm.Get_rank() != 0:
+        array.flags.writeable = False
+    return array
+
+
+def share_dict(comm, dictionary):
+
+    # share a (nested) dictionary of arrays across the processes of a node (collective call).
+    # Only the first process of the node needs to pass the dictionary (the others pass None).
+    # Large arrays are moved to shared memory, everything else is broadcast.
+    # Return the dictionary, where large arrays are replaced by shared arrays
+
+    def skeleton(item):
+        if isinstance(item, dict):
+            return dict((key, skeleton(val)) for key, val in item.items())
+        if isinstance(item, np.ndarray) and item.nbytes >= SHARED_MIN_SIZE:
+            return ('__shared__', item.shape, item.dtype.str)
+        if isinstance(item, np.ndarray):
+            return np.array(item)
+        return item
+
+    def fill(item, source):
+        if isinstance(item, dict):
+            return dict((key, fill(item[key], source[key] if source is not None else None))
+                        for key in sorted(item.keys()))
+        if isinstance(item, tuple) and len(item) == 3 and item[0] == '__shared__':
+            return shared_array(comm, item[1], item[2], source=source)
+        return item
+
+    if comm.Get_rank() == 0:
+        tree = skeleton(dictionary)
+    else:
+        tree = None
+    tree = comm.bcast(tree, root=0)
+    shared = fill(tree, dictionary if comm.Get_rank() == 0 else None)
+
+    if comm.Get_rank() == 0:
+        logging.info('Shared %.1f MB of input data with %i processes on this node' %
+                     (sum([win.Get_attr(MPI.WIN_SIZE) for win in _shared_windows])/1e6, comm.Get_size()))
+
+    return shared
+
+
+def bcast_dict(comm, dictionary, chunk_size=2**27):
+
+    # broadcast a (nested) dictionary of arrays from the first process of comm (collective call).
+    # Arrays are sent as raw buffers (Bcast, in chunks of chunk_size bytes), everything else is pickled.
+    # Only the first process needs to pass the dictionary (the others pass None).
+
+    def skeleton(item):
+        if isinstance(item, dict):
+            return dict((key, skeleton(val)) for key, val in item.items())
+        if isinstance(item, np.ndarray) and not item.dtype.hasobject:
+            return ('__array__', item.shape, item.dtype.str)
+        return item
+
+    def fill(item, source):
+        if isinstance(item, dict):
+            return dict((key, fill(item[key], source[key] if source is not None else None))
+                        for key in sorted(item.keys()))
+        if isinstance(item, tuple) and len(item) == 3 and item[0] == '__array__':
+            if comm.Get_rank() == 0:
+                array = source
+            else:
+                array = np.empty(item[1], dtype=item[2])
+            flat = array.reshape(-1) # copy on the master process if the array is not contiguous
+            step = max(1, chunk_size // array.dtype.itemsize)
+            for idx in range(0, flat.size, step):
+                chunk = flat[idx:idx+step]
+                if comm.Get_rank() == 0 and not chunk.flags.writeable:
+                    chunk = np.array(chunk) # memory mapped arrays are read only
+                comm.Bcast(chunk, root=0)
+            return array
+        return item
+
+    if comm.Get_rank() == 0:
+        tree = skeleton(dictionary)
+    else:
+        tree = None
+    tree = comm.bcast(tree, root=0)
+    return fill(tree, dictionary if comm.Get_rank() == 0 else None)
+
+
+def broadcast_dict(dictionary, node_comm=None):
+
+    # broadcast a dictionary of arrays from the master process to all the processes (collective call over
+    # COMM_WORLD). If node_comm is given, the dictionary is only sent to the first process of each node, and then
+    # shared with the other processes of the node (see share_dict)
+
+    comm = MPI.COMM_WORLD
+    if node_comm is None:
+        return bcast_dict(comm, dictionary)
+
+    leader_comm = comm.Split(0 if node_comm.Get_rank() == 0 else MPI.UNDEFINED, comm.Get_rank())
+    if leader_comm != MPI.COMM_NULL:
+        dictionary = bcast_dict(leader_comm, dictionary)
+        leader_comm.Free()
+    return share_dict(node_comm, dictionary)
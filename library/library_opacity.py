@@ -0,0 +1,484 @@
+'''
+    TauREx v2 - Development version - DO NOT DISTRIBUTE
+
+    Binary opacity store
+
+    Cross sections and ktables are stored in a single binary file (extension .TauREx.mmap) that can be
+    memory mapped. The file starts with a short fixed header:
+
+        8 bytes   magic string 'TAUREXMM'
+        8 bytes   length of the json header (unsigned int64, little endian)
+        n bytes   json header
+
+    The json header lists every array stored in the file (dtype, shape, byte offset) and a dictionary of
+    scalar attributes. Each array is written in C order and starts on a page boundary, so that any
+    slice along the leading axes maps onto contiguous chunks of the file. Opacities are stored already
+    converted to m^2 (attribute 'units' = 'm^2').
+
+    Developers: Ingo Waldmann, Marco Rocchetto (University College London)
+
+'''
+
+import os
+import glob
+import json
+import hashlib
+import struct
+import logging
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+import numpy as np
+
+OPACITY_STORE_MAGIC = b'TAUREXMM'
+OPACITY_STORE_EXT = '.TauREx.mmap'
+OPACITY_STORE_ALIGN = 4096
+
+
+def _json_scalar(value):
+
+    # convert numpy scalars, tuples and lists to something json can write
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_json_scalar(val) for val in value]
+    return value
+
+
+def write_opacity_store(filename, arrays, attrs=None):
+
+    # write a dictionary of numpy arrays (and a dictionary of scalar attributes) to a binary opacity store
+
+    header = {'arrays': {}, 'attrs': {}}
+    if attrs:
+        for key, val in attrs.items():
+            header['attrs'][key] = _json_scalar(val)
+
+    # compute the offsets. Leave some room for the header, then align every array to a page boundary
+    names = sorted(arrays.keys())
+    arrays = dict((name, np.ascontiguousarray(arrays[name])) for name in names)
+    for name in names:
+        header['arrays'][name] = {'dtype': arrays[name].dtype.str,
+                                  'shape': list(arrays[name].shape),
+                                  'offset': 0}
+
+    offset = OPACITY_STORE_ALIGN
+    while True:
+        # iterate, as the offsets change the length of the header itself
+        pos = offset
+        for name in names:
+            header['arrays'][name]['offset'] = pos
+            pos += arrays[name].nbytes
+            pos = int(np.ceil(pos/float(OPACITY_STORE_ALIGN))*OPACITY_STORE_ALIGN)
+        header_str = json.dumps(header).encode('utf-8')
+        if 16 + len(header_str) <= offset:
+            break
+        offset = int(np.ceil((16 + len(header_str))/float(OPACITY_STORE_ALIGN))*OPACITY_STORE_ALIGN)
+
+    with open(filename, 'wb') as f:
+        f.write(OPACITY_STORE_MAGIC)
+        f.write(struct.pack('<Q', len(header_str)))
+        f.write(header_str)
+        for name in names:
+            f.seek(header['arrays'][name]['offset'])
+            arrays[name].tofile(f)
+        # make sure the last array is fully allocated on disk
+        f.truncate(max(f.tell(), offset))
+
+
+def read_opacity_store_header(filename):
+
+    # return the json header of a binary opacity store, without mapping any array
+
+    with open(filename, 'rb') as f:
+        magic = f.read(8)
+        if magic != OPACITY_STORE_MAGIC:
+            raise IOError('%s is not a TauREx binary opacity store' % filename)
+        length = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(length).decode('utf-8'))
+    return header
+
+
+def is_opacity_store(filename):
+
+    if not os.path.isfile(filename):
+        return False
+    with open(filename, 'rb') as f:
+        return f.read(8) == OPACITY_STORE_MAGIC
+
+
+def read_opacity_store(filename, mmap=True):
+
+    # return a dictionary with the same layout as the pickled cross sections / ktables.
+    # Arrays are memory mapped (read only), so slicing them does not read anything from disk
+    # until the data is actually used. Attributes are added as dictionary items.
+
+    header = read_opacity_store_header(filename)
+    store = {}
+    for key, val in header['attrs'].items():
+        store[key] = val
+    for name, desc in header['arrays'].items():
+        shape = tuple(desc['shape'])
+        dtype = np.dtype(str(desc['dtype']))
+        if np.prod(shape) == 0:
+            store[name] = np.zeros(shape, dtype=dtype)
+        elif mmap and len(shape) > 1:
+            store[name] = np.memmap(filename, dtype=dtype, mode='r', offset=desc['offset'], shape=shape)
+        else:
+            # axes and other one dimensional arrays are small, and are always read into memory
+            with open(filename, 'rb') as f:
+                f.seek(desc['offset'])
+                store[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return store
+
+
+def load_opacity_file(filename):
+
+    # load a cross section or ktable, either from a binary store or from a pickle.
+    # Return the dictionary and the number the opacities need to be divided by to get m^2
+
+    if is_opacity_store(filename):
+        opacity = read_opacity_store(filename)
+        if opacity.get('units', 'cm^2') == 'm^2':
+            return opacity, 1.
+        return opacity, 10000.
+
+    try:
+        opacity = pickle.load(open(filename, 'rb'), encoding='latin1') # python 3
+    except:
+        opacity = pickle.load(open(filename)) # python 2
+
+    return opacity, 10000.
+
+
+def scale_opacity(array, divisor):
+
+    # convert to m^2. Memory mapped arrays already in m^2 are returned as they are (no copy)
+    if divisor == 1.:
+        return array
+    return array / divisor
+
+
+def sort_opacity_files(filenames):
+
+    # binary stores first, so that they are preferred to pickles of the same molecule
+    stores = [filename for filename in filenames if filename.endswith(OPACITY_STORE_EXT)]
+    others = [filename for filename in filenames if not filename.endswith(OPACITY_STORE_EXT)]
+    return stores + others
+
+
+def convert_opacity_to_store(filename_in, filename_out):
+
+    # convert a pickled cross section or ktable to a binary opacity store, in m^2
+
+    opacity, divisor = load_opacity_file(filename_in)
+
+    if 'kcoeff' in opacity:
+        kind = 'ktable'
+        opacity_key = 'kcoeff'
+        axes = ['t', 'p', 'samples', 'weights', 'bin_centers', 'bin_edges']
+    elif 'xsecarr' in opacity:
+        kind = 'xsec'
+        opacity_key = 'xsecarr'
+        axes = ['t', 'p', 'wno']
+    else:
+        raise IOError('%s does not look like a TauREx cross section or ktable' % filename_in)
+
+    arrays = {}
+    attrs = {'kind': kind, 'units': 'm^2', 'source': os.path.basename(filename_in)}
+    arrays[opacity_key] = np.asarray(opacity[opacity_key], dtype=np.float64) / divisor
+    for key in axes:
+        if key in opacity:
+            arrays[key] = np.asarray(opacity[key], dtype=np.float64)
+    for key, val in opacity.items():
+        if key in arrays or key == opacity_key:
+            continue
+        if isinstance(val, (str, int, float, bool, np.generic, list, tuple)) or val is None:
+            attrs[key] = val
+        elif isinstance(val, np.ndarray) and val.ndim <= 1 and val.dtype.kind in 'biuf':
+            arrays[key] = val
+
+    write_opacity_store(filename_out, arrays, attrs)
+    logging.info('Converted %s to %s' % (filename_in, filename_out))
+
+    return filename_out
+
+
+def get_file_identity(filename):
+
+    # identify a source file by its path, size and modification time (cheaper than a checksum)
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_size, int(stat.st_mtime))
+
+
+class opacity_cache(object):
+
+    '''
+    Persistent, content addressed cache of opacity arrays.
+
+    Every entry is a binary opacity store named after a hash of all the inputs used to build it, so entries
+    never need to be invalidated: a change in any input gives a different key. The total size of the cache
+    folder is bounded by max_size (in bytes). The modification time of an entry is updated every time it is
+    used, and the least recently used entries are removed first.
+    '''
+
+    def __init__(self, path, max_size):
+
+        self.path = path
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                pass # created in the meantime by another process
+
+    def _update_hash(self, sha, item):
+
+        if isinstance(item, np.ndarray):
+            sha.update(item.dtype.str.encode('utf-8'))
+            sha.update(str(item.shape).encode('utf-8'))
+            sha.update(np.ascontiguousarray(item).tobytes())
+        elif isinstance(item, (list, tuple)):
+            sha.update(('%s%i' % (type(item).__name__, len(item))).encode('utf-8'))
+            for val in item:
+                self._update_hash(sha, val)
+        elif isinstance(item, dict):
+            for key in sorted(item.keys()):
+                self._update_hash(sha, key)
+                self._update_hash(sha, item[key])
+        else:
+            sha.update(repr(item).encode('utf-8'))
+
+    def get_key(self, *items):
+
+        sha = hashlib.sha1()
+        for item in items:
+            self._update_hash(sha, item)
+        return sha.hexdigest()
+
+    def get_filename(self, key):
+
+        return os.path.join(self.path, key + OPACITY_STORE_EXT)
+
+    def load(self, key):
+
+        # return the cached arrays (memory mapped), or None if the entry does not exist
+        filename = self.get_filename(key)
+        if not os.path.isfile(filename):
+            return None
+        try:
+            entry = read_opacity_store(filename)
+            os.utime(filename, None) # mark as recently used
+        except (IOError, OSError, ValueError):
+            logging.warning('Cannot read opacity cache entry %s' % filename)
+            return None
+        logging.info('Loaded opacity arrays from cache: %s' % filename)
+        return entry
+
+    def save(self, key, arrays, attrs=None):
+
+        # write to a temporary file first, so that other processes never see an incomplete entry
+        filename = self.get_filename(key)
+        tmp_filename = '%s.%i.tmp' % (filename, os.getpid())
+        try:
+            write_opacity_store(tmp_filename, arrays, attrs)
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError):
+            logging.warning('Cannot write opacity cache entry %s' % filename)
+            if os.path.isfile(tmp_filename):
+                os.remove(tmp_filename)
+            return
+        logging.info('Saved opacity arrays to cache: %s' % filename)
+        self.evict(keep=filename)
+
+    def evict(self, keep=None):
+
+        # remove the least recently used entries until the cache is smaller than max_size
+        entries = []
+        for filename in glob.glob(os.path.join(self.path, '*' + OPACITY_STORE_EXT)):
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+        entries.sort()
+
+        total_size = sum([entry[1] for entry in entries])
+        for mtime, size, filename in entries:
+            if total_size <= self.max_size:
+                break
+            if filename == keep:
+                continue
+            try:
+                os.remove(filename)
+                total_size -= size
+                logging.info('Removed opacity cache entry %s' % filename)
+            except OSError:
+                pass
+
+
+OPACITY_CATALOGUE_NAME = 'TauREx.catalogue'
+
+
+def get_file_checksum(filename, blocksize=2**24):
+
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def get_opacity_file_info(filename):
+
+    # return the catalogue entry of a cross section or ktable file, or None if the file is not an opacity file
+
+    try:
+        if is_opacity_store(filename):
+            opacity = read_opacity_store(filename) # only the axes are read, the opacities are memory mapped
+        else:
+            opacity, divisor = load_opacity_file(filename)
+    except Exception:
+        return None
+    if not isinstance(opacity, dict):
+        return None
+
+    if 'kcoeff' in opacity:
+        kind = 'ktable'
+        wno = np.asarray(opacity['bin_centers'])
+    elif 'xsecarr' in opacity and 'p' in opacity:
+        kind = 'xsec'
+        wno = np.asarray(opacity['wno'])
+    else:
+        return None
+
+    stat = os.stat(filename)
+    info = {'filename': os.path.basename(filename),
+            'molecule': os.path.basename(filename).split('.')[0].split('_')[0],
+            'kind': kind,
+            'store': is_opacity_store(filename),
+            't': np.asarray(opacity['t'], dtype=float).tolist(),
+            'p': np.asarray(opacity['p'], dtype=float).tolist(),
+            'wnmin': float(np.min(wno)),
+            'wnmax': float(np.max(wno)),
+            'nwno': len(wno),
+            'resolution': float((np.max(wno) - np.min(wno))/max(len(wno)-1, 1)),
+            'size': stat.st_size,
+            'mtime': int(stat.st_mtime),
+            'checksum': None}
+    return info
+
+
+def build_opacity_catalogue(path, checksum=True, catalogue=None):
+
+    # list all cross sections / ktables in path. Entries of an older catalogue are reused for the files
+    # that have not changed (same size and modification time)
+
+    old_entries = {}
+    if catalogue:
+        for entry in catalogue['files']:
+            old_entries[entry['filename']] = entry
+
+    entries = []
+    for basename in sorted(os.listdir(path)):
+        filename = os.path.join(path, basename)
+        if basename == OPACITY_CATALOGUE_NAME or basename.endswith('.tmp') or not os.path.isfile(filename):
+            continue
+        stat = os.stat(filename)
+        old = old_entries.get(basename)
+        if old and old['size'] == stat.st_size and old['mtime'] == int(stat.st_mtime):
+            entries.append(old)
+            continue
+        logging.info('Add %s to the opacity catalogue' % basename)
+        info = get_opacity_file_info(filename)
+        if info is None:
+            continue
+        if checksum:
+            info['checksum'] = get_file_checksum(filename)
+        entries.append(info)
+
+    return {'version': 1,
+            'path_mtime': os.stat(path).st_mtime,
+            'files': entries}
+
+
+def save_opacity_catalogue(path, catalogue):
+
+    # the catalogue is written to a temporary file and renamed, which changes the modification time of the
+    # folder. The new modification time is then stored in the catalogue, rewriting the file in place
+    # (this does not change the folder), so that the catalogue is not seen as stale because of itself
+    filename = os.path.join(path, OPACITY_CATALOGUE_NAME)
+    tmp_filename = '%s.%i.tmp' % (filename, os.getpid())
+    try:
+        with open(tmp_filename, 'w') as f:
+            json.dump(catalogue, f, indent=1)
+        os.rename(tmp_filename, filename)
+        catalogue['path_mtime'] = os.stat(path).st_mtime
+        with open(filename, 'r+') as f:
+            json.dump(catalogue, f, indent=1)
+            f.truncate()
+    except (IOError, OSError):
+        logging.warning('Cannot write the opacity catalogue %s' % filename)
+        if os.path.isfile(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def load_opacity_catalogue(path):
+
+    # load the catalogue of the opacity folder path. Return None if there is no catalogue.
+    # The catalogue is only read here, it is created and refreshed by tools/create_opacity_catalogue.py.
+    # Files added, removed or renamed change the modification time of the folder: in this case the catalogue
+    # is stale, and it is not used. The files themselves are only checked when their molecule is resolved
+    # (see get_catalogue_entries)
+
+    filename = os.path.join(path, OPACITY_CATALOGUE_NAME)
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'r') as f:
+            catalogue = json.load(f)
+    except (IOError, OSError, ValueError):
+        logging.warning('Cannot read the opacity catalogue %s' % filename)
+        return None
+
+    if catalogue.get('path_mtime') != os.stat(path).st_mtime:
+        logging.warning('The opacity catalogue %s is stale and it is not used. '
+                        'Refresh it with tools/create_opacity_catalogue.py' % filename)
+        return None
+
+    catalogue['path'] = path
+    catalogue['checked'] = {} # entries of the molecules resolved so far, by molecule (see get_catalogue_entries)
+
+    return catalogue
+
+
+def get_catalogue_entries(catalogue, mol_val):
+
+    # catalogue entries of a molecule (case insensitive), binary stores first. The first time a molecule is
+    # resolved, its files are checked against the catalogue (size and modification time). None if some of them
+    # have changed since the catalogue was created: the molecule is then resolved without the catalogue
+    molecule = mol_val.upper()
+    if not molecule in catalogue['checked']:
+        entries = [entry for entry in catalogue['files'] if entry['molecule'].upper() == molecule]
+        for entry in entries:
+            try:
+                stat = os.stat(os.path.join(catalogue['path'], entry['filename']))
+            except OSError:
+                stat = None
+            if stat is None or entry['size'] != stat.st_size or entry['mtime'] != int(stat.st_mtime):
+                logging.warning('%s has changed since the opacity catalogue of %s was created' %
+                                (entry['filename'], catalogue['path']))
+                entries = None
+                break
+        if entries is not None:
+            entries = [entry for entry in entries if entry['store']] + [entry for entry in entries if not entry['store']]
+        catalogue['checked'][molecule] = entries
+    return catalogue['checked'][molecule]
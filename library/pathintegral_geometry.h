@@ -0,0 +1,72 @@
+/*
+
+    TauREx v2 - Development version - DO NOT DISTRIBUTE
+
+    Geometry of the transmission path integral: layer thickness (dz) and path length of each
+    line of sight in each layer (dlarray).
+
+    The geometry only depends on the altitude profile and on the planet radius, so it is kept
+    between calls of path_integral and only recomputed when one of them changes (e.g. not when
+    only the abundances or the clouds are fitted).
+
+    Developers: Ingo Waldmann, Marco Rocchetto (University College London)
+
+ */
+
+#pragma once
+
+#include <cmath>
+#include <vector>
+#include <algorithm>
+
+struct PathGeometry {
+
+    int nlayers;
+    double planet_radius;
+    std::vector<double> z;
+    std::vector<double> dz;
+    std::vector<double> dlarray;
+
+    PathGeometry() : nlayers(0), planet_radius(0.) {}
+
+    // recompute dz and dlarray if the altitude profile or the planet radius have changed.
+    // Return true if the geometry has been recomputed
+    bool update(const int nlayers_new, const double * z_new, const double planet_radius_new) {
+
+        if (nlayers_new == nlayers && planet_radius_new == planet_radius &&
+            std::equal(z.begin(), z.end(), z_new)) {
+            return false;
+        }
+
+        nlayers = nlayers_new;
+        planet_radius = planet_radius_new;
+        z.assign(z_new, z_new + nlayers);
+        dz.resize(nlayers);
+        dlarray.resize(nlayers*nlayers);
+
+        //dz array
+        for (int j=0; j<(nlayers); j++) {
+            if ((j+1) == nlayers) {
+                dz[j] = z[j] - z[j-1];
+            } else {
+                dz[j] = z[j+1] - z[j];
+            }
+        }
+
+        // dl array
+        int count = 0;
+        double p;
+        for (int j=0; j<(nlayers); j++) {
+            for (int k=0; k < (nlayers - j); k++) {
+                p = pow((planet_radius+dz[0]/2.+z[j]),2);
+                if (k == 0) {
+                    dlarray[count] = 2.0 * sqrt(pow((planet_radius + dz[0]/2. + z[j] + dz[j]/2.),2) - p);
+                } else {
+                    dlarray[count] = 2.0 * (sqrt(pow((planet_radius + dz[0]/2. + z[k+j] + dz[j+k]/2.),2) - p) -  sqrt(pow((planet_radius + dz[0]/2. + z[k+j-1] + dz[j+k-1]/2.  ),2) - p));
+                }
+                count += 1;
+            }
+        }
+        return true;
+    }
+};
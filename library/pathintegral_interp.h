@@ -0,0 +1,80 @@
+/*
+
+    TauREx v2 - Development version - DO NOT DISTRIBUTE
+
+    Temperature interpolation of the opacities (cross sections, k-tables, cia) to the temperature profile.
+
+    For each layer, the bracket of the temperature grid containing the layer temperature is found
+    once by binary search, together with the interpolation weight. The opacities are then
+    interpolated in a single (parallel) pass over gases/pairs, layers and wavenumbers.
+    Temperatures outside the grid are set to the first (last) temperature of the grid.
+
+    Developers: Ingo Waldmann, Marco Rocchetto (University College London)
+
+ */
+
+#pragma once
+
+#include <cmath>
+#include <vector>
+#include <algorithm>
+
+struct TemperatureWeights {
+
+    std::vector<int> t_lo;      // lower temperature index of the bracket, for each layer
+    std::vector<int> t_hi;      // upper temperature index of the bracket, for each layer
+    std::vector<double> weight; // weight of the upper temperature, for each layer
+
+    // log_temperature: interpolate linearly in log10(T) (k-tables) instead of T
+    void update(const int nlayers, const double * temperature, const double * temp_grid, const int ntemp,
+                const bool log_temperature) {
+
+        t_lo.resize(nlayers);
+        t_hi.resize(nlayers);
+        weight.resize(nlayers);
+
+        for (int j=0; j<nlayers; j++) {
+            // first temperature of the grid higher than the layer temperature
+            int t = std::upper_bound(temp_grid, temp_grid + ntemp, temperature[j]) - temp_grid;
+            if (t == 0) { // temperature lower than grid
+                t_lo[j] = 0;
+                t_hi[j] = 0;
+                weight[j] = 0.;
+            } else if (t == ntemp) { // temperature higher than (or equal to the last temperature of) the grid
+                t_lo[j] = ntemp-1;
+                t_hi[j] = ntemp-1;
+                weight[j] = 0.;
+            } else {
+                t_lo[j] = t-1;
+                t_hi[j] = t;
+                if (log_temperature) {
+                    weight[j] = (log10(temperature[j])-log10(temp_grid[t-1]))/(log10(temp_grid[t])-log10(temp_grid[t-1]));
+                } else {
+                    weight[j] = (temperature[j]-temp_grid[t-1])/(temp_grid[t]-temp_grid[t-1]);
+                }
+            }
+        }
+    }
+};
+
+// interpolate array [nblocks, (nlayers,) ntemp, n] to out [nblocks, nlayers, n], where n is the number of
+// wavenumbers (times the number of gauss points for k-tables). If the array does not depend on the layer
+// (cia), the same temperature grid is used for all layers.
+inline void interpolate_temperature(const double * array, const int nblocks, const int nlayers, const int ntemp,
+                                    const int n, const bool layer_dependent, const TemperatureWeights & weights,
+                                    double * out) {
+
+    #pragma omp parallel for collapse(2)
+    for (int l=0; l<nblocks; l++) {
+        for (int j=0; j<nlayers; j++) {
+            const double * block = array + (long) n * ntemp * (layer_dependent ? (j + l*nlayers) : l);
+            const double * lo = block + (long) n * weights.t_lo[j];
+            const double * hi = block + (long) n * weights.t_hi[j];
+            const double x = weights.weight[j];
+            double * dest = out + (long) n * (j + l*nlayers);
+            for (int i=0; i<n; i++) {
+                dest[i] = lo[i] + (hi[i]-lo[i])*x;
+            }
+        }
+    }
+}
@@ -0,0 +1,142 @@
+'''
+Tests of the binning operator (library/library_general.py) against the binning loops it replaces.
+
+Run from the TauREx folder:
+
+python -m pytest tests/test_binning_operator.py
+
+'''
+
+import os, sys, warnings
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library'))
+
+import numpy as np
+
+from library_general import get_specbingrid, binning_operator, get_binning_operator
+
+
+def loop_binning(spectrum, bingrid_idx, nbins):
+
+    # binning used before the binning operator (fitting, output, binspectrum): mean of the points in each bin
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # mean of empty bins
+        return np.asarray([spectrum[bingrid_idx == i].mean() for i in range(1, nbins+1)])
+
+
+def test_from_bingrid_idx_matches_loop():
+
+    rng = np.random.RandomState(1)
+    wlgrid = np.sort(rng.uniform(0.5, 5., 300))[::-1] # model grid, decreasing in wavelength
+    obs_wlgrid = np.linspace(1., 4., 40)
+    spectrum = rng.rand(len(wlgrid))
+
+    bingrid, bingrid_idx = get_specbingrid(obs_wlgrid, wlgrid)
+    operator = binning_operator.from_bingrid_idx(bingrid_idx, len(obs_wlgrid))
+
+    np.testing.assert_allclose(operator.apply(spectrum), loop_binning(spectrum, bingrid_idx, len(obs_wlgrid)),
+                               rtol=1e-12)
+
+
+def test_from_bingrid_idx_empty_bins():
+
+    # bins with widths, with a gap between two instruments and bins finer than the model grid
+    wlgrid = np.linspace(5., 0.5, 60)
+    obs_wlgrid = np.concatenate((np.linspace(1., 1.5, 20), np.linspace(3., 4., 5)))
+    binwidths = np.concatenate((np.full(20, 0.5/19), np.full(5, 0.25)))
+    spectrum = np.random.RandomState(2).rand(len(wlgrid))
+
+    bingrid, bingrid_idx = get_specbingrid(obs_wlgrid, wlgrid, binwidths)
+    operator = binning_operator.from_bingrid_idx(bingrid_idx, len(obs_wlgrid))
+    binned = operator.apply(spectrum)
+    expected = loop_binning(spectrum, bingrid_idx, len(obs_wlgrid))
+
+    assert np.any(np.isnan(expected)) # some bins are empty
+    np.testing.assert_array_equal(np.isnan(binned), np.isnan(expected))
+    np.testing.assert_allclose(binned, expected, rtol=1e-12)
+
+    # points in the gap are outside all the bins
+    assert np.any(operator.bin_idx < 0)
+    np.testing.assert_array_equal(operator.bin_idx < 0, ~((bingrid_idx >= 1) & (bingrid_idx <= len(obs_wlgrid))))
+
+
+def test_bin_idx_form():
+
+    # per point form used by the transmission kernel (set_bins): same binning as apply
+    rng = np.random.RandomState(3)
+    wlgrid = np.linspace(5., 0.5, 200)
+    obs_wlgrid = np.linspace(1., 4., 30)
+    spectrum = rng.rand(len(wlgrid))
+
+    bingrid, bingrid_idx = get_specbingrid(obs_wlgrid, wlgrid)
+    operator = binning_operator.from_bingrid_idx(bingrid_idx, len(obs_wlgrid))
+
+    inside = operator.bin_idx >= 0
+    binned = np.bincount(operator.bin_idx[inside], weights=spectrum[inside]*operator.bin_weight[inside],
+                         minlength=operator.nbins)
+    np.testing.assert_allclose(binned, operator.apply(spectrum), rtol=1e-12)
+
+
+def test_apply_batch():
+
+    rng = np.random.RandomState(4)
+    wlgrid = np.linspace(5., 0.5, 100)
+    obs_wlgrid = np.linspace(1., 4., 10)
+    spectra = rng.rand(7, len(wlgrid))
+
+    operator = get_binning_operator(obs_wlgrid, wlgrid)
+    binned = operator.apply(spectra)
+
+    assert binned.shape == (7, 10)
+    for i in range(7):
+        np.testing.assert_array_equal(binned[i], operator.apply(spectra[i]))
+
+
+def test_from_edges_partial_overlaps():
+
+    # cells of the points: [0.5, 1.5], [1.5, 2.5], [2.5, 3.5], [3.5, 4.5]
+    grid = np.array([1., 2., 3., 4.])
+    spectrum = np.array([1., 2., 3., 4.])
+    bin_low = np.array([1., 2., 10.])
+    bin_high = np.array([2., 3.5, 11.])
+
+    operator = binning_operator.from_edges(grid, bin_low, bin_high)
+    binned = operator.apply(spectrum)
+
+    np.testing.assert_allclose(binned[:2], [1.5, (2.*0.5 + 3.*1.)/1.5], rtol=1e-12)
+    assert np.isnan(binned[2]) # no point in the bin
+
+    # point 2. contributes to two bins
+    assert operator.bin_idx is None
+
+
+def test_from_edges_weights_sum_to_one():
+
+    rng = np.random.RandomState(5)
+    grid = np.sort(rng.uniform(1., 10., 500))
+    centers = np.linspace(2., 9., 25)
+    widths = rng.uniform(0.05, 0.5, 25)
+
+    operator = binning_operator.from_edges(grid, centers-widths/2., centers+widths/2.)
+    sums = np.bincount(np.repeat(np.arange(operator.nbins), operator.bin_count), weights=operator.weights,
+                       minlength=operator.nbins)
+
+    np.testing.assert_allclose(sums[operator.nonempty], 1., rtol=1e-12)
+    assert np.all(operator.weights > 0)
+
+    # a constant spectrum is unchanged
+    np.testing.assert_allclose(operator.apply(np.full(len(grid), 3.)), 3., rtol=1e-12)
+
+
+def test_from_edges_decreasing_grid():
+
+    rng = np.random.RandomState(6)
+    grid = np.sort(rng.uniform(1., 10., 300))
+    spectrum = rng.rand(len(grid))
+    centers = np.linspace(2., 9., 20)
+    widths = np.full(20, 0.3)
+
+    increasing = binning_operator.from_edges(grid, centers-widths/2., centers+widths/2.)
+    decreasing = binning_operator.from_edges(grid[::-1], centers-widths/2., centers+widths/2.)
+
+    np.testing.assert_allclose(decreasing.apply(spectrum[::-1]), increasing.apply(spectrum), rtol=1e-12)
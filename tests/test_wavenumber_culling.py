@@ -0,0 +1,166 @@
+'''
+Test of the wavenumber culling (Input->wavenumber_culling): the transmission spectrum binned to the observations
+on the culled `obs_spectrum` grid is the same as the binned spectrum of the full grid (cross sections). With
+ktables the model interpolated to the observed wavenumbers, as used by the fit, is unchanged.
+
+Synthetic cross sections, ktables, cia tables and an observed spectrum with a gap between two instruments are
+written to a temporary folder. The transmission kernels are compiled in ./library if needed (g++).
+
+Run from the TauREx folder:
+
+python -m pytest tests/test_wavenumber_culling.py
+
+'''
+
+import os, sys, pickle, subprocess
+try:
+    from shutil import which # python 3
+except ImportError:
+    from distutils.spawn import find_executable as which # python 2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'classes'))
+sys.path.append(os.path.join(ROOT, 'library'))
+
+import numpy as np
+import pytest
+
+from parameters import *
+from data import *
+from atmosphere import *
+from transmission import *
+
+
+KERNELS = ['ctypes_pathintegral_transmission_xsec', 'ctypes_pathintegral_transmission_ktab']
+
+
+@pytest.fixture(scope='module')
+def kernels():
+
+    # compile the transmission kernels if they are missing or older than their sources
+    os.chdir(ROOT)
+    for name in KERNELS:
+        source = os.path.join('library', name + '.cpp')
+        library = os.path.join('library', name + '.so')
+        headers = [os.path.join('library', header) for header in os.listdir('library') if header.endswith('.h')]
+        if os.path.isfile(library) and \
+                os.path.getmtime(library) >= max([os.path.getmtime(filename) for filename in [source] + headers]):
+            continue
+        if not which('g++'):
+            pytest.skip('g++ is needed to compile the transmission kernels')
+        subprocess.check_call(['g++', '-fPIC', '-shared', '-O3', '-o', library, source])
+
+
+def write_inputs(path):
+
+    rng = np.random.RandomState(1)
+    for folder in ['xsec', 'ktab', 'cia']:
+        os.makedirs(os.path.join(path, folder))
+
+    t = np.array([1000., 1500., 2000.])
+    p = np.logspace(-5, 1, 8) # bar
+
+    # cross sections (cm^2) and ktables (4 gauss points), on 2000 wavenumbers between 2000 and 12000 cm-1
+    wno = np.linspace(2000., 12000., 2000)
+    with open(os.path.join(path, 'xsec', 'H2O_T1000-2000.TauREx.pickle'), 'wb') as f:
+        pickle.dump({'xsecarr': rng.rand(len(p), len(t), len(wno))*1e-21, 'p': p, 't': t, 'wno': wno}, f, protocol=2)
+
+    ngauss = 4
+    bin_edges = np.linspace(2000., 12000., 501)
+    bin_centers = (bin_edges[1:] + bin_edges[:-1])/2.
+    samples, weights = np.polynomial.legendre.leggauss(ngauss)
+    with open(os.path.join(path, 'ktab', 'H2O.ktab.pickle'), 'wb') as f:
+        pickle.dump({'kcoeff': np.sort(rng.rand(len(p), len(t), len(bin_centers), ngauss), axis=-1)*1e-21,
+                     'p': p, 't': t, 'method': 'synthetic', 'ngauss': ngauss,
+                     'samples': (samples+1.)/2., 'weights': weights/2.,
+                     'bin_centers': bin_centers, 'bin_edges': bin_edges,
+                     'wnrange': [2000., 12000.], 'wlrange': [10000./12000., 10000./2000.]}, f, protocol=2)
+
+    # cia tables (cm^5)
+    cia_wno = np.linspace(1000., 15000., 500)
+    for pair in ['H2-H2', 'H2-HE']:
+        with open(os.path.join(path, 'cia', '%s.db' % pair), 'wb') as f:
+            pickle.dump({'t': t, 'wno': cia_wno, 'xsecarr': rng.rand(len(t), len(cia_wno))*1e-45}, f, protocol=2)
+
+    # mie refractive indices (not used, but always loaded)
+    np.savetxt(os.path.join(path, 'mie.dat'), np.array([[0.5, 1.5, 0.01], [20., 1.5, 0.01]]), header='mie')
+
+    # observed spectrum (wavelength, depth, error, bin width): two instruments with a gap between 1.7 and 3 micron,
+    # and a few isolated bins in the gap, narrower than the spacing of the ktables
+    wlgrid = np.concatenate((np.linspace(1.1, 1.65, 25), np.array([2.0, 2.3, 2.6]), np.linspace(3.05, 3.95, 10)))
+    binwidths = np.concatenate((np.full(25, 0.55/24), np.full(3, 0.004), np.full(10, 0.1)))
+    spectrum = np.column_stack((wlgrid, np.full(len(wlgrid), 0.01), np.full(len(wlgrid), 1e-5), binwidths))
+    np.savetxt(os.path.join(path, 'spectrum.dat'), spectrum)
+
+
+def write_parfile(path, opacity_method, culling):
+
+    parfile = os.path.join(path, '%s_%s.par' % (opacity_method, culling))
+    with open(parfile, 'w') as f:
+        f.write('\n'.join(['[General]',
+                           'type = transmission',
+                           '[Input]',
+                           'opacity_method = %s' % opacity_method,
+                           'xsec_path = %s' % os.path.join(path, 'xsec'),
+                           'ktab_path = %s' % os.path.join(path, 'ktab'),
+                           'cia_path = %s' % os.path.join(path, 'cia'),
+                           'mie_path = %s' % os.path.join(path, 'mie.dat'),
+                           'spectrum_file = %s' % os.path.join(path, 'spectrum.dat'),
+                           'opacity_cache_path = None',
+                           'prefetch_data = False',
+                           'wavenumber_culling = %s' % culling,
+                           '[Output]',
+                           'path = %s' % os.path.join(path, 'output'),
+                           '[Atmosphere]',
+                           'nlayers = 20',
+                           'tp_type = isothermal',
+                           'tp_iso_temp = 1400',
+                           'active_gases = H2O',
+                           'active_gases_mixratios = 1e-4',
+                           'cia_pairs = H2-H2, H2-He',
+                           'rayleigh = True',
+                           'cia = True',
+                           'clouds = False',
+                           '']))
+    return parfile
+
+
+def get_forward_model(path, opacity_method, culling):
+
+    params = parameters(write_parfile(path, opacity_method, culling), mode='retrieval', mpi=False)
+    return transmission(atmosphere(data(params)))
+
+
+@pytest.mark.parametrize('opacity_method', ['xsec_sampled', 'ktables'])
+def test_culled_spectrum(kernels, tmpdir, opacity_method):
+
+    path = str(tmpdir)
+    write_inputs(path)
+
+    full = get_forward_model(path, opacity_method, False)
+    culled = get_forward_model(path, opacity_method, True)
+    model_full = full.model()
+
+    if opacity_method == 'ktables':
+
+        # the ktables fit interpolates the model to the observed wavenumbers (fitting.chisq_trans): the grid is
+        # not culled, and the interpolated model is unchanged
+        obs_wngrid = full.atmosphere.data.obs_wngrid
+        np.testing.assert_array_equal(np.interp(obs_wngrid, culled.atmosphere.int_wngrid, culled.model()),
+                                      np.interp(obs_wngrid, full.atmosphere.int_wngrid, model_full))
+        return
+
+    # the gap between the instruments is removed
+    inside = full.atmosphere.int_binning.bin_idx >= 0
+    assert culled.atmosphere.int_nwngrid < full.atmosphere.int_nwngrid
+    np.testing.assert_array_equal(culled.atmosphere.int_wngrid, full.atmosphere.int_wngrid[inside])
+
+    # binning of the full grid: mean of the model in each bin
+    bingrididx = np.asarray(full.atmosphere.int_bingrididx)
+    expected = np.asarray([model_full[bingrididx == i].mean() for i in range(1, full.atmosphere.int_nbingrid+1)])
+    assert not np.any(np.isnan(expected))
+
+    binned, model_culled = culled.model_binned(return_full=True)
+    np.testing.assert_allclose(binned, expected, rtol=1e-12)
+    np.testing.assert_allclose(full.model_binned(), expected, rtol=1e-12)
+    np.testing.assert_array_equal(model_culled, model_full[inside])
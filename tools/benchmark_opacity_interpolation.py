@@ -0,0 +1,71 @@
+'''
+Benchmark the interpolation of the opacity arrays to the atmospheric pressure profile
+(atmosphere.get_sigma_array).
+
+Compare the original element by element np.interp loop with the vectorised interpolation
+(get_interp_bracket / interp_bracket in library_general) on a synthetic cross section,
+and check that the two give identical results.
+
+Usage:
+
+python benchmark_opacity_interpolation.py -l 'nlayers' [default 100]
+                                          -p 'npressures' [default 22]
+                                          -t 'ntemperatures' [default 20]
+                                          -w 'nwavenumbers' [default 2000]
+
+'''
+
+import sys, os, argparse, time
+
+sys.path.append('../library')
+sys.path.append('./library')
+
+import numpy as np
+
+from library_general import get_interp_bracket, interp_bracket
+
+
+def interp_loop(pressure_profile_bar, p, sigma_in_cut):
+    # original implementation (atmosphere.get_sigma_array, single molecule)
+    sigma_array = np.zeros((len(pressure_profile_bar), sigma_in_cut.shape[1], sigma_in_cut.shape[2]))
+    for pressure_idx, pressure_val in enumerate(pressure_profile_bar):
+        for temperature_idx in range(sigma_in_cut.shape[1]):
+            for wno_idx in range(sigma_in_cut.shape[2]):
+                sigma_array[pressure_idx, temperature_idx, wno_idx] = \
+                    np.interp(pressure_val, p, sigma_in_cut[:,temperature_idx,wno_idx])
+    return sigma_array
+
+
+def interp_vectorised(pressure_profile_bar, p, sigma_in_cut):
+    sigma_array = np.zeros((len(pressure_profile_bar), sigma_in_cut.shape[1], sigma_in_cut.shape[2]))
+    for pressure_idx, pressure_val in enumerate(pressure_profile_bar):
+        interp_bracket(sigma_in_cut, get_interp_bracket(pressure_val, p), out=sigma_array[pressure_idx])
+    return sigma_array
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-l', '--nlayers', dest='nlayers', type=int, default=100)
+parser.add_argument('-p', '--npressures', dest='npressures', type=int, default=22)
+parser.add_argument('-t', '--ntemperatures', dest='ntemperatures', type=int, default=20)
+parser.add_argument('-w', '--nwavenumbers', dest='nwavenumbers', type=int, default=2000)
+options = parser.parse_args()
+
+p = np.logspace(-5, 2, options.npressures)
+sigma_in_cut = np.random.random((options.npressures, options.ntemperatures, options.nwavenumbers))**4 * 1e-24
+pressure_profile_bar = np.logspace(1, -6, options.nlayers)
+
+print('Interpolating %i x %i x %i cross section to %i layers' % (options.npressures, options.ntemperatures,
+                                                                options.nwavenumbers, options.nlayers))
+
+t0 = time.time()
+sigma_vectorised = interp_vectorised(pressure_profile_bar, p, sigma_in_cut)
+time_vectorised = time.time() - t0
+print('Vectorised interpolation: %.4f s' % time_vectorised)
+
+t0 = time.time()
+sigma_loop = interp_loop(pressure_profile_bar, p, sigma_in_cut)
+time_loop = time.time() - t0
+print('np.interp loop: %.4f s' % time_loop)
+
+print('Speedup: %.1fx' % (time_loop/time_vectorised))
+print('Identical results: %s' % np.array_equal(sigma_loop, sigma_vectorised))
@@ -0,0 +1,83 @@
+'''
+Benchmark the two forms of the transmission path integral (cross sections):
+
+ - loop: optical depths integrated along each line of sight in the c++ kernel
+ - matrix: extinction of each layer computed in the c++ kernel, optical depths of all the lines
+           of sight obtained with one triangular matrix product (BLAS)
+
+The forward model defined in the parameter file is computed ncalls times with each kernel, and the
+two spectra are compared. The loop kernel is also timed when only the planet radius changes between
+calls (extinction of the layers reused, see transmission.get_extinction). Run from the TauREx folder (the c++ libraries are loaded from ./library,
+compile them first, e.g. with compile_cpp = True).
+
+Usage:
+
+python tools/benchmark_transmission_kernel.py -p 'parameter_file' [default Parfiles/default.par]
+                                              -n 'ncalls' [default 100]
+                                              --nthreads 'nthreads' [default 1]
+
+'''
+
+import sys, os, argparse, time
+
+sys.path.append('./classes')
+sys.path.append('./library')
+
+import numpy as np
+
+from parameters import *
+from data import *
+from atmosphere import *
+from transmission import *
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-p', '--parfile', dest='param_filename', default='Parfiles/default.par')
+parser.add_argument('-n', '--ncalls', dest='ncalls', type=int, default=100)
+parser.add_argument('--nthreads', dest='nthreads', type=int, default=1)
+options = parser.parse_args()
+
+params = parameters(options.param_filename, mpi=False)
+params.gen_type = 'transmission'
+if params.in_opacity_method in ['ktab', 'ktable', 'ktables']:
+    print('The matrix form of the path integral is only available for cross sections')
+    exit()
+
+dataob = data(params)
+atmosphereob = atmosphere(dataob, nthreads=options.nthreads)
+
+print('Transmission model: %i layers, %i wavenumbers, %i active gases' % (atmosphereob.nlayers,
+                                                                          atmosphereob.int_nwngrid,
+                                                                          atmosphereob.nactivegases))
+
+spectra = {}
+times = {}
+for kernel in ['loop', 'matrix']:
+    params.gen_transmission_kernel = kernel
+    fmob = transmission(atmosphereob)
+    spectra[kernel] = fmob.model() # first call sets up the kernel context
+    t0 = time.time()
+    for i in range(options.ncalls):
+        fmob.model()
+    times[kernel] = (time.time() - t0)/options.ncalls
+    print('%s kernel: %.3f ms per call' % (kernel, times[kernel]*1e3))
+    fmob.free_kernel_context()
+
+# radius steps: the altitude profile is updated, the extinction of the layers is unchanged
+params.gen_transmission_kernel = 'loop'
+fmob = transmission(atmosphereob)
+planet_radius = atmosphereob.planet_radius
+fmob.model()
+t0 = time.time()
+for i in range(options.ncalls):
+    atmosphereob.planet_radius = planet_radius*(1. + 1e-3*(i+1))
+    atmosphereob.set_altitude_gravity_scaleheight_profile()
+    fmob.model()
+times['radius'] = (time.time() - t0)/options.ncalls
+print('loop kernel, radius steps: %.3f ms per call' % (times['radius']*1e3))
+atmosphereob.planet_radius = planet_radius
+atmosphereob.set_altitude_gravity_scaleheight_profile()
+fmob.free_kernel_context()
+
+print('Speedup: %.2fx' % (times['loop']/times['matrix']))
+print('Max relative difference: %.2e' % np.max(np.abs(spectra['matrix']/spectra['loop'] - 1.)))
@@ -10,6 +10,10 @@ import csv
 from matplotlib import cm
 from matplotlib import rc
 import matplotlib as mpl
+import sys
+sys.path.append('../library')
+sys.path.append('./library')
+from library_general import get_binning_operator
 
 #some global matplotlib vars
 mpl.rcParams['axes.linewidth'] = 1 #set the value globally
@@ -192,43 +196,12 @@ class bin_spectrum(object):
             
         return lam, dlam
     
-    def get_specbingrid(self,wavegrid, specgrid, binwidths=None):
-        #function calculating the bin boundaries for the data
-        #this is used to bin the internal spectrum to the data in fitting module
-        if not isinstance(binwidths, (np.ndarray, np.generic)):
-            bingrid =[]
-            bingrid.append(wavegrid[0]- (wavegrid[1]-wavegrid[0])/2.0) #first bin edge
-            for i in range(len(wavegrid)-1):
-                bingrid.append(wavegrid[i]+(wavegrid[i+1]-wavegrid[i])/2.0)
-            bingrid.append((wavegrid[-1]-wavegrid[-2])/2.0 + wavegrid[-1]) #last bin edge
-            bingrid_idx = np.digitize(specgrid,bingrid) #getting the specgrid indexes for bins
-        else:
-            bingrid = []
-            for i in range(len(wavegrid)):
-                bingrid.append(wavegrid[i]-binwidths[i]/2.)
-                bingrid.append(wavegrid[i]+binwidths[i]/2.)
-    
-            # build bin grid index array (an index for each model datapoint
-            bingrid_idx = np.empty(len(specgrid))
-    #         print 'BLEEE ',len(specgrid)
-            bingrid_idx[:] = np.NaN
-            for i in range(len(specgrid)):
-                for j in range(len(wavegrid)):
-                    if specgrid[i] >= (wavegrid[j]-binwidths[j]/2.) and specgrid[i] < (wavegrid[j]+binwidths[j]/2.):
-                        bingrid_idx[i] = j+1
-                        break
-        return bingrid, bingrid_idx
-
-
     def bin_spectrum(self,spectrum, wlgrid,dlam_grid=None):
-        sp_wlgrid = spectrum[:,0]
-        sp_bingrid, sp_bingrididx = self.get_specbingrid(wlgrid, sp_wlgrid,dlam_grid)
-        sp_nbingrid = len(wlgrid)
-        model_binned = [spectrum[:,1][sp_bingrididx == i].mean() for i in xrange(1, sp_nbingrid+1)]
-        
+        binning = get_binning_operator(wlgrid, spectrum[:,0], dlam_grid)
+
         out = np.zeros((len(wlgrid),2))
         out[:,0] = wlgrid
-        out[:,1] = model_binned
+        out[:,1] = binning.apply(spectrum[:,1])
         return out
 
 
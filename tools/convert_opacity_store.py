@@ -0,0 +1,81 @@
+'''
+Convert pickled cross sections (.TauREx.pickle, including the high resolution
+files of the form H2O_T600.TauREx.pickle) and pickled ktables to the binary
+opacity store format (.TauREx.mmap).
+
+The binary store is memory mapped by the data class, so that only the temperature
+and wavenumber ranges actually needed are read from disk. Opacities are saved
+in m^2, so no conversion is needed at load time.
+
+The output files are written next to the input files (or in the output folder,
+if given), replacing the extension with .TauREx.mmap. The original pickles are
+left untouched. If both are present, the data class uses the binary store.
+
+Usage:
+
+python convert_opacity_store.py -i 'input_files' (comma separated, or a folder)
+                                -o 'output_folder' [optional]
+                                --overwrite [optional]
+
+'''
+
+import sys, os, argparse, glob
+
+sys.path.append('../library')
+sys.path.append('./library')
+
+from library_opacity import *
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', '--input',
+                  dest='input',
+                  default=None,
+)
+parser.add_argument('-o', '--output_folder',
+                  dest='output_folder',
+                  default=None,
+)
+parser.add_argument('--overwrite',
+                  dest='overwrite',
+                  action='store_true',
+                  default=False,
+)
+options = parser.parse_args()
+
+if not options.input:
+    print('Wrong input. Retry...')
+    exit()
+
+if os.path.isdir(options.input):
+    filenames = sorted([filename for filename in glob.glob(os.path.join(options.input, '*'))
+                        if os.path.isfile(filename) and not filename.endswith(OPACITY_STORE_EXT)])
+else:
+    filenames = options.input.split(',')
+
+for filename in filenames:
+
+    if is_opacity_store(filename):
+        print('%s is already a binary opacity store. Skip.' % filename)
+        continue
+
+    basename = os.path.basename(filename)
+    if basename.endswith('.TauREx.pickle'):
+        basename = basename[:-len('.TauREx.pickle')]
+    else:
+        basename = os.path.splitext(basename)[0]
+
+    if options.output_folder:
+        output_filename = os.path.join(options.output_folder, basename + OPACITY_STORE_EXT)
+    else:
+        output_filename = os.path.join(os.path.dirname(filename), basename + OPACITY_STORE_EXT)
+
+    if os.path.isfile(output_filename) and not options.overwrite:
+        print('%s already exists. Use --overwrite to replace it.' % output_filename)
+        continue
+
+    print('Converting %s to %s' % (filename, output_filename))
+    try:
+        convert_opacity_to_store(filename, output_filename)
+    except Exception as e:
+        print('Cannot convert %s: %s' % (filename, e))
@@ -0,0 +1,62 @@
+'''
+Convert a library of ASCII Phoenix stellar spectra (*.fmt) into one indexed binary file
+(TauREx.starlib, opacity store format), saved in the same folder.
+
+The spectra are sorted by temperature and stored as contiguous blocks, with an index
+temperature -> offset, length. The data class (load_star_SED) uses the binary library when
+present in star_path, reading only the selected spectrum instead of parsing the ASCII file.
+
+Usage:
+
+python convert_star_library.py -p 'star_path' [default ../Input/star_spectra]
+                               -o 'output_file' [optional, default star_path/TauREx.starlib]
+                               --overwrite [optional]
+
+'''
+
+import sys, os, argparse
+
+sys.path.append('../library')
+sys.path.append('./library')
+
+from library_general import insensitive_glob
+from library_emission import *
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-p', '--star_path',
+                  dest='star_path',
+                  default='../Input/star_spectra',
+)
+parser.add_argument('-o', '--output_file',
+                  dest='output_file',
+                  default=None,
+)
+parser.add_argument('--overwrite',
+                  dest='overwrite',
+                  action='store_true',
+                  default=False,
+)
+options = parser.parse_args()
+
+filenames = insensitive_glob(os.path.join(options.star_path, '*.fmt'))
+if len(filenames) == 0:
+    print('No Phoenix spectra (*.fmt) found in %s' % options.star_path)
+    exit()
+
+if options.output_file:
+    output_filename = options.output_file
+else:
+    output_filename = os.path.join(options.star_path, STAR_LIBRARY_NAME)
+
+if os.path.isfile(output_filename) and not options.overwrite:
+    print('%s already exists. Use --overwrite to replace it.' % output_filename)
+    exit()
+
+temperatures = [get_phoenix_temperature(filename) for filename in filenames]
+if len(set(temperatures)) != len(temperatures):
+    print('Warning: several spectra with the same temperature. The last one in alphabetical order is used.')
+
+print('Converting %i spectra (%.0f - %.0f K) to %s' % (len(set(temperatures)), min(temperatures),
+                                                      max(temperatures), output_filename))
+write_star_library(filenames, output_filename)
@@ -0,0 +1,85 @@
+'''
+Create the catalogue of a folder of cross sections or ktables (file TauREx.catalogue).
+
+The catalogue lists, for each file: molecule, temperatures, pressures, wavenumber range,
+number of points and resolution, size, modification time and md5 checksum.
+When the catalogue is present, the data class resolves all cross sections / ktables from it,
+without scanning the folder. The catalogue is not used when files have been added, removed or
+renamed, and the files modified since it was created are resolved by scanning the folder: run
+this script again to refresh it (only new or modified files are read again).
+
+Usage:
+
+python create_opacity_catalogue.py -p 'opacity_path'
+                                   --no_checksum [optional, skip md5 checksums]
+                                   --rebuild [optional, read again all files]
+                                   --verify [optional, check the md5 checksums of the catalogue]
+
+'''
+
+import sys, os, argparse, json
+
+sys.path.append('../library')
+sys.path.append('./library')
+
+from library_opacity import *
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-p', '--opacity_path',
+                  dest='opacity_path',
+                  default=None,
+)
+parser.add_argument('--no_checksum',
+                  dest='no_checksum',
+                  action='store_true',
+                  default=False,
+)
+parser.add_argument('--rebuild',
+                  dest='rebuild',
+                  action='store_true',
+                  default=False,
+)
+parser.add_argument('--verify',
+                  dest='verify',
+                  action='store_true',
+                  default=False,
+)
+options = parser.parse_args()
+
+if not options.opacity_path or not os.path.isdir(options.opacity_path):
+    print('Wrong input. Retry...')
+    exit()
+
+if options.verify:
+    catalogue = load_opacity_catalogue(options.opacity_path)
+    if catalogue is None:
+        print('No valid catalogue in %s' % options.opacity_path)
+        exit()
+    nfiles = 0
+    nerrors = 0
+    for molecule in sorted(set([entry['molecule'] for entry in catalogue['files']])):
+        entries = get_catalogue_entries(catalogue, molecule)
+        if entries is None:
+            print('Modified files: %s' % molecule)
+            nerrors += 1
+            continue
+        for entry in entries:
+            nfiles += 1
+            if entry['checksum'] is not None and \
+                    entry['checksum'] != get_file_checksum(os.path.join(options.opacity_path, entry['filename'])):
+                print('Wrong checksum: %s' % entry['filename'])
+                nerrors += 1
+    print('Catalogue of %s: %i files verified, %i errors' % (options.opacity_path, nfiles, nerrors))
+    exit()
+
+catalogue = None
+if not options.rebuild and os.path.isfile(os.path.join(options.opacity_path, OPACITY_CATALOGUE_NAME)):
+    with open(os.path.join(options.opacity_path, OPACITY_CATALOGUE_NAME), 'r') as f:
+        catalogue = json.load(f)
+
+catalogue = build_opacity_catalogue(options.opacity_path, checksum=not options.no_checksum, catalogue=catalogue)
+save_opacity_catalogue(options.opacity_path, catalogue)
+
+molecules = sorted(set([entry['molecule'] for entry in catalogue['files']]))
+print('Catalogue of %s: %i files, molecules: %s' % (options.opacity_path, len(catalogue['files']), ', '.join(molecules)))